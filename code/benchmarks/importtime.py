@@ -0,0 +1,88 @@
+# ============================================================================================
+# IMPORTTIME.PY
+# ============================================================================================
+#
+# Tiempo de importación de `gpxra` para un proceso de lote que solo usa `parse_gpx` y
+# `compute_metrics`, medido con `python -X importtime`. Falla (código de salida 1) si se
+# carga alguna dependencia pesada de la interfaz (folium, branca, altair, streamlit) o si
+# se supera el presupuesto de tiempo.
+#
+#   python benchmarks/importtime.py                 # desde code/
+#   python benchmarks/importtime.py --max-ms 600 --repeat 5
+#   python benchmarks/importtime.py --top 15        # módulos más lentos
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+import argparse
+import os
+import subprocess
+import sys
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Lo que hace un worker de lote típico
+STATEMENT = "import gpxra; gpxra.parse_gpx; gpxra.compute_metrics"
+
+# Módulos que no deben cargarse con STATEMENT
+FORBIDDEN = ("folium", "branca", "altair", "streamlit", "PIL")
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# IMPORT_PROFILE =============================================================================
+
+def import_profile(statement: str = STATEMENT):
+    """
+    Ejecuta `statement` en un intérprete nuevo con `-X importtime` y devuelve
+    `(total_us, modules)`, con `modules` = {nombre: (propio_us, acumulado_us)}.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=CODE_DIR, capture_output=True, text=True, check=True,
+    )
+    modules, total = {}, 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cum_us))
+        if not name[1:].startswith(" "):  # importación de primer nivel
+            total += int(cum_us)
+    return total, modules
+
+# MAIN =======================================================================================
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Tiempo de importación de gpxra (python -X importtime).")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones (se usa la mejor).")
+    parser.add_argument("--max-ms", type=float, default=None, help="Presupuesto de tiempo; por encima, falla.")
+    parser.add_argument("--top", type=int, default=10, help="Nº de módulos más lentos a mostrar.")
+    args = parser.parse_args(argv)
+
+    runs = [import_profile() for _ in range(max(1, args.repeat))]
+    total, modules = min(runs, key=lambda r: r[0])
+
+    print(f"{STATEMENT!r}: {total / 1000:.1f} ms (mejor de {len(runs)})")
+    slowest = sorted(modules.items(), key=lambda kv: kv[1][0], reverse=True)[:args.top]
+    for name, (self_us, cum_us) in slowest:
+        print(f"  {self_us / 1000:8.1f} ms  (acum. {cum_us / 1000:8.1f} ms)  {name}")
+
+    loaded = sorted({m.split(".")[0] for m in modules} & set(FORBIDDEN))
+    failed = False
+    if loaded:
+        print(f"ERROR: se han importado dependencias de la interfaz: {', '.join(loaded)}")
+        failed = True
+    if args.max_ms is not None and total / 1000 > args.max_ms:
+        print(f"ERROR: {total / 1000:.1f} ms supera el presupuesto de {args.max_ms:.0f} ms")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
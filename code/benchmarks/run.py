@@ -0,0 +1,235 @@
+# ============================================================================================
+# RUN.PY
+# ============================================================================================
+#
+# Benchmarks de las etapas de análisis sobre GPX sintéticos (ver synthetic.py). Para cada
+# caso y tamaño mide el tiempo (mejor de N repeticiones), el pico de memoria (tracemalloc)
+# y el tamaño de la salida que se envía al navegador (HTML del mapa, spec de las gráficas).
+# Los resultados se guardan en JSON para compararlos entre commits.
+#
+#   python benchmarks/run.py                                  # 1k, 10k y 100k puntos
+#   python benchmarks/run.py --sizes 1000 1000000 --cases parse_gpx compute_metrics
+#   python benchmarks/run.py --out antes.json
+#   python benchmarks/run.py --out despues.json --compare antes.json
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CODE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, CODE_DIR)
+
+import numpy as npy
+import pandas as pd
+from synthetic import synthetic_gpx
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), "gpxra-bench")
+
+# ============================================================================================
+# CASOS
+# ============================================================================================
+#
+# Cada caso recibe el contexto (`ctx`: bytes del GPX y resultados de etapas previas) y
+# devuelve `(función a medir, tamaño de la salida en bytes o None)`. Las entradas se
+# preparan fuera de la medición.
+
+def _case_parse_gpx(ctx):
+    from gpxra.io import parse_gpx
+    data = ctx['gpx_bytes']
+    return (lambda: parse_gpx(io.BytesIO(data))), None
+
+def _case_compute_metrics(ctx):
+    from gpxra.metrics import compute_metrics
+    return (lambda: compute_metrics(ctx['df'])), None
+
+def _case_make_splits(ctx):
+    from gpxra.metrics import make_splits
+    return (lambda: make_splits(ctx['df_proc'], 1)), None
+
+def _case_prepare_coords(ctx):
+    from gpxra.maps import prepare_coords
+    return (lambda: prepare_coords(ctx['df_proc'], 5000)), None
+
+def _case_draw_route(ctx):
+    from gpxra.maps import build_map, draw_route, prepare_coords
+    df_proc = ctx['df_proc']
+    coords = prepare_coords(df_proc, 5000)
+
+    def run():
+        m = build_map([df_proc['lat'].mean(), df_proc['lon'].mean()], "OpenStreetMap")
+        draw_route(m, coords, "Velocidad", "Min-Max (robusto)", 3, "#1f77b4")
+        return m.get_root().render()
+    return run, lambda html: len(html.encode("utf-8"))
+
+def _case_chart_frames(ctx):
+    from gpxra.charts import chart_frame, profile_chart
+    df_proc = ctx['df_proc']
+
+    def run():
+        return profile_chart(chart_frame(df_proc, grade_window=9, grade_clip=15)).to_json()
+    return run, lambda spec: len(spec.encode("utf-8"))
+
+CASES = {
+    'parse_gpx': _case_parse_gpx,
+    'compute_metrics': _case_compute_metrics,
+    'make_splits': _case_make_splits,
+    'prepare_coords': _case_prepare_coords,
+    'draw_route': _case_draw_route,
+    'chart_frames': _case_chart_frames,
+}
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# _GIT_COMMIT ================================================================================
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=CODE_DIR,
+                             capture_output=True, text=True, check=True)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=CODE_DIR,
+                               capture_output=True, text=True).stdout.strip()
+        return out.stdout.strip() + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+# MEASURE ====================================================================================
+
+def measure(fn, payload=None, repeat: int = 3) -> dict:
+    """
+    Tiempo (mejor de `repeat`), pico de memoria Python/NumPy (`tracemalloc`, en una
+    ejecución aparte para no distorsionar el tiempo) y tamaño de la salida.
+    """
+    times = []
+    result = None
+    for _ in range(max(1, repeat)):
+        gc.collect()
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    del result
+
+    gc.collect()
+    tracemalloc.start()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'seconds': min(times),
+        'seconds_mean': sum(times) / len(times),
+        'peak_mb': peak / 1024 ** 2,
+        'payload_bytes': payload(result) if payload else None,
+    }
+
+# RUN_BENCHMARKS =============================================================================
+
+def run_benchmarks(sizes, cases, repeat: int = 3, data_dir: str = DEFAULT_DATA_DIR, gen_kwargs=None,
+                   log=print) -> list[dict]:
+    """Ejecuta `cases` para cada tamaño de `sizes` y devuelve una fila por (caso, tamaño)."""
+    from gpxra.io import parse_gpx
+    from gpxra.metrics import compute_metrics
+
+    rows = []
+    for n in sizes:
+        path = synthetic_gpx(n, data_dir, **(gen_kwargs or {}))
+        with open(path, "rb") as f:
+            gpx_bytes = f.read()
+        ctx = {'gpx_bytes': gpx_bytes}
+        # entradas de las etapas posteriores (solo si algún caso las necesita)
+        if set(cases) - {'parse_gpx'}:
+            ctx['df'] = parse_gpx(io.BytesIO(gpx_bytes))
+            _, ctx['df_proc'], _ = compute_metrics(ctx['df'])
+        for name in cases:
+            fn, payload = CASES[name](ctx)
+            row = {'case': name, 'n_points': n, 'gpx_bytes': len(gpx_bytes), **measure(fn, payload, repeat)}
+            rows.append(row)
+            payload_txt = f" · salida {row['payload_bytes'] / 1024:,.0f} KB" if row['payload_bytes'] else ""
+            log(f"{name:<16} {n:>9,} pts  {row['seconds'] * 1000:10.1f} ms  "
+                f"pico {row['peak_mb']:8.1f} MB{payload_txt}")
+    return rows
+
+# COMPARE ====================================================================================
+
+def compare(rows, baseline_path: str, log=print) -> None:
+    """Muestra la relación (nuevo / base) de tiempo, memoria y salida por caso y tamaño."""
+    with open(baseline_path, encoding="utf-8") as f:
+        base = {(r['case'], r['n_points']): r for r in json.load(f)['results']}
+    log(f"\nComparación con {baseline_path} (nuevo / base; < 1 = mejor):")
+    for r in rows:
+        b = base.get((r['case'], r['n_points']))
+        if b is None:
+            continue
+        ratio = lambda k: f"{r[k] / b[k]:6.2f}×" if r.get(k) and b.get(k) else "     - "
+        log(f"{r['case']:<16} {r['n_points']:>9,} pts  tiempo {ratio('seconds')}  "
+            f"memoria {ratio('peak_mb')}  salida {ratio('payload_bytes')}")
+
+# MAIN =======================================================================================
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks de gpxra sobre GPX sintéticos.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Nº de puntos (p. ej. 1000 10000 100000 1000000 5000000).")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones por medida (se guarda la mejor).")
+    parser.add_argument("--hz", type=float, default=1.0, help="Frecuencia de muestreo del GPX sintético.")
+    parser.add_argument("--no-ext", action="store_true", help="Sin extensiones de HR/cadencia.")
+    parser.add_argument("--pauses", type=int, default=2)
+    parser.add_argument("--noise-m", type=float, default=3.0)
+    parser.add_argument("--segments", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="Caché de los GPX generados.")
+    parser.add_argument("--out", default=None,
+                        help="JSON de resultados (por defecto, benchmarks/results/<commit>.json).")
+    parser.add_argument("--compare", default=None, help="JSON de una ejecución anterior para comparar.")
+    args = parser.parse_args(argv)
+
+    gen_kwargs = dict(hz=args.hz, hr=not args.no_ext, cad=not args.no_ext, pauses=args.pauses,
+                      noise_m=args.noise_m, segments=args.segments, seed=args.seed)
+    commit = _git_commit()
+    rows = run_benchmarks(args.sizes, args.cases, args.repeat, args.data_dir, gen_kwargs)
+
+    out = args.out or os.path.join(BENCH_DIR, "results", f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({
+            'meta': {
+                'commit': commit,
+                'timestamp': datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                'python': platform.python_version(),
+                'numpy': npy.__version__,
+                'pandas': pd.__version__,
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'repeat': args.repeat,
+                'generator': gen_kwargs,
+            },
+            'results': rows,
+        }, f, indent=2)
+    print(f"\nResultados en {out}")
+
+    if args.compare:
+        compare(rows, args.compare)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+# ============================================================================================
+# SYNTHETIC.PY
+# ============================================================================================
+#
+# Generador determinista de ficheros GPX sintéticos para los benchmarks: mismo conjunto de
+# parámetros (y semilla) → mismos bytes. Escribe por bloques, así que sirve desde 1k hasta
+# varios millones de puntos sin disparar la memoria.
+#
+#   python benchmarks/synthetic.py 100000 ruta_100k.gpx --hz 1 --pauses 3 --noise-m 3
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import argparse
+import hashlib
+import os
+import numpy as npy
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+# Puntos por bloque al escribir
+_CHUNK = 100_000
+
+# Punto de partida (Bilbao) e inicio de la actividad
+_START_LAT, _START_LON = 43.2627, -2.9350
+_START_TIME = npy.datetime64("2026-05-01T08:00:00", "ms")
+
+_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<gpx version="1.1" creator="gpxra-benchmarks" '
+    'xmlns="http://www.topografix.com/GPX/1/1" '
+    'xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1">\n'
+    '<trk><name>synthetic</name><trkseg>\n'
+)
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# _PAUSE_MASK ================================================================================
+
+def _pause_mask(n_points: int, pauses: int, pause_points: int) -> npy.ndarray:
+    """Puntos parados: `pauses` rachas de `pause_points` repartidas uniformemente."""
+    stopped = npy.zeros(n_points, dtype=bool)
+    for k in range(1, pauses + 1):
+        a = int(n_points * k / (pauses + 1))
+        stopped[a:a + pause_points] = True
+    return stopped
+
+# WRITE_SYNTHETIC_GPX ========================================================================
+
+def write_synthetic_gpx(path: str, n_points: int, hz: float = 1.0, hr: bool = True, cad: bool = True,
+                        pauses: int = 2, pause_s: float = 120.0, noise_m: float = 3.0,
+                        segments: int = 1, speed_kmh: float = 25.0, seed: int = 0) -> str:
+    """
+    Escribe un GPX sintético reproducible.
+
+    Parámetros
+    ----------
+    path : str
+        Fichero de salida.
+    n_points : int
+        Nº de puntos de track.
+    hz : float, opcional
+        Frecuencia de muestreo (puntos por segundo). Por defecto 1.
+    hr, cad : bool, opcional
+        Incluir frecuencia cardiaca / cadencia como extensión Garmin.
+    pauses : int, opcional
+        Nº de paradas (el dispositivo sigue registrando sin moverse).
+    pause_s : float, opcional
+        Duración de cada parada en segundos.
+    noise_m : float, opcional
+        Ruido GPS gaussiano (desviación típica, metros) sobre la posición.
+    segments : int, opcional
+        Nº de `<trkseg>` en que se reparte el track.
+    speed_kmh : float, opcional
+        Velocidad media en movimiento.
+    seed : int, opcional
+        Semilla del generador aleatorio.
+
+    Devuelve
+    --------
+    str
+        `path`.
+
+    Notas
+    -----
+    - El recorrido es un paseo aleatorio suave (rumbo con deriva) con perfil de altitud
+    sinusoidal; velocidad, HR y cadencia varían de forma continua.
+    - Se genera por bloques de 100k puntos arrastrando el estado, de modo que el resultado
+    no depende del tamaño de bloque.
+    """
+
+    rng = npy.random.default_rng(seed)
+    dt_s = 1.0 / hz
+    stopped_all = _pause_mask(n_points, pauses, int(round(pause_s * hz)))
+    seg_breaks = {int(n_points * k / segments) for k in range(1, max(1, segments))}
+    m_per_deg_lat = 111_320.0
+    m_per_deg_lon = m_per_deg_lat * npy.cos(npy.radians(_START_LAT))
+
+    heading, x, y = 0.0, 0.0, 0.0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(_HEADER)
+        for a in range(0, n_points, _CHUNK):
+            b = min(a + _CHUNK, n_points)
+            i = npy.arange(a, b)
+            stopped = stopped_all[a:b]
+
+            # rumbo con deriva suave y velocidad variable (m/s)
+            headings = heading + npy.cumsum(rng.normal(0.0, 0.02 / hz, b - a))
+            speed = speed_kmh / 3.6 * (1.0 + 0.25 * npy.sin(i * dt_s / 600.0)) * (~stopped)
+            xs = x + npy.cumsum(speed * dt_s * npy.sin(headings))
+            ys = y + npy.cumsum(speed * dt_s * npy.cos(headings))
+            heading, x, y = headings[-1], xs[-1], ys[-1]
+
+            lat = _START_LAT + (ys + rng.normal(0.0, noise_m, b - a)) / m_per_deg_lat
+            lon = _START_LON + (xs + rng.normal(0.0, noise_m, b - a)) / m_per_deg_lon
+            ele = 150.0 + 120.0 * npy.sin(i * dt_s / 1800.0) + rng.normal(0.0, 0.5, b - a)
+            times = npy.datetime_as_string(_START_TIME + (i * dt_s * 1000).astype("timedelta64[ms]"),
+                                           unit="s" if hz <= 1 else "ms")
+            hr_v = npy.round(125 + 25 * npy.sin(i * dt_s / 900.0) - 15 * stopped).astype(int)
+            cad_v = npy.where(stopped, 0, npy.round(85 + 8 * npy.sin(i * dt_s / 300.0))).astype(int)
+
+            lines = []
+            for k in range(b - a):
+                if a + k in seg_breaks:
+                    lines.append("</trkseg><trkseg>\n")
+                ext = ""
+                if hr or cad:
+                    ext = ("<extensions><gpxtpx:TrackPointExtension>"
+                           + (f"<gpxtpx:hr>{hr_v[k]}</gpxtpx:hr>" if hr else "")
+                           + (f"<gpxtpx:cad>{cad_v[k]}</gpxtpx:cad>" if cad else "")
+                           + "</gpxtpx:TrackPointExtension></extensions>")
+                lines.append(f'<trkpt lat="{lat[k]:.7f}" lon="{lon[k]:.7f}"><ele>{ele[k]:.1f}</ele>'
+                             f'<time>{times[k]}Z</time>{ext}</trkpt>\n')
+            f.write("".join(lines))
+        f.write("</trkseg></trk></gpx>\n")
+    return path
+
+# SYNTHETIC_GPX ==============================================================================
+
+def synthetic_gpx(n_points: int, data_dir: str, **kwargs) -> str:
+    """
+    Ruta de un GPX sintético en `data_dir`, generándolo solo si no existe ya uno con los
+    mismos parámetros (el nombre lleva la huella de los parámetros).
+    """
+    params = dict(n_points=n_points, **kwargs)
+    tag = hashlib.blake2b(repr(sorted(params.items())).encode(), digest_size=6).hexdigest()
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"synthetic_{n_points}_{tag}.gpx")
+    if not os.path.exists(path):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        write_synthetic_gpx(tmp, n_points, **kwargs)
+        os.replace(tmp, path)
+    return path
+
+# MAIN =======================================================================================
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Genera un GPX sintético determinista.")
+    parser.add_argument("n_points", type=int)
+    parser.add_argument("path")
+    parser.add_argument("--hz", type=float, default=1.0)
+    parser.add_argument("--no-hr", action="store_true")
+    parser.add_argument("--no-cad", action="store_true")
+    parser.add_argument("--pauses", type=int, default=2)
+    parser.add_argument("--pause-s", type=float, default=120.0)
+    parser.add_argument("--noise-m", type=float, default=3.0)
+    parser.add_argument("--segments", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    write_synthetic_gpx(args.path, args.n_points, hz=args.hz, hr=not args.no_hr, cad=not args.no_cad,
+                        pauses=args.pauses, pause_s=args.pause_s, noise_m=args.noise_m,
+                        segments=args.segments, seed=args.seed)
+
+if __name__ == "__main__":
+    main()
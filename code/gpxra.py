@@ -22,13 +22,16 @@ import gpxpy
 import gpxpy.gpx
 import altair as alt
 import folium
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from streamlit_folium import st_folium
 from folium.plugins import Draw
 
 from datetime import datetime, timezone
 from branca.colormap import LinearColormap
+import functools
 import locale
 import os
+import tempfile
 
 # ============================================================================================
 # Configuración y Variables
@@ -45,14 +48,23 @@ except locale.Error:
 # ============================================================================================
 
 from gpxra.geo import haversine
-from gpxra.io import parse_gpx
-from gpxra.metrics import compute_metrics, make_splits
 from gpxra.formatting import format_time, hex_to_rgba
 from gpxra.maps import (
     TILE_SOURCES, build_map, prepare_coords,
     draw_route, add_start_end_markers, add_key_point_markers,
-    create_layers, _add_marker
+    create_layers, _add_marker, add_comparison_layer
 )
+from gpxra.heatmap import HeatmapGrid
+from gpxra.spatial import GridIndex
+from gpxra.segments import match_segment, segment_from_geojson, track_bboxes
+from gpxra.thumbnails import render_thumbnails
+from gpxra.charts import chart_frame, profile_chart, comparison_chart
+from gpxra.compare import comparison_summary, ghost_positions, track_colors
+from gpxra.pipeline import AnalysisPipeline, stage_key
+from gpxra.cache import shared_track_cache
+from gpxra.export import EXPORT_FORMATS, export_bytes
+from gpxra.dem import DEFAULT_DEM_DIR
+from gpxra import profiling
 
 # ============================================================================================
 # Funciones
@@ -145,6 +157,32 @@ with st.sidebar:
         key="moving_speed_threshold_slider",
     )
 
+    # Limpieza del ruido del GPS antes de las métricas
+    gps_filter = st.selectbox(
+        label="Filtro de ruido GPS",
+        options=["Sin filtro", "Descartar saltos", "Descartar saltos y suavizar"],
+        index=0,
+        help=(
+            "• Descartar saltos: quita los puntos a los que habría que llegar a una velocidad o "
+            "aceleración imposibles (picos del GPS que inflan la velocidad máxima y la escala del mapa).\n"
+            "• Descartar saltos y suavizar: además, suaviza las posiciones con un filtro de Kalman."
+        ),
+        key="gps_filter_select",
+    )
+
+    # Corrección de altitud con teselas SRTM locales (solo si GPXRA_DEM_DIR apunta a ellas)
+    dem_on = st.checkbox(
+        label="Corregir altitud con DEM",
+        value=False,
+        disabled=not os.path.isdir(DEFAULT_DEM_DIR),
+        help=(
+            "Sustituye la altitud del GPS por la de un modelo digital de elevaciones (teselas SRTM .hgt "
+            "del directorio GPXRA_DEM_DIR). Útil en dispositivos sin barómetro: el desnivel, la pendiente "
+            "y el mapa por altitud dejan de acumular el ruido del GPS."
+        ),
+        key="dem_check",
+    ) and os.path.isdir(DEFAULT_DEM_DIR)
+
     map_mode = st.selectbox(
         label="Representación en mapa",
         options=["Posición", "Velocidad", "Altitud"],
@@ -250,6 +288,25 @@ with st.sidebar:
         key="line_width_slider",
     )
 
+    profiling_on = st.checkbox(
+        label="Perfilado (panel Rendimiento)",
+        value=False,
+        help=(
+            "Registra cuánto tarda cada función de análisis (parseo, métricas, parciales, mapa…) "
+            "y con cuántos puntos trabaja. Los resultados aparecen al final de esta barra, en 'Rendimiento'."
+        ),
+        key="profiling_check",
+    )
+
+    profile_memory = st.checkbox(
+        label="Medir memoria (tracemalloc)",
+        value=False,
+        disabled=not profiling_on,
+        help=("Añade la memoria asignada por cada función. Ralentiza la app (en todas las sesiones "
+              "abiertas) mientras alguna lo tenga activo."),
+        key="profile_memory_check",
+    )
+
 
 BG_ = hex_to_rgba(color_hex, 0.10)   # fondo suave (10% opacidad)
 BD_ = hex_to_rgba(color_hex, 0.35)   # borde
@@ -289,23 +346,69 @@ uploaded_files = st.file_uploader("Sube tus ficheros .gpx", type=["gpx"], accept
 if not uploaded_files:
     st.stop()
 
+# Pipeline por etapas con caché por sesión: cada etapa se recalcula solo si cambian sus
+# entradas reales (contenido del GPX, etapas previas y sus propios parámetros). Los tracks
+# parseados/procesados viven en una caché común a todas las sesiones del proceso
+if "pipeline" not in st.session_state:
+    st.session_state["pipeline"] = AnalysisPipeline(track_cache=shared_track_cache())
+pipe = st.session_state["pipeline"]
+pipe.start_run()
+
+
+def timed_fragment(fn):
+    """`st.fragment` que, al re-ejecutarse solo el fragmento, reinicia los tiempos del pipeline
+    y refresca el panel de tiempos de la barra lateral (que no se vuelve a dibujar)."""
+    @functools.wraps(fn)
+    def body(*args, **kwargs):
+        partial = bool(get_script_run_ctx().fragment_ids_this_run)
+        if partial:
+            pipe.start_run()
+        fn(*args, **kwargs)
+        if partial:
+            render_timings()
+    return st.fragment(body)
+
+# Perfilado opcional: las funciones instrumentadas de gpxra registran cada llamada en el
+# sumidero de la sesión (solo en este hilo). La medición de memoria usa tracemalloc, que es
+# global del proceso: sigue activa mientras alguna sesión la tenga marcada (el sumidero de
+# cada sesión cuenta como un usuario) y entretanto ralentiza también a las demás
+if "profile_sink" not in st.session_state:
+    st.session_state["profile_sink"] = profiling.MemorySink()
+profile_sink = st.session_state["profile_sink"]
+profile_sink.clear()
+if profiling_on:
+    profiling.enable(profile_sink, trace_memory=profile_memory, owner=profile_sink)
+else:
+    profiling.disable()
+if not (profiling_on and profile_memory):
+    profiling.stop_memory_tracing(profile_sink)
+
 sessions = {}
+parsed_stages = {}
 for f in uploaded_files:
     try:
-        df_points = parse_gpx(f)
-        sessions[f.name] = df_points
+        parsed = pipe.parse(f.getvalue(), label=f.name)
+        if gps_filter != "Sin filtro":
+            parsed = pipe.filter(parsed, smooth=gps_filter == "Descartar saltos y suavizar")
+        if dem_on:
+            parsed = pipe.elevation(parsed, DEFAULT_DEM_DIR)
+        parsed_stages[f.name] = parsed
+        sessions[f.name] = parsed.value
     except Exception as e:
         st.warning(f"No se pudo procesar {f.name}: {e}")
+sessions_key = stage_key(*(p.key for p in parsed_stages.values()))
 
 file_names = list(sessions.keys())
 activity_selected = st.selectbox(label="Selecciona una actividad",
                                  options=file_names,
                                  key="activity_selected_select")
-df = sessions[activity_selected]
-
-metrics, df_proc, splits = compute_metrics(df, moving_speed_threshold)
+metrics_stage = pipe.metrics(parsed_stages[activity_selected], moving_speed_threshold)
+metrics, df_proc, splits = metrics_stage.value
+grade_stage = pipe.grade(parsed_stages[activity_selected], grade_window)
+stops_stage = pipe.stops(metrics_stage, min_stop_seconds=60)
 
-tab_resumen, tab_mapa, tab_stats, tab_guide = st.tabs(["Resumen", "Mapa", "Estadísticas", "Guía"])
+tab_resumen, tab_mapa, tab_stats, tab_compare, tab_gallery, tab_guide = st.tabs(
+    ["Resumen", "Mapa", "Estadísticas", "Comparar", "Galería", "Guía"])
 
 # ============================================================================================
 # TAB: RESUMEN
@@ -500,68 +603,107 @@ with tab_resumen:
         unsafe_allow_html=True
     )
 
-    if not splits.empty:
-        # Recalcular splits según el slider
-        c1, _ = st.columns([1, 5])    # ~16% / 84%
-        with c1:
-            split_km = st.slider("Tamaño del parcial (km)", 1, 10, 5, 1, key="split_km")
-        splits_dyn = make_splits(df_proc, split_km)
-
-        st.markdown(f"### Parciales (cada {split_km} km)")
-        if not splits_dyn.empty:
-            cols_show = ['km_inicio', 'dist_moving', 'time_moving', 'elev_gain', 'ritmo_min_km']
-            df_show = splits_dyn[cols_show].copy()
-
-            # Nombres legibles en castellano
-            col_map = {
-                'km_inicio': 'Inicio (km)',
-                'dist_moving': 'Distancia mov. (m)',
-                'time_moving': 'Tiempo en mov. (s)',
-                'elev_gain': 'Desnivel + (m)',
-                'ritmo_min_km': 'Ritmo (min/km)',
-            }
-            df_show = df_show.rename(columns=col_map)
-            cols_show_es = list(col_map.values())
-
-            # Styler con barras y sin índice
-            styler = (
-                df_show.style
-                .format({
-                    'Inicio (km)': '{:.0f}',
-                    'Distancia mov. (m)': '{:.0f}',
-                    'Tiempo en mov. (s)': '{:.0f}',
-                    'Desnivel + (m)': '{:.0f}',
-                    'Ritmo (min/km)': '{:.1f}',
-                })
-                .bar(subset=cols_show_es, color=color_hex, height=70, width=60)
-                .hide(axis="index")
-                .set_caption("Parciales por tramos de N km (configurable): inicio del tramo (km), distancia y tiempo en movimiento, desnivel positivo y ritmo medio (min/km).")
-            )
-            st.table(styler)
-        else:
-            st.info("No hay datos suficientes para calcular parciales.")
+    # Fragmento: mover el tamaño del parcial solo vuelve a ejecutar la tabla de parciales
+    @timed_fragment
+    def splits_fragment():
+        if not splits.empty:
+            # Recalcular splits según el slider
+            c1, _ = st.columns([1, 5])    # ~16% / 84%
+            with c1:
+                split_km = st.slider("Tamaño del parcial (km)", 1, 10, 5, 1, key="split_km")
+            splits_dyn = pipe.splits(metrics_stage, split_km).value
+
+            st.markdown(f"### Parciales (cada {split_km} km)")
+            if not splits_dyn.empty:
+                cols_show = ['km_inicio', 'dist_moving', 'time_moving', 'elev_gain', 'ritmo_min_km']
+                df_show = splits_dyn[cols_show].copy()
+
+                # Nombres legibles en castellano
+                col_map = {
+                    'km_inicio': 'Inicio (km)',
+                    'dist_moving': 'Distancia mov. (m)',
+                    'time_moving': 'Tiempo en mov. (s)',
+                    'elev_gain': 'Desnivel + (m)',
+                    'ritmo_min_km': 'Ritmo (min/km)',
+                }
+                df_show = df_show.rename(columns=col_map)
+                cols_show_es = list(col_map.values())
+
+                # Styler con barras y sin índice
+                styler = (
+                    df_show.style
+                    .format({
+                        'Inicio (km)': '{:.0f}',
+                        'Distancia mov. (m)': '{:.0f}',
+                        'Tiempo en mov. (s)': '{:.0f}',
+                        'Desnivel + (m)': '{:.0f}',
+                        'Ritmo (min/km)': '{:.1f}',
+                    })
+                    .bar(subset=cols_show_es, color=color_hex, height=70, width=60)
+                    .hide(axis="index")
+                    .set_caption("Parciales por tramos de N km (configurable): inicio del tramo (km), distancia y tiempo en movimiento, desnivel positivo y ritmo medio (min/km).")
+                )
+                st.table(styler)
+            else:
+                st.info("No hay datos suficientes para calcular parciales.")
 
-    # --- Descarga de datos (CSV) ---
-    st.markdown("### Descarga de datos")
+    splits_fragment()
 
-    # Nombre base del fichero (sin extensión)
-    fname = activity_selected.rsplit(".", 1)[0] if isinstance(activity_selected, str) else "actividad"
+    # --- Descarga de datos ---
+    st.markdown("### Descarga de datos")
 
-    # Columnas típicas; si HR/Cad no existen, se omiten automáticamente
-    cols_points = ['time','lat','lon','ele','dist','d_dist','dt','speed','moving','hr','cad']
-    cols_points = [c for c in cols_points if c in df_proc.columns]
+    # Fragmento: el fichero solo se genera en la pasada en que se pulsa "Preparar descarga" y
+    # no se memoiza (puede ocupar cientos de MB): las reejecuciones normales no serializan
+    # nada ni retienen el fichero, y el botón de descarga desaparece hasta volver a prepararlo
+    @timed_fragment
+    def export_fragment():
+        # Nombre base del fichero (sin extensión)
+        fname = activity_selected.rsplit(".", 1)[0] if isinstance(activity_selected, str) else "actividad"
+        safe_fname = fname.replace(" ", "_").replace("/", "-")
 
-    csv_points = df_proc[cols_points].to_csv(index=False).encode("utf-8")
+        c1, c2, _ = st.columns([1, 1, 2])
+        with c1:
+            export_choice = st.selectbox(
+                label="Formato",
+                options=["csv", "parquet", "gpx", "gpx_simple"],
+                format_func={
+                    "csv": "CSV (puntos)",
+                    "parquet": "Parquet (puntos, tipado y comprimido)",
+                    "gpx": "GPX (track original)",
+                    "gpx_simple": "GPX (track simplificado, 5 m)",
+                }.get,
+                help=(
+                    "• CSV / Parquet: todos los puntos procesados (time, lat, lon, ele, dist, speed, moving, hr, cad…).\n"
+                    "• GPX: el track para llevarlo a otra aplicación; la versión simplificada conserva "
+                    "la forma de la ruta (tolerancia 5 m) con muchos menos puntos."
+                ),
+                key="export_format_select",
+            )
+        fmt, simplify_m = ("gpx", 5.0) if export_choice == "gpx_simple" else (export_choice, None)
+        export_key = stage_key(metrics_stage.key, export_choice)
 
-    date_str = datetime.now().strftime("%Y%m%d%H%M%S")
-    safe_fname = fname.replace(" ", "_").replace("/", "-")
+        with c2:
+            st.write("")
+            prepare = st.button("Preparar descarga", key="export_prepare_button")
+
+        if prepare:
+            data = pipe.run(
+                "export", export_key, export_bytes, df_proc, fmt, name=fname, simplify_m=simplify_m,
+                memoize=False,
+            ).value
+            ext, mime = EXPORT_FORMATS[fmt]
+            suffix = "track_simplificado" if simplify_m else ("track" if fmt == "gpx" else "points")
+            date_str = datetime.now().strftime("%Y%m%d%H%M%S")
+            st.download_button(
+                label=f"⬇️ Descargar {ext.upper()} ({len(data) / 1024:,.0f} KB)",
+                data=data,
+                file_name=f"{date_str}_{safe_fname}_{suffix}.{ext}",
+                mime=mime,
+                on_click="ignore",
+                key="export_download_button",
+            )
 
-    st.download_button(
-        label="⬇️ Descargar puntos (CSV)",
-        data=csv_points,
-        file_name=f"{date_str}_{safe_fname}_points.csv",
-        mime="text/csv"
-    )
+    export_fragment()
 
 # ============================================================================================
 # TAB: MAPA
@@ -571,72 +713,143 @@ with tab_mapa:
 
     st.subheader("Mapa")
 
-    c1, c2, c3, c4 = st.columns(4)
-    with c1:
-        base_layer = st.selectbox(
-            label="Mapa base",
-            options=list(TILE_SOURCES.keys()),
-            index=0,
-            label_visibility="visible",
-            help=(
-                "Elige la capa de fondo.\n"
-                "• OpenStreetMap: estándar\n"
-                "• Carto Light/Dark: estilo limpio para ver datos\n"
-                "• Satélite (Esri): ortofoto, útil en montaña"
-            ),
-            key="map_base_select",
-        )
+    # Fragmento: los controles del mapa (capa base, minimapa, …) y la interacción con él
+    # (clicks, segmentos dibujados) solo vuelven a ejecutar esta región, no la app entera
+    @timed_fragment
+    def map_fragment():
+        c1, c2, c3, c4, c5 = st.columns(5)
+        with c1:
+            base_layer = st.selectbox(
+                label="Mapa base",
+                options=list(TILE_SOURCES.keys()),
+                index=0,
+                label_visibility="visible",
+                help=(
+                    "Elige la capa de fondo.\n"
+                    "• OpenStreetMap: estándar\n"
+                    "• Carto Light/Dark: estilo limpio para ver datos\n"
+                    "• Satélite (Esri): ortofoto, útil en montaña"
+                ),
+                key="map_base_select",
+            )
 
-    with c2:
-        show_minimap = st.checkbox(
-            label="Mini-map",
-            value=True,
-            help="Muestra un minimapa en la esquina con una vista general. Útil para orientarte en rutas largas.",
-            key="map_minimap_check",
-        )
+        with c2:
+            show_minimap = st.checkbox(
+                label="Mini-map",
+                value=True,
+                help="Muestra un minimapa en la esquina con una vista general. Útil para orientarte en rutas largas.",
+                key="map_minimap_check",
+            )
 
-    with c3:
-        show_measure = st.checkbox(
-            label="Regla de medir",
-            value=True,
-            help="Activa la herramienta de medición para calcular distancias (km) y áreas directamente sobre el mapa.",
-            key="map_measure_check",
-        )
+        with c3:
+            show_measure = st.checkbox(
+                label="Regla de medir",
+                value=True,
+                help="Activa la herramienta de medición para calcular distancias (km) y áreas directamente sobre el mapa.",
+                key="map_measure_check",
+            )
 
-    with c4:
-        use_layers = st.checkbox(
-            label="Capas",
-            value=True,
-            help=(
-                "Permite encender/apagar grupos en el mapa: Ruta, Inicio/fin, Altitud (máx/mín), "
-                "Rendimiento (vel/pte máx/min) y Paradas (≥ umbral)."
-            ),
-            key="map_layers_check",
-        )
+        with c4:
+            use_layers = st.checkbox(
+                label="Capas",
+                value=True,
+                help=(
+                    "Permite encender/apagar grupos en el mapa: Ruta, Inicio/fin, Altitud (máx/mín), "
+                    "Rendimiento (vel/pte máx/min) y Paradas (≥ umbral)."
+                ),
+                key="map_layers_check",
+            )
+
+        with c5:
+            show_heatmap = st.checkbox(
+                label="Mapa de calor",
+                value=False,
+                disabled=len(sessions) < 2,
+                help=(
+                    "Superpone la densidad de TODAS las actividades cargadas como una única imagen "
+                    "(rasterizada en el servidor). Requiere al menos dos actividades."
+                ),
+                key="map_heatmap_check",
+            )
 
 
-    center = [df_proc['lat'].mean(), df_proc['lon'].mean()]
-    m = build_map(center, base_layer, show_minimap=show_minimap, show_measure=show_measure)
+        def build_activity_map():
+            center = [df_proc['lat'].mean(), df_proc['lon'].mean()]
+            m = build_map(center, base_layer, show_minimap=show_minimap, show_measure=show_measure)
 
-    coords_df = prepare_coords(df_proc, max_points)
-    draw_route(m, coords_df, map_mode, color_range_mode, point_radius, color_hex)
+            coords_df = prepare_coords(df_proc, max_points)
+            draw_route(m, coords_df, map_mode, color_range_mode, point_radius, color_hex)
 
-    # Crear capas si procede
-    layers = create_layers(m, enabled=use_layers)
+            if show_heatmap:
+                heatmap = pipe.run("heatmap", sessions_key, HeatmapGrid.from_tracks, sessions.values())
+                heatmap.value.image_overlay().add_to(m)
 
-    # Inicio/fin a su capa si existe
-    add_start_end_markers(m, coords_df, layer=layers.get("start_end") if layers else None)
+            # Crear capas si procede
+            layers = create_layers(m, enabled=use_layers)
 
-    # Puntos clave usando capas (o mapa si no hay capas)
-    add_key_point_markers(
-        m, df_proc,
-        grade_window=grade_window,
-        min_stop_seconds=60,
-        format_time_fn=format_time,
-        layers=layers if layers else None
-    )
+            # Inicio/fin a su capa si existe
+            add_start_end_markers(m, coords_df, layer=layers.get("start_end") if layers else None)
+
+            # Puntos clave usando capas (o mapa si no hay capas)
+            add_key_point_markers(
+                m, df_proc,
+                grade_window=grade_window,
+                min_stop_seconds=60,
+                format_time_fn=format_time,
+                layers=layers if layers else None,
+                grade=grade_stage.value,
+                stops=stops_stage.value,
+            )
+            return m
+
+        map_key = stage_key(
+            metrics_stage.key, grade_stage.key, stops_stage.key, base_layer, show_minimap, show_measure,
+            use_layers, map_mode, color_range_mode, max_points, point_radius, color_hex,
+            sessions_key if show_heatmap else None,
+        )
+        m = pipe.run("map", map_key, build_activity_map).value
+
+        map_state = st_folium(m, width=None, returned_objects=["last_clicked", "last_active_drawing"])
+
+        # Click-to-inspect: punto de la ruta más cercano al click (índice espacial)
+        clicked = (map_state or {}).get("last_clicked")
+        if clicked:
+            index = pipe.run("index", metrics_stage.key, GridIndex, df_proc['lat'], df_proc['lon']).value
+            hit = index.nearest_point(clicked['lat'], clicked['lng'], max_radius_m=500)
+            if hit is None:
+                st.caption("No hay ningún punto de la ruta a menos de 500 m del click.")
+            else:
+                _, i, d_m = hit
+                row = df_proc.iloc[i]
+                st.info(
+                    f"📍 Punto más cercano (a {d_m:.0f} m): km {row['dist']/1000.0:.2f} · "
+                    f"{row['time'].strftime('%H:%M:%S')} · {row['ele']:.0f} m · {row['speed']*3.6:.1f} km/h"
+                )
+
+        # Segmento dibujado con la herramienta de línea: pasadas en todas las actividades
+        segment = segment_from_geojson((map_state or {}).get("last_active_drawing"))
+        if segment is not None:
+            st.markdown("#### 🏁 Segmento dibujado")
+            # memoizado por dibujo y conjunto de actividades; los bbox se calculan una vez
+            bboxes = pipe.run("bboxes", sessions_key, track_bboxes, sessions).value
+            efforts = pipe.run(
+                "segment", stage_key(sessions_key, segment.tolist()), match_segment, segment, sessions,
+                bboxes=bboxes,
+            ).value
+            if efforts.empty:
+                st.info("Ninguna actividad cargada recorre este segmento (en ese sentido).")
+            else:
+                efforts_show = pd.DataFrame({
+                    'Puesto': efforts['rank'],
+                    'Actividad': efforts['track'],
+                    'Hora': efforts['start_time'].dt.strftime("%Y-%m-%d %H:%M:%S"),
+                    'Tiempo': efforts['elapsed_s'].map(format_time),
+                    'Distancia (m)': efforts['distance_m'].round(0),
+                    'Vmed (km/h)': efforts['avg_speed_kmh'].round(1),
+                })
+                st.dataframe(efforts_show, hide_index=True)
 
-    st_folium(m, width=None)
+    map_fragment()
 
 # ============================================================================================
 # TAB: ESTADÍSTICAS
@@ -645,142 +858,215 @@ with tab_mapa:
 with tab_stats:
     st.subheader("Perfiles y Series")
 
-    chart_df = pd.DataFrame({
-        'km': df_proc['dist']/1000.0,
-        'ele': df_proc['ele'],
-        'speed_kmh': df_proc['speed']*3.6,
-        'hr': df_proc['hr'] if 'hr' in df_proc.columns else npy.nan,
-        'cad': df_proc['cad'] if 'cad' in df_proc.columns else npy.nan
-    })
-
-    # ==== Pendiente (%), suavizado y recorte ====
-    grade_raw = 100.0 * df_proc['ele'].diff() / df_proc['d_dist'].replace(0, npy.nan)
-    grade_pct = grade_raw.rolling(window=grade_window, min_periods=1, center=True).median()
-    grade_pct = grade_pct.clip(-grade_clip, grade_clip).fillna(0)
-    chart_df['grade_pct'] = grade_pct
-
-    # Perfil de altitud
-    st.markdown("#### ⛰️ Altitud")
-
-    y_min = chart_df["ele"].min() - 5
-    y_max = chart_df["ele"].max() + 5
-
-    alt_area = alt.Chart(chart_df).mark_area(opacity=0.25, color=color_hex, size=line_width, clip=True).encode(
-        x=alt.X('km:Q', title='Distancia (km)'),
-        y=alt.Y('ele:Q', title='Altitud (m)', scale=alt.Scale(domain=[y_min, y_max], zero=False)),
-    )
-    alt_line = alt.Chart(chart_df).mark_line(color=color_hex, size=line_width).encode(
-        x=alt.X('km:Q', title='Distancia (km)'),
-        y=alt.Y('ele:Q', title='Altitud (m)', scale=alt.Scale(domain=[y_min, y_max])),
-        tooltip=[
-            alt.Tooltip("km:Q", title="Distancia (km)", format=".1f"),
-            alt.Tooltip("ele:Q", title="Altitud (m)", format=".1f"),
-        ],
-    )
-    alt_chart_elev = (alt_line+alt_area).properties(height=300)
-    st.altair_chart(alt_chart_elev, use_container_width=True)
-
-    # Velocidad
-    st.markdown("#### ⚡ Velocidad")
-    alt_chart_speed = alt.Chart(chart_df).mark_line(color=color_hex, size=line_width).encode(
-        x=alt.X('km:Q', title='Distancia (km)'),
-        y=alt.Y('speed_kmh:Q', title='Velocidad (km/h)'),
-        tooltip=[
-            alt.Tooltip("km:Q", title="Distancia (km)", format=".1f"),
-            alt.Tooltip("speed_kmh:Q", title="Velocidad (km/h)", format=".1f"),
-        ],
-    ).properties(height=300)
-    st.altair_chart(alt_chart_speed, use_container_width=True)
-
-    # Pendiente (%)
-    st.markdown("#### ↗️ Pendiente (%)")
-
-    alt_chart_grade = alt.Chart(chart_df).mark_line(color=color_hex, size=line_width).encode(
-        x=alt.X('km:Q', title='Distancia (km)'),
-        y=alt.Y('grade_pct:Q',
-                title='Pendiente (%)'),
-        tooltip=[
-            alt.Tooltip("km:Q", title="Distancia (km)", format=".1f"),
-            alt.Tooltip("grade_pct:Q", title="Pendiente (%)", format=".0f"),
-        ],
-    ).properties(height=300)
-    st.altair_chart(alt_chart_grade, use_container_width=True)
-
-    # HR (si existe)
-    if show_hr and chart_df['hr'].notnull().any():
-        st.markdown("#### ❤️‍ Frecuencia Cardiaca")
-        # Línea HR
-        hr_df = chart_df.dropna(subset=['hr'])
-        alt_chart_hr = alt.Chart(hr_df).mark_line(color=color_hex, size=line_width).encode(
-            x=alt.X('km:Q', title='Distancia (km)'),
-            y=alt.Y('hr:Q', title='Frecuencia Cardiaca (bpm)'),
-            tooltip=[
-                alt.Tooltip("km:Q", title="Distancia (km)", format=".1f"),
-                alt.Tooltip("hr:Q", title="Frecuencia Cardiaca", format=".0f"),
-            ],
-        ).properties(height=300)
-
-        # Zonas HR (tiempo en movimiento)
-        hr_zones_df = df_proc[['hr','dt','moving']].dropna(subset=['hr']).copy()
-        hr_zones_df = hr_zones_df[(hr_zones_df['dt'] > 0) & (hr_zones_df['moving'])]
-        pie = None
-
-        if not hr_zones_df.empty:
-
-            bins = [-npy.inf, 100, 133, 149, 165, npy.inf]
-            palette = ["#2c7bb6", "#abd9e9", "#ffffbf", "#fdae61", "#d7191c"]
-            labels = ["<100", "100–133", "133–149", "149–165", ">165"]
-
-            hr_zones_df['zona'] = pd.cut(hr_zones_df['hr'], bins=bins, labels=labels, right=False)
-            zones = hr_zones_df.groupby('zona', observed=True)['dt'].sum().reindex(labels, fill_value=0)
-            zones_df = zones.reset_index().rename(columns={'dt': 'segundos'})
-            total_s = zones_df['segundos'].sum()
-            zones_df['porcentaje'] = npy.where(total_s > 0, 100 * zones_df['segundos'] / total_s, 0)
-
-            # (opcional) fuerza el orden de los sectores en el dibujo:
-            order_map = {lab: i for i, lab in enumerate(labels)}
-            zones_df["orden"] = zones_df["zona"].map(order_map).astype(int)
-
-            pie = (
-                alt.Chart(zones_df)
-                .mark_arc(stroke="white", strokeWidth=1)
-                .encode(
-                    theta=alt.Theta("segundos:Q", stack=True),
-                    color=alt.Color(
-                        "zona:N",
-                        title="Zona HR",
-                        scale=alt.Scale(domain=labels, range=palette),  # fija colores y orden de leyenda
-                    ),
-                    order=alt.Order("orden:Q"),  # <- opcional (garantiza orden de sectores)
-                    tooltip=[
-                        alt.Tooltip("zona:N", title="Zona"),
-                        alt.Tooltip("segundos:Q", title="Segundos", format=".0f"),
-                        alt.Tooltip("porcentaje:Q", title="%", format=".1f"),
-                    ],
-                )
-                .properties(height=260)
+    # Fragmento: los controles propios de las gráficas solo vuelven a ejecutar esta pestaña
+    @timed_fragment
+    def charts_fragment():
+        c1, c2, _ = st.columns([1, 1, 2])
+        with c1:
+            chart_points = st.slider(
+                label="Puntos por gráfica",
+                min_value=200, max_value=5000, value=1000, step=100,
+                help=(
+                    "Nº de puntos objetivo por serie en las gráficas de 'Estadísticas'. "
+                    "Se conserva la forma de la serie (y sus picos), pero el navegador recibe "
+                    "siempre un volumen de datos acotado, sea cual sea la longitud de la ruta."
+                ),
+                key="chart_points_slider",
+            )
+        with c2:
+            chart_method = st.selectbox(
+                label="Submuestreo de gráficas",
+                options=["lttb", "minmax"],
+                format_func={"lttb": "LTTB (forma)", "minmax": "Mín/máx por tramo"}.get,
+                index=0,
+                help=(
+                    "• LTTB: conserva la forma visual de la serie con el nº de puntos indicado.\n"
+                    "• Mín/máx por tramo: conserva todos los extremos locales (picos estrechos)."
+                ),
+                key="chart_method_select",
             )
 
-        c1, c2 = st.columns(2)
+        # Perfiles frente a distancia (pendiente suavizada y recortada), submuestreados para
+        # que el tamaño de las gráficas no dependa de la longitud de la ruta
+        chart_key = stage_key(grade_stage.key, grade_clip, chart_points, chart_method)
+        # Los perfiles solo usan columnas independientes del umbral: cuelgan del parseo
+        chart_df = pipe.run(
+            "chart_frame", chart_key, chart_frame,
+            parsed_stages[activity_selected].value, grade_clip=grade_clip, max_points=chart_points, method=chart_method,
+            grade=grade_stage.value,
+        ).value
+
+        # Perfiles (altitud, velocidad, pendiente, HR y cadencia) en un único spec: todas las
+        # vistas comparten un solo dataset y marcan la misma distancia bajo el ratón
+        alt_chart_profiles = pipe.run(
+            "charts", stage_key(chart_key, color_hex, line_width, show_hr, show_cad), profile_chart,
+            chart_df, color_hex=color_hex, line_width=line_width, show_hr=show_hr, show_cad=show_cad,
+        ).value
+        st.altair_chart(alt_chart_profiles, use_container_width=True)
+
+        # HR (si existe)
+        if show_hr and chart_df['hr'].notnull().any():
+            # Zonas HR (tiempo en movimiento)
+            hr_zones_df = df_proc[['hr','dt','moving']].dropna(subset=['hr']).copy()
+            hr_zones_df = hr_zones_df[(hr_zones_df['dt'] > 0) & (hr_zones_df['moving'])]
+            pie = None
+
+            if not hr_zones_df.empty:
+
+                bins = [-npy.inf, 100, 133, 149, 165, npy.inf]
+                palette = ["#2c7bb6", "#abd9e9", "#ffffbf", "#fdae61", "#d7191c"]
+                labels = ["<100", "100–133", "133–149", "149–165", ">165"]
+
+                hr_zones_df['zona'] = pd.cut(hr_zones_df['hr'], bins=bins, labels=labels, right=False)
+                zones = hr_zones_df.groupby('zona', observed=True)['dt'].sum().reindex(labels, fill_value=0)
+                zones_df = zones.reset_index().rename(columns={'dt': 'segundos'})
+                total_s = zones_df['segundos'].sum()
+                zones_df['porcentaje'] = npy.where(total_s > 0, 100 * zones_df['segundos'] / total_s, 0)
+
+                # (opcional) fuerza el orden de los sectores en el dibujo:
+                order_map = {lab: i for i, lab in enumerate(labels)}
+                zones_df["orden"] = zones_df["zona"].map(order_map).astype(int)
+
+                pie = (
+                    alt.Chart(zones_df)
+                    .mark_arc(stroke="white", strokeWidth=1)
+                    .encode(
+                        theta=alt.Theta("segundos:Q", stack=True),
+                        color=alt.Color(
+                            "zona:N",
+                            title="Zona HR",
+                            scale=alt.Scale(domain=labels, range=palette),  # fija colores y orden de leyenda
+                        ),
+                        order=alt.Order("orden:Q"),  # <- opcional (garantiza orden de sectores)
+                        tooltip=[
+                            alt.Tooltip("zona:N", title="Zona"),
+                            alt.Tooltip("segundos:Q", title="Segundos", format=".0f"),
+                            alt.Tooltip("porcentaje:Q", title="%", format=".1f"),
+                        ],
+                    )
+                    .properties(height=260)
+                )
+
+            c1, _ = st.columns(2)
+            with c1:
+                st.markdown("#### ❤️‍ Zonas de frecuencia cardiaca (tiempo en movimiento)")
+                if pie is not None:
+                    st.altair_chart(pie, use_container_width=True)
+                else:
+                    st.info("No hay datos de HR suficientes para calcular zonas.")
+
+    charts_fragment()
+
+# ============================================================================================
+# TAB: COMPARAR
+# ============================================================================================
+
+with tab_compare:
+
+    st.subheader("Comparar actividades")
+    st.caption("Varios intentos de la misma ruta, alineados por distancia sobre una referencia.")
+
+    # Fragmento: cambiar la referencia, los intentos o el instante del fantasma solo
+    # vuelve a ejecutar esta pestaña
+    @timed_fragment
+    def compare_fragment():
+        if len(file_names) < 2:
+            st.info("Sube al menos dos actividades de la misma ruta para compararlas.")
+            return
+
+        c1, c2, c3 = st.columns([2, 3, 1])
         with c1:
-            st.markdown("##### Frecuencia cardiaca")
-            st.altair_chart(alt_chart_hr, use_container_width=True)
+            reference = st.selectbox(
+                label="Referencia",
+                options=file_names,
+                index=file_names.index(activity_selected),
+                help="Actividad sobre la que se alinean las demás (p. ej. tu mejor intento).",
+                key="compare_reference_select",
+            )
+        others = [n for n in file_names if n != reference]
         with c2:
-            st.markdown("##### Zonas de frecuencia cardiaca (tiempo en movimiento)")
-            if pie is not None:
-                st.altair_chart(pie, use_container_width=True)
-            else:
-                st.info("No hay datos de HR suficientes para calcular zonas.")
+            attempts = st.multiselect(
+                label="Intentos",
+                options=others,
+                default=others,
+                help="Actividades que se comparan con la referencia.",
+                key="compare_tracks_multiselect",
+            )
+        with c3:
+            step_m = st.selectbox(
+                label="Resolución (m)",
+                options=[5, 10, 25, 50],
+                index=1,
+                help="Una muestra de comparación cada N metros de la referencia.",
+                key="compare_step_select",
+            )
+        if not attempts:
+            st.info("Elige al menos un intento.")
+            return
+
+        comparison = pipe.compare(
+            parsed_stages[reference], {n: parsed_stages[n] for n in attempts},
+            every_m=step_m, reference_name=reference,
+        ).value
+        colors = track_colors([reference] + attempts)
+
+        summary = comparison_summary(comparison)
+        st.dataframe(
+            pd.DataFrame({
+                'Puesto': summary['rank'],
+                'Actividad': summary['track'],
+                'Cobertura': summary['coverage_pct'].map(lambda v: f"{v:.0f}%"),
+                'Hasta km': summary['common_km'].map(lambda v: f"{v:.2f}"),
+                'Tiempo': summary['elapsed_s'].map(lambda v: format_time(v) if pd.notna(v) else "—"),
+                'Diferencia': summary['delta_s'].map(lambda v: f"{v:+.0f} s" if pd.notna(v) else "—"),
+            }),
+            hide_index=True,
+            use_container_width=True,
+        )
+        st.altair_chart(comparison_chart(comparison, colors=colors), use_container_width=True)
+
+        # Carrera fantasma: posición de cada actividad el mismo tiempo después de su salida
+        max_min = max(1, int(npy.ceil(comparison['elapsed_s'].max() / 60.0)))
+        ghost_min = st.slider(
+            label="👻 Carrera fantasma (minutos desde la salida)",
+            min_value=0, max_value=max_min, value=min(max_min, max_min // 2), step=1,
+            key="compare_ghost_slider",
+        )
+        ghosts = ghost_positions(comparison, ghost_min * 60.0)
+
+        ref_df = sessions[reference]
+        m = build_map([ref_df["lat"].mean(), ref_df["lon"].mean()], "OpenStreetMap", show_minimap=False)
+        add_comparison_layer(m, {n: sessions[n] for n in [reference] + attempts}, colors, ghosts=ghosts)
+        st_folium(m, width=None, height=450, key="compare_map", returned_objects=[])
 
-    # Cadencia (si existe)
-    if show_cad and chart_df['cad'].notnull().any():
-        st.markdown("#### ⚙️ Cadencia")
+    compare_fragment()
 
-        alt_chart_cad = alt.Chart(chart_df.dropna(subset=['cad'])).mark_line(color=color_hex, size=line_width).encode(
-            x='km:Q', y=alt.Y('cad:Q', title='Cadencia (rpm)'), tooltip=['km','cad']
-        ).properties(height=220)
+# ============================================================================================
+# TAB: GALERÍA
+# ============================================================================================
 
-        st.altair_chart(alt_chart_cad, use_container_width=True)
+with tab_gallery:
+
+    st.subheader("Galería de actividades")
+    st.caption("Miniaturas dibujadas en el servidor (sin mapa base), con el modo de color del mapa.")
+
+    thumbnails = pipe.run(
+        "thumbnails", stage_key(sessions_key, map_mode, color_hex, color_range_mode), render_thumbnails,
+        sessions,
+        cache_dir=os.path.join(tempfile.gettempdir(), "gpxra-thumbnails"),
+        mode=map_mode,
+        color_hex=color_hex,
+        color_range_mode=color_range_mode,
+    ).value
+    GALLERY_COLS = 4
+    names = list(thumbnails.keys())
+    for i in range(0, len(names), GALLERY_COLS):
+        cols = st.columns(GALLERY_COLS)
+        for name, col in zip(names[i:i+GALLERY_COLS], cols):
+            df_g = sessions[name]
+            km_g = df_g['dist'].iloc[-1] / 1000.0 if not df_g.empty else 0.0
+            with col:
+                st.image(thumbnails[name], caption=f"{name} · {km_g:.1f} km")
 
 # ============================================================================================
 # TAB:GUÍA
@@ -803,3 +1089,67 @@ with tab_guide:
         st.warning(f"No se encontró `{guia_path}`. Crea ese fichero Markdown en tu proyecto o cambia la ruta en Ajustes.")
     except Exception as e:
         st.error(f"No se pudo leer la guía: {e}")
+
+# ============================================================================================
+# TIEMPOS DEL PIPELINE
+# ============================================================================================
+
+with st.sidebar:
+    with st.expander("⏱️ Tiempos por etapa", expanded=False):
+        timings_slot = st.empty()
+
+
+def render_timings():
+    """Dibuja en el panel lateral los tiempos de la última ejecución (completa o de fragmento)."""
+    timings_df = pipe.timings_frame()
+    with timings_slot.container():
+        st.caption(
+            f"Total: {timings_df['ms'].sum():.0f} ms · "
+            f"{int(timings_df['cached'].sum())}/{len(timings_df)} etapas servidas desde caché"
+        )
+        st.dataframe(
+            timings_df.rename(columns={'stage': 'Etapa', 'label': 'Detalle', 'ms': 'ms', 'cached': 'Caché'}),
+            hide_index=True,
+            column_config={'ms': st.column_config.NumberColumn(format="%.1f")},
+        )
+        cache_stats = shared_track_cache().stats()
+        st.caption(
+            f"Caché compartida de tracks: {cache_stats['entries']} entradas · "
+            f"{cache_stats['nbytes'] / 1024**2:.1f}/{cache_stats['max_bytes'] / 1024**2:.0f} MB · "
+            f"{cache_stats['hits']} aciertos · {cache_stats['misses']} fallos · "
+            f"{cache_stats['evictions']} descartes"
+            + (" · modo compacto (GPXRA_COMPACT_TRACKS)" if pipe.compact else "")
+        )
+
+
+render_timings()
+
+# ============================================================================================
+# RENDIMIENTO
+# ============================================================================================
+
+if profiling_on:
+    with st.sidebar:
+        with st.expander("🩺 Rendimiento", expanded=False):
+            profile_df = profile_sink.summary()
+            if profile_df.empty:
+                st.caption("Ninguna función instrumentada se ha ejecutado en esta pasada (todo vino de caché).")
+            else:
+                profile_show = pd.DataFrame({
+                    'Función': profile_df['name'],
+                    'Llamadas': profile_df['calls'],
+                    'Total (ms)': profile_df['total_s'] * 1000.0,
+                    'Máx (ms)': profile_df['max_s'] * 1000.0,
+                    'Puntos': profile_df['points'],
+                })
+                if profile_memory:
+                    profile_show['Memoria (MB)'] = profile_df['alloc_bytes'] / 1024 ** 2
+                st.dataframe(
+                    profile_show,
+                    hide_index=True,
+                    column_config={
+                        'Total (ms)': st.column_config.NumberColumn(format="%.1f"),
+                        'Máx (ms)': st.column_config.NumberColumn(format="%.1f"),
+                        'Memoria (MB)': st.column_config.NumberColumn(format="%.2f"),
+                    },
+                )
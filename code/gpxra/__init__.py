@@ -1,7 +1,32 @@
-from .geo import haversine
-from .io import parse_gpx
-from .metrics import compute_metrics
-from .formatting import format_time
-from .maps import TILE_SOURCES, build_map, prepare_coords, draw_route, add_start_end_markers, add_key_point_markers, create_layers, _add_marker
+import importlib
+
+# Atributos públicos del paquete → módulo que los define. Se importan en el primer acceso
+# (PEP 562), así que `import gpxra` no arrastra folium/branca/altair a quien solo necesita
+# `parse_gpx` o `compute_metrics` (p. ej. un proceso de lote).
+_LAZY_ATTRS = {
+    "haversine": "geo",
+    "parse_gpx": "io",
+    "compute_metrics": "metrics",
+    "format_time": "formatting",
+    "TILE_SOURCES": "maps",
+    "build_map": "maps",
+    "prepare_coords": "maps",
+    "draw_route": "maps",
+    "add_start_end_markers": "maps",
+    "add_key_point_markers": "maps",
+    "create_layers": "maps",
+    "_add_marker": "maps",
+}
 
 __all__ = ["haversine", "parse_gpx", "compute_metrics", "format_time", "TILE_SOURCES", "build_map", "prepare_coords", "draw_route", "add_start_end_markers", "add_key_point_markers", "create_layers", "_add_marker", ]
+
+def __getattr__(name):
+    module = _LAZY_ATTRS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value     # los siguientes accesos no pasan por __getattr__
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
@@ -0,0 +1,230 @@
+# ============================================================================================
+# CACHE.PY
+# ============================================================================================
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+import pandas as pd
+from .track import Track
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+# Presupuesto por defecto de la caché compartida (MB); configurable por variable de entorno
+DEFAULT_BUDGET_MB = float(os.environ.get("GPXRA_TRACK_CACHE_MB", 512))
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# _SIZEOF ====================================================================================
+
+def _sizeof(value) -> int:
+    """
+    Estimación de la memoria (bytes) de un valor en caché: DataFrames, tuplas de ellos, etc.
+    Los arrays de los `Track` no se cuentan aquí (ver `_track_arrays`).
+    """
+    if isinstance(value, Track):
+        return 0
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True))
+    if isinstance(value, (tuple, list)):
+        return sum(_sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+# _TRACK_ARRAYS ==============================================================================
+
+def _track_arrays(value):
+    """
+    Arrays (columnas, máscaras y columnas ya calculadas) de los `Track` de un valor en
+    caché. Varios `Track` pueden compartir arrays (`Track.with_columns`), así que la caché
+    los cuenta una vez por array.
+    """
+    if isinstance(value, Track):
+        yield from value.arrays()
+    elif isinstance(value, (tuple, list)):
+        for v in value:
+            yield from _track_arrays(v)
+
+# ============================================================================================
+# TRACKCACHE
+# ============================================================================================
+
+class TrackCache:
+    """
+    Caché LRU de tracks parseados/procesados, compartida por todo el proceso.
+
+    Está pensada para despliegues con muchos usuarios: si varias sesiones suben el mismo
+    GPX (la ruta del club), se parsea una sola vez y todas reciben vistas de solo lectura
+    de los mismos arrays (`Track.to_frame()`), de modo que la memoria crece con el número
+    de ficheros distintos, no con el de sesiones.
+
+    Parámetros
+    ----------
+    max_bytes : int, opcional
+        Presupuesto de memoria. Al superarlo se descartan las entradas usadas hace más
+        tiempo. Por defecto, `GPXRA_TRACK_CACHE_MB` (512 MB).
+
+    Notas
+    -----
+    - Las claves son hashables arbitrarios; el pipeline usa `(etapa, hash de contenido)`.
+    - `get_or_compute` es seguro entre hilos y evita el trabajo duplicado: si dos sesiones
+    piden a la vez la misma clave, una calcula y la otra espera su resultado.
+    - Un valor mayor que todo el presupuesto se devuelve pero no se guarda.
+    - `stats()` expone aciertos, fallos, descartes, entradas y bytes ocupados. Los arrays
+    compartidos por varias entradas (p. ej. `parse` y `metrics` en modo compacto) se
+    cuentan una sola vez.
+
+    Ejemplos
+    --------
+    >>> cache = shared_track_cache()
+    >>> track = cache.get_or_compute(("parse", key), lambda: Track.from_frame(parse_gpx(f)))  # doctest: +SKIP
+    >>> cache.stats()  # doctest: +SKIP
+    {'hits': 12, 'misses': 3, 'evictions': 0, 'entries': 3, 'nbytes': 5242880, 'max_bytes': 536870912}
+    """
+
+    def __init__(self, max_bytes: int | None = None):
+        self.max_bytes = int(DEFAULT_BUDGET_MB * 1024 ** 2 if max_bytes is None else max_bytes)
+        self._entries: OrderedDict = OrderedDict()     # clave → (valor, bytes sin arrays de Track, arrays)
+        self._arrays: dict = {}                        # id → [array de Track, nº de entradas que lo usan]
+        self._inflight: dict = {}                      # clave → Event del cálculo en curso
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key: Hashable, default=None):
+        """Valor en caché para `key` (y lo marca como recién usado), o `default`."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return default
+
+    def peek(self, key: Hashable, default=None):
+        """Como `get`, pero sin contar acierto/fallo ni cambiar el orden LRU (sondeos)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return default if entry is None else entry[0]
+
+    def put(self, key: Hashable, value: Any) -> Any:
+        """Guarda `value` y descarta entradas antiguas hasta volver al presupuesto."""
+        size = _sizeof(value)
+        with self._lock:
+            self._put_locked(key, value, size)
+        return value
+
+    def _put_locked(self, key, value, size: int) -> None:
+        if key in self._entries:
+            self._release(*self._entries.pop(key))
+        # los arrays se anotan al guardar: los que un `Track` calcule después no se cuentan
+        arrays = list(_track_arrays(value))
+        if size + sum(a.nbytes for a in arrays) > self.max_bytes:
+            return
+        self._entries[key] = (value, size, arrays)
+        self.nbytes += size
+        for arr in arrays:
+            ref = self._arrays.setdefault(id(arr), [arr, 0])
+            if ref[1] == 0:
+                self.nbytes += arr.nbytes
+            ref[1] += 1
+        while self.nbytes > self.max_bytes:
+            _, old = self._entries.popitem(last=False)
+            self._release(*old)
+            self.evictions += 1
+
+    def _release(self, value, size: int, arrays: list) -> None:
+        """Descuenta una entrada que sale de la caché (sus arrays, si nadie más los usa)."""
+        self.nbytes -= size
+        for arr in arrays:
+            ref = self._arrays[id(arr)]
+            ref[1] -= 1
+            if ref[1] == 0:
+                self.nbytes -= arr.nbytes
+                del self._arrays[id(arr)]
+
+    def get_or_compute(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Devuelve el valor de `key`; si no está, lo calcula con `fn()` (una sola vez aunque
+        lo pidan varios hilos a la vez) y lo guarda.
+        """
+        while True:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][0]
+                event = self._inflight.get(key)
+                if event is None:
+                    self.misses += 1
+                    event = self._inflight[key] = threading.Event()
+                    owner = True
+                else:
+                    owner = False
+            if not owner:
+                # otro hilo lo está calculando: esperar y volver a mirar (si falló, se reintenta)
+                event.wait()
+                continue
+            try:
+                value = fn()
+                size = _sizeof(value)
+                with self._lock:
+                    self._put_locked(key, value, size)
+                return value
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                event.set()
+
+    def clear(self) -> None:
+        """Vacía la caché (los contadores se conservan)."""
+        with self._lock:
+            self._entries.clear()
+            self._arrays.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        """Contadores y ocupación actuales."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'nbytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+            }
+
+# SHARED_TRACK_CACHE =========================================================================
+
+_SHARED = None
+_SHARED_LOCK = threading.Lock()
+
+def shared_track_cache() -> TrackCache:
+    """La `TrackCache` única del proceso (se crea en el primer uso)."""
+    global _SHARED
+    with _SHARED_LOCK:
+        if _SHARED is None:
+            _SHARED = TrackCache()
+        return _SHARED
@@ -0,0 +1,221 @@
+# ============================================================================================
+# CHARTS.PY
+# ============================================================================================
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import altair as alt
+import numpy as npy
+import pandas as pd
+from .metrics import compute_grade
+from .downsample import downsample_frame
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+# Series de los perfiles de la pestaña "Estadísticas" (eje x: 'km')
+PROFILE_SERIES = ['ele', 'speed_kmh', 'grade_pct', 'hr', 'cad']
+
+# Decimales con los que se serializa cada serie en el spec (lo que se ve en los tooltips)
+_DECIMALS = {'km': 3, 'ele': 1, 'speed_kmh': 1, 'grade_pct': 1}
+
+# Series enteras opcionales (NaN donde el GPX no las trae)
+_INT_SERIES = ['hr', 'cad']
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# CHART_FRAME ================================================================================
+
+def chart_frame(df_proc: pd.DataFrame, grade_window: int = 9, grade_clip: float = 15,
+                max_points: int | None = 1000, method: str = "lttb",
+                grade: pd.Series | None = None) -> pd.DataFrame:
+    """
+    Construye el DataFrame de los perfiles (altitud, velocidad, pendiente, HR y cadencia)
+    frente a la distancia.
+
+    Parámetros
+    ----------
+    df_proc : pandas.DataFrame
+        Salida de `compute_metrics` (necesita 'dist', 'ele', 'speed', 'd_dist').
+    grade_window : int, opcional
+        Ventana de la mediana de la pendiente (ver `compute_grade`).
+    grade_clip : float, opcional
+        Saturación visual de la pendiente en ±`grade_clip` %.
+    max_points : int | None, opcional
+        Puntos objetivo por serie tras el submuestreo (`downsample_frame`). None
+        desactiva el submuestreo.
+    method : str, opcional
+        "lttb" o "minmax".
+    grade : pandas.Series, opcional
+        Pendiente ya calculada con `compute_grade` (se reutiliza en lugar de recalcularla).
+
+    Devuelve
+    --------
+    pandas.DataFrame
+        Columnas 'km' + `PROFILE_SERIES`. La pendiente se calcula con todos los puntos
+        y después se submuestrea, así que el suavizado no depende de `max_points`.
+    """
+
+    chart_df = pd.DataFrame({
+        'km': df_proc['dist']/1000.0,
+        'ele': df_proc['ele'],
+        'speed_kmh': df_proc['speed']*3.6,
+        'hr': df_proc['hr'] if 'hr' in df_proc.columns else npy.nan,
+        'cad': df_proc['cad'] if 'cad' in df_proc.columns else npy.nan
+    })
+    if grade is None:
+        grade = compute_grade(df_proc, grade_window)
+    chart_df['grade_pct'] = grade.clip(-grade_clip, grade_clip)
+    chart_df = chart_df[['km'] + PROFILE_SERIES]
+
+    if max_points:
+        series = [c for c in PROFILE_SERIES if chart_df[c].notna().any()]
+        chart_df = downsample_frame(chart_df, 'km', series, n_points=max_points, method=method)
+    return chart_df
+
+# COMPACT_CHART_FRAME ========================================================================
+
+def compact_chart_frame(chart_df: pd.DataFrame, columns) -> pd.DataFrame:
+    """
+    Deja solo las columnas indicadas (más 'km') con la precisión que se muestra, para que
+    el JSON embebido en el spec sea lo más pequeño posible: flotantes redondeados y HR /
+    cadencia como enteros anulables.
+    """
+    out = chart_df[['km'] + [c for c in columns if c != 'km']].copy()
+    for col in out.columns:
+        if col in _INT_SERIES:
+            out[col] = out[col].round().astype("Int16")
+        elif col in _DECIMALS:
+            out[col] = out[col].round(_DECIMALS[col])
+    return out.reset_index(drop=True)
+
+# PROFILE_CHART ==============================================================================
+
+def profile_chart(chart_df: pd.DataFrame, color_hex: str = "#1f77b4", line_width: float = 2.5,
+                  show_hr: bool = True, show_cad: bool = True, height: int = 300):
+    """
+    Gráfica compuesta de los perfiles (altitud, velocidad, pendiente y, si existen, HR y
+    cadencia) frente a la distancia, como UN único spec de Vega-Lite.
+
+    Parámetros
+    ----------
+    chart_df : pandas.DataFrame
+        Salida de `chart_frame`.
+    color_hex : str, opcional
+        Color de las series.
+    line_width : float, opcional
+        Grosor de línea.
+    show_hr, show_cad : bool, opcional
+        Incluir las vistas de HR / cadencia (solo si hay datos).
+    height : int, opcional
+        Alto de cada vista en píxeles.
+
+    Devuelve
+    --------
+    altair.VConcatChart
+
+    Notas
+    -----
+    - Todas las vistas referencian un único dataset con nombre declarado en el nivel
+    superior, en lugar de incrustar una copia de los datos por gráfica (y dos en la
+    altitud, área + línea). El navegador recibe y analiza los datos una sola vez.
+    - Pasar el ratón por cualquier vista marca la misma distancia en todas (selección
+    `hover_km` compartida).
+    """
+
+    views = [('ele', 'Altitud (m)', '⛰️ Altitud', '.1f'),
+             ('speed_kmh', 'Velocidad (km/h)', '⚡ Velocidad', '.1f'),
+             ('grade_pct', 'Pendiente (%)', '↗️ Pendiente (%)', '.0f')]
+    if show_hr and chart_df['hr'].notna().any():
+        views.append(('hr', 'Frecuencia Cardiaca (bpm)', '❤️ Frecuencia Cardiaca', '.0f'))
+    if show_cad and chart_df['cad'].notna().any():
+        views.append(('cad', 'Cadencia (rpm)', '⚙️ Cadencia', '.0f'))
+
+    data = compact_chart_frame(chart_df, [v[0] for v in views])
+    hover = alt.selection_point(name="hover_km", fields=['km'], nearest=True,
+                                on='pointerover', clear='pointerout', empty=False)
+    x = alt.X('km:Q', title='Distancia (km)')
+
+    charts = []
+    for col, y_title, title, fmt in views:
+        base = alt.Chart().encode(x=x)
+        if col in _INT_SERIES:
+            base = base.transform_filter(f"isValid(datum.{col})")
+        if col == 'ele':
+            y_min, y_max = float(data['ele'].min()) - 5, float(data['ele'].max()) + 5
+            y = alt.Y('ele:Q', title=y_title, scale=alt.Scale(domain=[y_min, y_max], zero=False))
+        else:
+            y = alt.Y(f'{col}:Q', title=y_title)
+        tooltip = [alt.Tooltip("km:Q", title="Distancia (km)", format=".1f"),
+                   alt.Tooltip(f"{col}:Q", title=y_title, format=fmt)]
+
+        layers = []
+        if col == 'ele':
+            layers.append(base.mark_area(opacity=0.25, color=color_hex, clip=True).encode(y=y))
+        layers += [
+            base.mark_line(color=color_hex, size=line_width).encode(y=y),
+            # capa invisible que captura el punto más cercano al ratón
+            base.mark_point(opacity=0, size=60).encode(y=y, tooltip=tooltip).add_params(hover),
+            base.mark_rule(color="#777", strokeDash=[4, 3]).transform_filter(hover),
+            base.mark_circle(color=color_hex, size=50).encode(y=y).transform_filter(hover),
+        ]
+        charts.append(alt.layer(*layers).properties(title=title, height=height))
+
+    return alt.vconcat(*charts, data=data, spacing=24).resolve_scale(x='shared')
+
+# COMPARISON_CHART ===========================================================================
+
+def comparison_chart(comparison: pd.DataFrame, colors: dict | None = None, max_points: int = 1000,
+                     line_width: float = 2.0, height: int = 300):
+    """
+    Diferencia de tiempo de cada actividad con la referencia frente a la distancia
+    (salida de `compare_activities`). Por encima de 0, por detrás de la referencia.
+
+    Parámetros
+    ----------
+    comparison : pandas.DataFrame
+        Salida de `compare_activities`.
+    colors : dict[str, str], opcional
+        Color por actividad (por defecto, `track_colors` en el orden de `comparison`).
+    max_points : int, opcional
+        Puntos por actividad tras el downsampling (LTTB sobre 'delta_s').
+    line_width : float, opcional
+        Grosor de línea.
+    height : int, opcional
+        Alto en píxeles.
+
+    Devuelve
+    --------
+    altair.LayerChart
+    """
+    from .compare import track_colors
+
+    names = list(comparison['track'].unique())
+    colors = colors or track_colors(names)
+    frames = [
+        downsample_frame(g[['km', 'delta_s']].reset_index(drop=True), 'km', ['delta_s'], n_points=max_points)
+        .assign(track=name)
+        for name, g in comparison.groupby('track', sort=False)
+    ]
+    data = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['km', 'delta_s', 'track'])
+    data = data.round({'km': 3, 'delta_s': 1})
+
+    color = alt.Color('track:N', title='Actividad',
+                      scale=alt.Scale(domain=names, range=[colors[n] for n in names]))
+    tooltip = [alt.Tooltip("track:N", title="Actividad"),
+               alt.Tooltip("km:Q", title="Distancia (km)", format=".2f"),
+               alt.Tooltip("delta_s:Q", title="Diferencia (s)", format="+.0f")]
+    lines = alt.Chart(data).mark_line(size=line_width).encode(
+        x=alt.X('km:Q', title='Distancia (km)'),
+        y=alt.Y('delta_s:Q', title='Diferencia con la referencia (s)'),
+        color=color,
+        tooltip=tooltip,
+    )
+    zero = alt.Chart(pd.DataFrame({'delta_s': [0]})).mark_rule(color="#777", strokeDash=[4, 3]).encode(y='delta_s:Q')
+    return alt.layer(zero, lines).properties(title="👻 Diferencia con la referencia", height=height)
@@ -0,0 +1,325 @@
+# ============================================================================================
+# CLI.PY
+# ============================================================================================
+#
+# Analizador por línea de comandos (sin navegador):
+#
+#   python -m gpxra rutas/ "archivo/2024-*.gpx" extra.gpx -o resumen.jsonl
+#   python -m gpxra archivo/ --format parquet -o resumen.parquet --workers 8 --profile
+#
+# Ejecuta parse → metrics → splits / stops para cada fichero en un pool de procesos y
+# escribe una fila por actividad a medida que terminan. Sale con código 1 si algún fichero
+# falla (las filas con error se escriben igualmente, con 'error' relleno).
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import argparse
+import csv
+import glob
+import json
+import math
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time as dtime
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+FORMATS = ("jsonl", "csv", "parquet")
+
+# Columnas de la salida tabular (CSV/Parquet); JSON Lines añade 'splits' y 'timings'
+SUMMARY_FIELDS = [
+    'file', 'points', 'date', 'start_time', 'end_time', 'distance_km', 'elapsed_time_s',
+    'moving_time_s', 'avg_moving_speed_kmh', 'max_speed_kmh', 'elev_gain_m', 'n_splits',
+    'n_stops', 'stopped_s', 'error',
+]
+
+# Filas por lote al escribir Parquet
+_PARQUET_BATCH = 256
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# EXPAND_INPUTS ==============================================================================
+
+def expand_inputs(inputs) -> list[str]:
+    """
+    Ficheros GPX a partir de rutas, patrones glob y directorios (recorridos
+    recursivamente). Sin duplicados y en orden estable.
+    """
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            found = glob.glob(os.path.join(item, "**", "*.gpx"), recursive=True)
+            found += glob.glob(os.path.join(item, "**", "*.GPX"), recursive=True)
+        elif glob.has_magic(item):
+            found = glob.glob(item, recursive=True)
+        else:
+            found = [item]
+        paths.extend(sorted(found))
+    return list(dict.fromkeys(os.path.normpath(p) for p in paths))
+
+# _JSONABLE ==================================================================================
+
+def _jsonable(value):
+    """Convierte fechas, horas y escalares de NumPy a tipos serializables en JSON."""
+    if isinstance(value, (datetime, date, dtime)):
+        return value.isoformat()
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+# ANALYZE_BYTES ==============================================================================
+
+def analyze_bytes(data: bytes, label: str = "", moving_speed_threshold: float = 0.5, split_km: int = 5,
+                  min_stop_seconds: float = 60, pipe=None, simplify_m: float | None = None) -> dict:
+    """
+    Analiza el contenido de un GPX (parse → metrics → splits / stops) y devuelve una fila
+    serializable con el resumen, los parciales y el tiempo de cada etapa.
+
+    Parámetros
+    ----------
+    data : bytes
+        Contenido del fichero GPX.
+    label : str, opcional
+        Nombre de la actividad (columna 'file').
+    moving_speed_threshold, split_km, min_stop_seconds : opcionales
+        Parámetros de `compute_metrics`, `make_splits` y `detect_stops`.
+    pipe : AnalysisPipeline, opcional
+        Pipeline a reutilizar (p. ej. con `track_cache`). Por defecto, uno nuevo.
+    simplify_m : float, opcional
+        Si se indica, añade 'geometry': la ruta simplificada (RDP, tolerancia en metros)
+        como LineString GeoJSON.
+
+    Notas
+    -----
+    - Nunca lanza: los errores se devuelven en 'error'.
+    """
+    from .pipeline import AnalysisPipeline
+
+    row = dict.fromkeys(SUMMARY_FIELDS)
+    row.update(file=label, splits=[], timings=[])
+    pipe = AnalysisPipeline() if pipe is None else pipe
+    pipe.start_run()
+    try:
+        parsed = pipe.parse(data, label=label)
+        if parsed.value.empty:
+            raise ValueError("el GPX no contiene puntos de track")
+        met = pipe.metrics(parsed, moving_speed_threshold)
+        metrics, df_proc, _ = met.value
+        splits = pipe.splits(met, split_km).value
+        stops = pipe.stops(met, min_stop_seconds).value
+
+        row.update({k: _jsonable(v) for k, v in metrics.items()})
+        row.update(
+            points=len(df_proc),
+            elev_gain_m=_jsonable(df_proc['ele'].diff().clip(lower=0).sum()),
+            n_splits=len(splits),
+            n_stops=len(stops),
+            stopped_s=_jsonable(stops['dur_s'].sum()) if len(stops) else 0.0,
+            splits=[
+                {k: _jsonable(v) for k, v in rec.items()}
+                for rec in splits[['km_inicio', 'dist_moving', 'time_moving', 'elev_gain', 'ritmo_min_km']]
+                .to_dict('records')
+            ] if len(splits) else [],
+        )
+        if simplify_m is not None:
+            import numpy as npy
+            from .geo import simplify_indices
+            lat, lon = df_proc['lat'].to_numpy(dtype=float), df_proc['lon'].to_numpy(dtype=float)
+            keep = simplify_indices(lat, lon, simplify_m)
+            row['geometry'] = {
+                'type': 'LineString',
+                'coordinates': npy.round(npy.column_stack([lon[keep], lat[keep]]), 6).tolist(),
+            }
+    except Exception as e:
+        row['error'] = f"{type(e).__name__}: {e}"
+    row['timings'] = [(t.stage, t.seconds) for t in pipe.timings]
+    return row
+
+# ANALYZE_FILE ===============================================================================
+
+def analyze_file(path: str, moving_speed_threshold: float = 0.5, split_km: int = 5,
+                 min_stop_seconds: float = 60) -> dict:
+    """
+    `analyze_bytes` sobre un fichero. Nunca lanza (un fichero ilegible se devuelve con
+    'error'). Función de nivel de módulo para poder ejecutarse en un `ProcessPoolExecutor`.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        row = dict.fromkeys(SUMMARY_FIELDS)
+        row.update(file=path, splits=[], timings=[], error=f"{type(e).__name__}: {e}")
+        return row
+    return analyze_bytes(data, path, moving_speed_threshold, split_km, min_stop_seconds)
+
+# _ANALYZE_ARGS ==============================================================================
+
+def _analyze_args(args):
+    return analyze_file(*args)
+
+# ============================================================================================
+# ESCRITORES
+# ============================================================================================
+
+class _JsonlWriter:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, row: dict) -> None:
+        self.stream.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.stream.flush()
+
+    def close(self) -> None:
+        pass
+
+class _CsvWriter:
+    def __init__(self, stream):
+        self.writer = csv.DictWriter(stream, fieldnames=SUMMARY_FIELDS, extrasaction="ignore")
+        self.writer.writeheader()
+        self.stream = stream
+
+    def write(self, row: dict) -> None:
+        self.writer.writerow(row)
+        self.stream.flush()
+
+    def close(self) -> None:
+        pass
+
+class _ParquetWriter:
+    """Escribe en lotes de `_PARQUET_BATCH` filas (un row group por lote)."""
+
+    def __init__(self, path: str):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise SystemExit("La salida Parquet requiere pyarrow (pip install pyarrow).") from e
+        self.pa = pa
+        self.schema = pa.schema([
+            ('file', pa.string()), ('points', pa.int64()), ('date', pa.string()),
+            ('start_time', pa.string()), ('end_time', pa.string()), ('distance_km', pa.float64()),
+            ('elapsed_time_s', pa.float64()), ('moving_time_s', pa.float64()),
+            ('avg_moving_speed_kmh', pa.float64()), ('max_speed_kmh', pa.float64()),
+            ('elev_gain_m', pa.float64()), ('n_splits', pa.int64()), ('n_stops', pa.int64()),
+            ('stopped_s', pa.float64()), ('error', pa.string()),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.batch = []
+
+    def write(self, row: dict) -> None:
+        self.batch.append({k: row.get(k) for k in SUMMARY_FIELDS})
+        if len(self.batch) >= _PARQUET_BATCH:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self.batch:
+            self.writer.write_table(self.pa.Table.from_pylist(self.batch, schema=self.schema))
+            self.batch = []
+
+    def close(self) -> None:
+        self._flush()
+        self.writer.close()
+
+# ============================================================================================
+# MAIN
+# ============================================================================================
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m gpxra",
+        description="Analiza ficheros GPX en lote (parse → metrics → splits/stops) sin navegador.",
+    )
+    parser.add_argument("inputs", nargs="+", help="Ficheros .gpx, patrones glob o directorios.")
+    parser.add_argument("-o", "--output", help="Fichero de salida (por defecto, la salida estándar).")
+    parser.add_argument("-f", "--format", choices=FORMATS, default=None,
+                        help="jsonl (por defecto), csv o parquet. Se deduce de la extensión de --output.")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Procesos en paralelo (por defecto, nº de CPUs; 1 = sin pool).")
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="Umbral de movimiento en m/s (por defecto 0.5).")
+    parser.add_argument("--split-km", type=int, default=5, help="Tamaño de los parciales en km (por defecto 5).")
+    parser.add_argument("--min-stop-seconds", type=float, default=60,
+                        help="Duración mínima de una pausa en s (por defecto 60).")
+    parser.add_argument("--profile", action="store_true",
+                        help="Muestra en stderr el tiempo acumulado y medio de cada etapa.")
+    parser.add_argument("-q", "--quiet", action="store_true", help="No muestra el resumen de rendimiento.")
+    return parser
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    fmt = args.format
+    if fmt is None:
+        ext = os.path.splitext(args.output or "")[1].lower().lstrip(".")
+        fmt = ext if ext in FORMATS else "jsonl"
+    if fmt == "parquet" and not args.output:
+        print("error: la salida Parquet necesita --output", file=sys.stderr)
+        return 2
+
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        print("error: no se ha encontrado ningún fichero .gpx", file=sys.stderr)
+        return 2
+
+    stream = None
+    if fmt == "parquet":
+        writer = _ParquetWriter(args.output)
+    else:
+        stream = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+        writer = _JsonlWriter(stream) if fmt == "jsonl" else _CsvWriter(stream)
+
+    jobs = [(p, args.threshold, args.split_km, args.min_stop_seconds) for p in paths]
+    workers = (os.cpu_count() or 1) if args.workers is None else max(1, args.workers)
+    workers = min(workers, len(jobs))
+    stage_time = defaultdict(float)
+    stage_count = defaultdict(int)
+    n_points = n_failed = 0
+
+    t0 = time.perf_counter()
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        # `map` conserva el orden de entrada y entrega cada fila en cuanto está lista
+        results = pool.map(_analyze_args, jobs, chunksize=max(1, len(jobs) // (workers * 8))) \
+            if pool else map(_analyze_args, jobs)
+        for row in results:
+            if row['error']:
+                n_failed += 1
+                print(f"{row['file']}: {row['error']}", file=sys.stderr)
+            n_points += row['points'] or 0
+            for stage, seconds in row['timings']:
+                stage_time[stage] += seconds
+                stage_count[stage] += 1
+            writer.write(row if fmt == "jsonl" else {k: row[k] for k in SUMMARY_FIELDS})
+    finally:
+        if pool:
+            pool.shutdown()
+        writer.close()
+        if stream is not None and stream is not sys.stdout:
+            stream.close()
+    elapsed = time.perf_counter() - t0
+
+    if not args.quiet:
+        print(
+            f"{len(paths)} ficheros ({n_failed} con error) · {n_points} puntos · {elapsed:.2f} s · "
+            f"{len(paths) / elapsed:.1f} ficheros/s · {n_points / elapsed:,.0f} puntos/s · "
+            f"{workers} proceso(s)",
+            file=sys.stderr,
+        )
+    if args.profile:
+        print(f"{'etapa':<10} {'n':>6} {'total (s)':>10} {'media (ms)':>11}", file=sys.stderr)
+        for stage in sorted(stage_time, key=stage_time.get, reverse=True):
+            total = stage_time[stage]
+            print(f"{stage:<10} {stage_count[stage]:>6} {total:>10.3f} {1000 * total / stage_count[stage]:>11.1f}",
+                  file=sys.stderr)
+    return 1 if n_failed else 0
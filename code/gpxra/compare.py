@@ -0,0 +1,255 @@
+# ============================================================================================
+# COMPARE.PY
+# ============================================================================================
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import numpy as npy
+import pandas as pd
+from .resample import resample
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+# Columnas del resultado de `compare_activities` (una fila por actividad y muestra de distancia)
+COMPARISON_COLUMNS = ['track', 'dist', 'km', 'lat', 'lon', 'elapsed_s', 'delta_s']
+
+# Colores de las actividades comparadas (mapa y gráfica usan los mismos); la referencia va primero
+COMPARISON_COLORS = [
+    "#1f77b4", "#d62728", "#2ca02c", "#ff7f0e", "#9467bd", "#8c564b", "#e377c2", "#17becf",
+    "#bcbd22", "#7f7f7f", "#393b79", "#ad494a", "#637939", "#e7969c", "#7b4173", "#3182bd",
+]
+
+# Muestras de cada intento que se emparejan a la vez con la referencia
+_ALIGN_CHUNK = 100
+
+_EARTH_R = 6_371_000.0
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# TRACK_COLORS ===============================================================================
+
+def track_colors(names) -> dict:
+    """Color de cada actividad, en el orden dado (se repiten si hay más que colores)."""
+    return {name: COMPARISON_COLORS[i % len(COMPARISON_COLORS)] for i, name in enumerate(names)}
+
+# _LOCAL_XY ==================================================================================
+
+def _local_xy(lat: npy.ndarray, lon: npy.ndarray, lat0: float):
+    """Proyección equirectangular local (metros); suficiente para emparejar puntos cercanos."""
+    k = npy.radians(1.0) * _EARTH_R
+    return lon * npy.cos(npy.radians(lat0)) * k, lat * k
+
+# ALIGN_TO_REFERENCE =========================================================================
+
+def align_to_reference(ref_grid, grid, every_m: float = 10.0, window_m: float = 500.0,
+                       max_offroute_m: float = 50.0) -> npy.ndarray:
+    """
+    Tiempo en que un intento pasa por cada muestra de la referencia, en segundos desde
+    que llega a la primera muestra emparejada (no cuenta el calentamiento o la
+    aproximación previos a la ruta).
+
+    Parámetros
+    ----------
+    ref_grid, grid : Track | pandas.DataFrame
+        Referencia e intento remuestreados por distancia con el mismo paso
+        (`resample(track, every_m=every_m)`): 'lat', 'lon' y 'time'.
+    every_m : float, opcional
+        Paso de las rejillas (m).
+    window_m : float, opcional
+        Cada muestra del intento se busca en la referencia solo dentro de ±`window_m`
+        de donde se espera que esté. Evita saltos en rutas que se cruzan consigo mismas.
+    max_offroute_m : float, opcional
+        Las muestras a más de esta distancia de la referencia (desvíos) no se emparejan.
+
+    Devuelve
+    --------
+    numpy.ndarray
+        Un valor por muestra de `ref_grid`; NaN en los tramos que el intento no cubre.
+
+    Notas
+    -----
+    - Se recorre el intento por bloques de `_ALIGN_CHUNK` muestras: cada bloque se compara
+    de forma vectorizada con su ventana de la referencia, centrada a partir de la última
+    muestra emparejada (avanzando una muestra de referencia por muestra de intento). En un
+    desvío la posición en la referencia se queda fija hasta que el intento vuelve a ella.
+    - El índice de referencia emparejado se fuerza a no decrecer (`maximum.accumulate`) y
+    el tiempo en cada muestra se interpola con `numpy.interp` desde la primera llegada. El
+    origen de tiempos es el paso por la primera muestra emparejada.
+    - Coste O(n · ventana), lineal en la longitud de la ruta.
+    """
+    ref_lat, ref_lon = npy.asarray(ref_grid['lat'], dtype=float), npy.asarray(ref_grid['lon'], dtype=float)
+    lat, lon = npy.asarray(grid['lat'], dtype=float), npy.asarray(grid['lon'], dtype=float)
+    n_ref, n = len(ref_lat), len(lat)
+    out = npy.full(n_ref, npy.nan)
+    if n_ref == 0 or n == 0:
+        return out
+    lat0 = float(npy.nanmean(ref_lat))
+    rx, ry = _local_xy(ref_lat, ref_lon, lat0)
+    ax, ay = _local_xy(lat, lon, lat0)
+    t = pd.to_datetime(pd.Series(grid['time'])).astype('int64').to_numpy() / 1e9
+    t = t - t[0]
+
+    half = max(1, int(round(window_m / every_m)))
+    offs = npy.arange(-half, half + 1)
+    match = npy.full(n, -1, dtype=npy.int64)
+    # punto de partida: la muestra de referencia más cercana al inicio del intento
+    anchor_ref = int(npy.argmin((rx - ax[0]) ** 2 + (ry - ay[0]) ** 2))
+    anchor_i = 0
+    for a in range(0, n, _ALIGN_CHUNK):
+        b = min(a + _ALIGN_CHUNK, n)
+        center = anchor_ref + (npy.arange(a, b) - anchor_i)
+        cand = npy.clip(center[:, None] + offs, 0, n_ref - 1)
+        d2 = (rx[cand] - ax[a:b, None]) ** 2 + (ry[cand] - ay[a:b, None]) ** 2
+        j = npy.argmin(d2, axis=1)
+        rows = npy.arange(b - a)
+        on_route = d2[rows, j] <= max_offroute_m ** 2
+        match[a:b] = npy.where(on_route, cand[rows, j], -1)
+        if on_route.any():
+            last = int(npy.flatnonzero(on_route)[-1])
+            anchor_ref, anchor_i = int(cand[last, j[last]]), a + last
+        else:
+            anchor_i = b          # desvío: la referencia no avanza
+
+    reached = npy.maximum.accumulate(match)
+    first = (reached >= 0) & npy.concatenate([[True], npy.diff(reached) > 0])
+    if not first.any():
+        return out
+    hits = npy.flatnonzero(first)
+    xp, fp = reached[hits], t[hits]
+    # origen de tiempos: la muestra del intento más cercana a la primera muestra emparejada
+    # (no la primera a `max_offroute_m`, que en una aproximación lenta llega mucho antes)
+    near = npy.arange(hits[0], hits[1] if len(hits) > 1 else n)
+    near = near[match[near] == xp[0]]
+    fp[0] = t[near[npy.argmin((rx[xp[0]] - ax[near]) ** 2 + (ry[xp[0]] - ay[near]) ** 2)]]
+    fp = fp - fp[0]
+    covered = npy.arange(xp[0], xp[-1] + 1)
+    out[covered] = npy.interp(covered, xp, fp)
+    return out
+
+# COMPARE_ACTIVITIES =========================================================================
+
+def compare_activities(reference, tracks: dict, every_m: float = 10.0, window_m: float = 500.0,
+                       max_offroute_m: float = 50.0, reference_name: str = "Referencia") -> pd.DataFrame:
+    """
+    Compara varios intentos de la misma ruta alineándolos por distancia sobre una referencia.
+
+    Parámetros
+    ----------
+    reference : Track | pandas.DataFrame
+        Actividad de referencia (p. ej. el mejor intento).
+    tracks : dict[str, Track | pandas.DataFrame]
+        Intentos a comparar, por nombre. Si incluye la referencia (mismo objeto), se ignora.
+    every_m : float, opcional
+        Resolución de la comparación: una muestra cada `every_m` metros de la referencia.
+    window_m, max_offroute_m : float, opcional
+        Ver `align_to_reference`.
+    reference_name : str, opcional
+        Nombre de la referencia en el resultado.
+
+    Devuelve
+    --------
+    pandas.DataFrame
+        `COMPARISON_COLUMNS`, una fila por actividad (referencia incluida) y muestra cubierta:
+        - dist, km   : distancia sobre la referencia.
+        - lat, lon   : posición de la muestra en la referencia.
+        - elapsed_s  : tiempo desde que la actividad entra en la referencia hasta esa muestra.
+        - delta_s    : `elapsed_s` menos el de la referencia contado desde la misma muestra de
+          entrada (> 0: por detrás; < 0: por delante).
+
+    Ejemplos
+    --------
+    >>> comp = compare_activities(df_best, {"martes": df_a, "jueves": df_b})   # doctest: +SKIP
+    >>> comp.groupby('track')['delta_s'].last()                                 # doctest: +SKIP
+    """
+    ref_grid = resample(reference, every_m=every_m)
+    if len(ref_grid) == 0:
+        return pd.DataFrame(columns=COMPARISON_COLUMNS)
+    ref_dist = ref_grid['dist']
+    ref_lat, ref_lon = ref_grid['lat'], ref_grid['lon']
+    ref_t = align_to_reference(ref_grid, ref_grid, every_m, window_m, max_offroute_m)
+
+    frames = []
+    items = [(reference_name, ref_t)]
+    for name, track in tracks.items():
+        if track is reference:
+            continue
+        grid = resample(track, every_m=every_m)
+        items.append((name, align_to_reference(ref_grid, grid, every_m, window_m, max_offroute_m)))
+    for name, elapsed in items:
+        ok = ~npy.isnan(elapsed)
+        if not ok.any():
+            continue
+        # la referencia se cuenta desde la muestra en la que entra la actividad
+        ref_elapsed = ref_t - ref_t[npy.argmax(ok)]
+        frames.append(pd.DataFrame({
+            'track': name,
+            'dist': ref_dist[ok],
+            'km': ref_dist[ok] / 1000.0,
+            'lat': ref_lat[ok],
+            'lon': ref_lon[ok],
+            'elapsed_s': elapsed[ok],
+            'delta_s': elapsed[ok] - ref_elapsed[ok],
+        }))
+    if not frames:
+        return pd.DataFrame(columns=COMPARISON_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+# COMPARISON_SUMMARY =========================================================================
+
+def comparison_summary(comparison: pd.DataFrame) -> pd.DataFrame:
+    """
+    Una fila por actividad: cobertura de la referencia (%), tiempo y diferencia en el
+    último punto común a todas, y puesto (por la diferencia, comparable también entre
+    actividades que entran en la referencia más adelante).
+    """
+    if comparison.empty:
+        return pd.DataFrame(columns=['rank', 'track', 'coverage_pct', 'common_km', 'elapsed_s', 'delta_s'])
+    ref_name = comparison['track'].iloc[0]
+    n_ref = int((comparison['track'] == ref_name).sum())
+    # último punto de la referencia cubierto por todas las actividades
+    common = comparison.groupby('dist')['track'].nunique()
+    common_dist = common.index[common == comparison['track'].nunique()]
+    end = common_dist.max() if len(common_dist) else comparison['dist'].min()
+    at_end = comparison[comparison['dist'] == end].set_index('track')
+    summary = pd.DataFrame({
+        'track': comparison['track'].unique(),
+    })
+    counts = comparison.groupby('track').size()
+    summary['coverage_pct'] = 100.0 * summary['track'].map(counts) / max(1, n_ref)
+    summary['common_km'] = end / 1000.0
+    summary['elapsed_s'] = summary['track'].map(at_end['elapsed_s'])
+    summary['delta_s'] = summary['track'].map(at_end['delta_s'])
+    summary['rank'] = summary['delta_s'].rank(method='min').astype('Int64')
+    return summary.sort_values(['rank', 'track'])[['rank', 'track', 'coverage_pct', 'common_km',
+                                                   'elapsed_s', 'delta_s']].reset_index(drop=True)
+
+# GHOST_POSITIONS ============================================================================
+
+def ghost_positions(comparison: pd.DataFrame, elapsed_s: float) -> pd.DataFrame:
+    """
+    "Carrera fantasma": dónde estaba cada actividad `elapsed_s` segundos después de su
+    inicio, sobre la referencia (las que ya han terminado se quedan en su último punto).
+
+    Devuelve un DataFrame con 'track', 'km', 'lat', 'lon' y 'delta_s' (diferencia con la
+    referencia en esa posición).
+    """
+    rows = []
+    for name, g in comparison.groupby('track', sort=False):
+        elapsed = g['elapsed_s'].to_numpy()
+        dist = g['dist'].to_numpy()
+        d = npy.interp(elapsed_s, elapsed, dist)
+        rows.append({
+            'track': name,
+            'km': d / 1000.0,
+            'lat': npy.interp(d, dist, g['lat'].to_numpy()),
+            'lon': npy.interp(d, dist, g['lon'].to_numpy()),
+            'delta_s': npy.interp(d, dist, g['delta_s'].to_numpy()),
+        })
+    return pd.DataFrame(rows, columns=['track', 'km', 'lat', 'lon', 'delta_s'])
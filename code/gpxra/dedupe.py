@@ -0,0 +1,429 @@
+# ============================================================================================
+# DEDUPE.PY
+# ============================================================================================
+#
+# Detección de actividades duplicadas en la biblioteca: la misma salida grabada por el
+# reloj, el ciclocomputador y el móvil (hashes distintos, así que `ActivityLibrary` no la
+# reconoce) cuenta dos o tres veces en los totales.
+#
+#   python -m gpxra.dedupe actividades.db
+#
+#   groups = find_duplicates(ActivityLibrary("actividades.db"))
+#
+# Dos fases: candidatos baratos a partir de la tabla de resúmenes (solape de horas, bbox y
+# celda de los puntos de inicio/fin), sin tocar los tracks; y confirmación de cada par con
+# DTW en banda sobre la geometría de la parte común, remuestreada a pocos puntos.
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import argparse
+from collections import OrderedDict
+import numpy as npy
+import pandas as pd
+from .geo import haversine
+from .library import ActivityLibrary
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+# Holgura (s) al cruzar horas: relojes de dispositivos distintos y arranques casi a la vez
+DEFAULT_TIME_SLACK_S = 60.0
+
+# Fracción mínima de la actividad más corta que debe solapar en el tiempo con la otra
+DEFAULT_MIN_OVERLAP = 0.8
+
+# Lado de la celda (m) para los puntos de inicio y fin (también margen de los bbox)
+DEFAULT_GRID_M = 500.0
+
+# Intervalo (s) en que se promedian los puntos de cada traza antes de compararlas: el
+# zigzag del ruido del GPS alarga la distancia de forma distinta en cada dispositivo
+DEFAULT_BIN_S = 10.0
+
+# Puntos de la geometría que se compara y ancho de la banda del DTW (en puntos)
+DEFAULT_POINTS = 128
+DEFAULT_BAND = 12
+
+# Distancia media máxima (m) entre dos trazas para darlas por la misma actividad
+DEFAULT_MAX_MEAN_M = 30.0
+
+# Pares que se comparan a la vez en el DTW vectorizado
+DEFAULT_CHUNK = 512
+
+# Tracks que se mantienen cargados durante la comparación
+_TRACK_CACHE = 256
+
+_EARTH_R = 6_371_000.0
+
+# Columnas del resultado de `duplicate_candidates` / `duplicate_pairs` / `find_duplicates`
+CANDIDATE_COLUMNS = ['hash_a', 'hash_b', 't0', 't1', 'overlap_s']
+GROUP_COLUMNS = ['group', 'hash', 'name', 'sport', 'start', 'distance_km', 'elapsed_time_s',
+                 'points', 'primary']
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# _GRID_CELLS ================================================================================
+
+def _grid_cells(lat: npy.ndarray, lon: npy.ndarray, grid_m: float) -> tuple:
+    """Celda `(ix, iy)` de `grid_m` metros de cada punto (equirectangular local)."""
+    k = npy.radians(1.0) * _EARTH_R / grid_m
+    iy = npy.floor(lat * k)
+    ix = npy.floor(lon * k * npy.cos(npy.radians(lat)))
+    return ix, iy
+
+# DUPLICATE_CANDIDATES =======================================================================
+
+def duplicate_candidates(summary: pd.DataFrame, time_slack_s: float = DEFAULT_TIME_SLACK_S,
+                         min_overlap: float = DEFAULT_MIN_OVERLAP,
+                         grid_m: float = DEFAULT_GRID_M) -> pd.DataFrame:
+    """
+    Pares de actividades que pueden ser la misma, solo a partir de sus resúmenes.
+
+    Parámetros
+    ----------
+    summary : pandas.DataFrame
+        Filas de `ActivityLibrary.query()`: 'hash', 'start_ts', 'end_ts', bbox
+        ('min_lat', …) e inicio/fin ('start_lat', 'start_lon', 'end_lat', 'end_lon').
+    time_slack_s : float, opcional
+        Holgura al comparar horas.
+    min_overlap : float, opcional
+        Fracción de la actividad más corta que debe caer dentro de la otra.
+    grid_m : float, opcional
+        Celda de los puntos de inicio/fin y margen de los bbox.
+
+    Devuelve
+    --------
+    pandas.DataFrame
+        `CANDIDATE_COLUMNS`: los dos hashes (en orden de inicio), el intervalo común
+        `[t0, t1]` (s desde 1970) y su duración.
+
+    Notas
+    -----
+    - Solape de horas: con las actividades ordenadas por inicio, las que empiezan antes
+    de que acabe cada una salen de un `searchsorted` (barrido), sin comparar todos con
+    todos. El resto de filtros son vectorizados sobre los pares.
+    - Los bbox (ampliados `grid_m`) deben cortarse.
+    - Si dos actividades empiezan a la vez (± `time_slack_s`), sus puntos de inicio deben
+    caer en la misma celda o en una vecina; igual con los de fin. Si una empezó más tarde
+    (se encendió el móvil a mitad de ruta), el inicio no se compara.
+    - Las actividades sin hora o sin posición no se consideran.
+    """
+    s = summary.dropna(subset=['start_ts', 'end_ts', 'min_lat', 'start_lat', 'end_lat'])
+    s = s.sort_values('start_ts', kind='stable')
+    start, end = s['start_ts'].to_numpy(dtype=float), s['end_ts'].to_numpy(dtype=float)
+    n = len(s)
+    hi = npy.searchsorted(start, end + time_slack_s, side='right')
+    counts = npy.maximum(hi - npy.arange(n) - 1, 0)
+    if n < 2 or not counts.any():
+        return pd.DataFrame(columns=CANDIDATE_COLUMNS)
+    i = npy.repeat(npy.arange(n), counts)
+    first = npy.cumsum(counts) - counts
+    j = i + 1 + npy.arange(len(i)) - npy.repeat(first, counts)
+
+    t0, t1 = npy.maximum(start[i], start[j]), npy.minimum(end[i], end[j])
+    overlap = t1 - t0
+    shorter = npy.minimum(end[i] - start[i], end[j] - start[j])
+    ok = (overlap > 0) & (overlap >= min_overlap * shorter)
+
+    lat_min, lat_max = s['min_lat'].to_numpy(dtype=float), s['max_lat'].to_numpy(dtype=float)
+    lon_min, lon_max = s['min_lon'].to_numpy(dtype=float), s['max_lon'].to_numpy(dtype=float)
+    m_lat = grid_m / (npy.radians(1.0) * _EARTH_R)
+    m_lon = m_lat / npy.maximum(npy.cos(npy.radians(lat_max[i])), 1e-6)
+    ok &= (lat_min[i] <= lat_max[j] + m_lat) & (lat_min[j] <= lat_max[i] + m_lat)
+    ok &= (lon_min[i] <= lon_max[j] + m_lon) & (lon_min[j] <= lon_max[i] + m_lon)
+
+    for when, lat_col, lon_col in ((start, 'start_lat', 'start_lon'), (end, 'end_lat', 'end_lon')):
+        ix, iy = _grid_cells(s[lat_col].to_numpy(dtype=float), s[lon_col].to_numpy(dtype=float), grid_m)
+        together = npy.abs(when[i] - when[j]) <= time_slack_s
+        near = (npy.abs(ix[i] - ix[j]) <= 1) & (npy.abs(iy[i] - iy[j]) <= 1)
+        ok &= ~together | near
+
+    hashes = s['hash'].to_numpy()
+    i, j = i[ok], j[ok]
+    return pd.DataFrame({'hash_a': hashes[i], 'hash_b': hashes[j], 't0': t0[ok], 't1': t1[ok],
+                         'overlap_s': overlap[ok]}, columns=CANDIDATE_COLUMNS)
+
+# _TRACK_LINE ================================================================================
+
+def _track_line(track, bin_s: float) -> tuple | None:
+    """
+    Traza simplificada de un track: `(t, lat, lon, d)` con la media de sus puntos (con
+    hora y posición) en cada intervalo de `bin_s` segundos y `d` la distancia acumulada a
+    lo largo de esas medias. None si no hay al menos dos puntos.
+    """
+    time = pd.Series(track['time']).to_numpy(dtype='datetime64[ns]')
+    lat = npy.asarray(track['lat'], dtype=float)
+    lon = npy.asarray(track['lon'], dtype=float)
+    ok = ~npy.isnat(time) & npy.isfinite(lat) & npy.isfinite(lon)
+    if ok.sum() < 2:
+        return None
+    t, lat, lon = time[ok].view('int64') / 1e9, lat[ok], lon[ok]
+    bins = npy.unique(npy.floor(t / bin_s), return_inverse=True)[1]
+    counts = npy.bincount(bins)
+    t, lat, lon = (npy.bincount(bins, weights=v) / counts for v in (t, lat, lon))
+    d = npy.concatenate([[0.0], npy.cumsum(haversine(lat[:-1], lon[:-1], lat[1:], lon[1:]))])
+    return t, lat, lon, d
+
+# _WINDOW_GEOMETRY ===========================================================================
+
+def _window_geometry(line: tuple, t0: float, t1: float, lat0: float, n_points: int):
+    """
+    Tramo `[t0, t1]` de una traza (`_track_line`), remuestreado a `n_points` puntos
+    equiespaciados en distancia y proyectado en metros alrededor de `lat0`: array
+    `(n_points, 2)`, o None si la traza no llega a ese intervalo.
+    """
+    t, lat, lon, d = line
+    if t1 < t[0] or t0 > t[-1]:
+        return None
+    d0, d1 = npy.interp([t0, t1], t, d)                  # t creciente: medias por intervalo
+    keep = npy.concatenate([[True], npy.diff(d) > 0])
+    grid = npy.linspace(d0, d1, n_points)
+    k = npy.radians(1.0) * _EARTH_R
+    x = npy.interp(grid, d[keep], lon[keep]) * k * npy.cos(npy.radians(lat0))
+    y = npy.interp(grid, d[keep], lat[keep]) * k
+    return npy.stack([x, y], axis=-1)
+
+# _SEGMENT_DISTANCE ==========================================================================
+
+def _segment_distance(p: npy.ndarray, a: npy.ndarray, b: npy.ndarray) -> npy.ndarray:
+    """Distancia de los puntos `p` a los segmentos `[a, b]` (arrays `(..., 2)`)."""
+    ab, ap = b - a, p - a
+    seg2 = (ab ** 2).sum(axis=-1)
+    t = npy.clip(npy.divide((ap * ab).sum(axis=-1), seg2, out=npy.zeros_like(seg2), where=seg2 > 0), 0.0, 1.0)
+    return npy.sqrt(((ap - t[..., None] * ab) ** 2).sum(axis=-1))
+
+# BANDED_DTW =================================================================================
+
+def banded_dtw(X: npy.ndarray, Y: npy.ndarray, band: int = DEFAULT_BAND) -> npy.ndarray:
+    """
+    Distancia DTW media (m) entre pares de trazas de la misma longitud, restringida a una
+    banda `|i - j| <= band`. El coste de emparejar `X[i]` con `Y[j]` es la distancia de
+    `X[i]` al segmento `Y[j]`–`Y[j+1]`: no depende de en qué punto de la ruta cae cada
+    muestra (dos remuestreos de la misma traza desfasados medio paso dan ~0).
+
+    Parámetros
+    ----------
+    X, Y : numpy.ndarray
+        Trazas `(P, L, 2)` (P pares de L puntos, en metros).
+    band : int, opcional
+        Desfase máximo (en puntos) entre los puntos emparejados.
+
+    Devuelve
+    --------
+    numpy.ndarray
+        Coste DTW de cada par dividido entre L: la distancia media entre puntos
+        emparejados (0 para trazas iguales).
+
+    Notas
+    -----
+    - Solo se calculan las 2·band + 1 celdas de la banda por fila, y solo se guarda la
+    fila anterior: memoria `(P, 2·band + 1)`.
+    - La recurrencia `C[i, j] = D[i, j] + min(C[i-1, j-1], C[i-1, j], C[i, j-1])` se
+    resuelve fila a fila para todos los pares a la vez. Dentro de la fila, la dependencia
+    de `C[i, j-1]` es un mínimo prefijo: con `S` la suma acumulada de `D` en la fila,
+    `C[i, j] = S[j] + min_{k <= j}(prev[k] - S[k-1])` (`minimum.accumulate`), así que no
+    hay bucle por columna.
+    """
+    X, Y = npy.asarray(X, dtype=float), npy.asarray(Y, dtype=float)
+    P, L, _ = X.shape
+    width = 2 * band + 1
+    offs = npy.arange(width) - band                 # j = i + offs
+    cost = None
+    for i in range(L):
+        j = i + offs
+        valid = (j >= 0) & (j < L)
+        jc = npy.clip(j, 0, L - 1)
+        D = _segment_distance(X[:, i, None, :], Y[:, jc, :], Y[:, npy.minimum(jc + 1, L - 1), :])
+        D[:, ~valid] = 0.0
+        if cost is None:                            # fila 0: solo desde (0, 0) hacia la derecha
+            prev = npy.full((P, width), npy.inf)
+            prev[:, band] = 0.0
+        else:                                       # C[i-1, j] está en offs + 1; C[i-1, j-1] en offs
+            up = npy.concatenate([cost[:, 1:], npy.full((P, 1), npy.inf)], axis=1)
+            prev = npy.minimum(cost, up)
+        prev[:, j < 0] = npy.inf
+        S = npy.cumsum(D, axis=1)
+        S_before = S - D
+        cost = S + npy.minimum.accumulate(prev - S_before, axis=1)
+        cost[:, ~valid] = npy.inf
+    return cost[:, band] / L
+
+# DUPLICATE_PAIRS ============================================================================
+
+def duplicate_pairs(library: ActivityLibrary, summary: pd.DataFrame | None = None,
+                    time_slack_s: float = DEFAULT_TIME_SLACK_S, min_overlap: float = DEFAULT_MIN_OVERLAP,
+                    grid_m: float = DEFAULT_GRID_M, bin_s: float = DEFAULT_BIN_S, n_points: int = DEFAULT_POINTS,
+                    band: int = DEFAULT_BAND, max_mean_m: float = DEFAULT_MAX_MEAN_M,
+                    chunk: int = DEFAULT_CHUNK) -> pd.DataFrame:
+    """
+    Candidatos (`duplicate_candidates`) confirmados con la geometría de sus tracks.
+
+    Parámetros
+    ----------
+    library : ActivityLibrary
+        Biblioteca con los tracks guardados.
+    summary : pandas.DataFrame, opcional
+        Resúmenes a considerar (por defecto, toda la biblioteca: `library.query()`).
+    bin_s : float, opcional
+        Intervalo (s) en que se promedian los puntos de cada traza.
+    n_points, band : int, opcional
+        Puntos de la geometría comparada y banda del DTW (`banded_dtw`).
+    max_mean_m : float, opcional
+        Distancia media máxima para confirmar el par.
+    chunk : int, opcional
+        Pares por lote del DTW vectorizado.
+    time_slack_s, min_overlap, grid_m : opcional
+        Ver `duplicate_candidates`.
+
+    Devuelve
+    --------
+    pandas.DataFrame
+        `CANDIDATE_COLUMNS` más 'mean_m' (distancia media; NaN si falta algún track o no
+        tiene puntos en la parte común) y 'duplicate'.
+
+    Notas
+    -----
+    - Solo se compara el intervalo de tiempo común: si el móvil se encendió a mitad de
+    ruta, su traza se compara con el mismo tramo del reloj, no con la ruta entera.
+    - Cada traza se simplifica promediando sus puntos por intervalos de `bin_s` (los
+    mismos instantes en todos los dispositivos): el zigzag del ruido alarga la distancia
+    de forma distinta en cada uno y desalinearía el remuestreo. El tramo común se remuestrea a `n_points` puntos equiespaciados en
+    distancia (coste fijo por par, sea cual sea su nº de puntos); la banda del DTW absorbe
+    diferencias de hasta `band / n_points` (~10%).
+    - Los tracks se cargan una vez (LRU de `_TRACK_CACHE`): los candidatos vienen
+    ordenados por hora, así que cada track se usa en pares cercanos.
+    """
+    if summary is None:
+        summary = library.query()
+    pairs = duplicate_candidates(summary, time_slack_s, min_overlap, grid_m)
+    pairs['mean_m'] = npy.nan
+    if pairs.empty:
+        pairs['duplicate'] = pd.Series(dtype=bool)
+        return pairs
+
+    loaded: OrderedDict = OrderedDict()
+
+    def line(hash):
+        if hash in loaded:
+            loaded.move_to_end(hash)
+            return loaded[hash]
+        track = library.track(hash)
+        value = _track_line(track, bin_s) if track is not None else None
+        loaded[hash] = value
+        while len(loaded) > _TRACK_CACHE:
+            loaded.popitem(last=False)
+        return value
+
+    chunk = max(1, int(chunk))
+    scores = pairs['mean_m'].to_numpy(copy=True)
+    rows = list(zip(pairs['hash_a'], pairs['hash_b'], pairs['t0'], pairs['t1']))
+    for c in range(0, len(rows), chunk):
+        idx, X, Y = [], [], []
+        for r, (ha, hb, t0, t1) in enumerate(rows[c:c + chunk], start=c):
+            a, b = line(ha), line(hb)
+            if a is None or b is None:
+                continue
+            lat0 = float(a[1][0])
+            ga = _window_geometry(a, t0, t1, lat0, n_points)
+            gb = _window_geometry(b, t0, t1, lat0, n_points)
+            if ga is None or gb is None:
+                continue
+            idx.append(r)
+            X.append(ga)
+            Y.append(gb)
+        if idx:
+            scores[idx] = banded_dtw(npy.stack(X), npy.stack(Y), band)
+    pairs['mean_m'] = scores
+    pairs['duplicate'] = scores <= max_mean_m
+    return pairs
+
+# FIND_DUPLICATES ============================================================================
+
+def find_duplicates(library: ActivityLibrary, summary: pd.DataFrame | None = None, **kwargs) -> pd.DataFrame:
+    """
+    Grupos de actividades duplicadas de la biblioteca.
+
+    Parámetros
+    ----------
+    library : ActivityLibrary
+        Biblioteca.
+    summary : pandas.DataFrame, opcional
+        Resúmenes a considerar (por defecto, toda la biblioteca).
+    **kwargs
+        Umbrales de `duplicate_pairs`.
+
+    Devuelve
+    --------
+    pandas.DataFrame
+        `GROUP_COLUMNS`, una fila por actividad que tiene algún duplicado. 'group' numera
+        los grupos (componentes conexas de los pares confirmados) y 'primary' marca la
+        que se conserva en cada uno: la de más duración y, a igualdad, más puntos.
+
+    Ejemplos
+    --------
+    >>> groups = find_duplicates(ActivityLibrary("actividades.db"))            # doctest: +SKIP
+    >>> extra = groups.loc[~groups['primary'], 'hash']                         # doctest: +SKIP
+    >>> lib.query().query("hash not in @extra")['distance_km'].sum()           # doctest: +SKIP
+    """
+    if summary is None:
+        summary = library.query()
+    pairs = duplicate_pairs(library, summary, **kwargs)
+    pairs = pairs[pairs['duplicate']]
+    if pairs.empty:
+        return pd.DataFrame(columns=GROUP_COLUMNS)
+
+    parent = {}
+
+    def root(h):
+        parent.setdefault(h, h)
+        while parent[h] != h:
+            parent[h] = parent[parent[h]]
+            h = parent[h]
+        return h
+
+    for a, b in zip(pairs['hash_a'], pairs['hash_b']):
+        ra, rb = root(a), root(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+
+    members = summary[summary['hash'].isin(list(parent))].copy()
+    members['root'] = [root(h) for h in members['hash']]
+    members = members.sort_values(['start_ts', 'hash'])
+    members['group'] = pd.factorize(members['root'])[0]
+    members = members.sort_values(['group', 'elapsed_time_s', 'points'], ascending=[True, False, False])
+    members['primary'] = ~members['group'].duplicated()
+    if 'start' not in members:
+        members['start'] = pd.to_datetime(members['start_ts'], unit='s', utc=True)
+    return members[GROUP_COLUMNS].reset_index(drop=True)
+
+# ============================================================================================
+# CLI
+# ============================================================================================
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m gpxra.dedupe",
+                                     description="Busca actividades duplicadas en la biblioteca.")
+    parser.add_argument("library", help="Base de datos SQLite de la biblioteca.")
+    parser.add_argument("--max-mean-m", type=float, default=DEFAULT_MAX_MEAN_M,
+                        help="Distancia media máxima (m) entre trazas duplicadas.")
+    parser.add_argument("--min-overlap", type=float, default=DEFAULT_MIN_OVERLAP,
+                        help="Fracción mínima de la actividad más corta que solapa con la otra.")
+    parser.add_argument("--output", default=None, help="CSV con los grupos (por defecto, se muestran).")
+    args = parser.parse_args(argv)
+
+    with ActivityLibrary(args.library) as library:
+        groups = find_duplicates(library, max_mean_m=args.max_mean_m, min_overlap=args.min_overlap)
+    if args.output:
+        groups.to_csv(args.output, index=False)
+    n_groups = groups['group'].nunique() if len(groups) else 0
+    print(f"{n_groups} grupos, {int((~groups['primary']).sum()) if len(groups) else 0} actividades sobrantes")
+    if not args.output and len(groups):
+        print(groups.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
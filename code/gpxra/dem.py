@@ -0,0 +1,237 @@
+# ============================================================================================
+# DEM.PY
+# ============================================================================================
+#
+# Corrección de altitud con un modelo digital de elevaciones local (teselas SRTM `.hgt`),
+# sin conexión: la altitud del GPS sin barómetro es ruidosa y dispara el desnivel.
+#
+#   tiles = dem_tiles("/datos/srtm")
+#   df_dem = correct_elevation(parse_gpx(f), tiles)
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import os
+import threading
+from collections import OrderedDict
+import numpy as npy
+import pandas as pd
+from .profiling import profiled
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+# Directorio de teselas por defecto (configurable con GPXRA_DEM_DIR; vacío = sin DEM)
+DEFAULT_DEM_DIR = os.environ.get("GPXRA_DEM_DIR", "")
+
+# Teselas abiertas a la vez (cada una es un `numpy.memmap`: solo ocupa las páginas leídas)
+DEFAULT_MAX_OPEN = 32
+
+# Valor de "sin dato" de SRTM
+HGT_VOID = -32768
+
+# Lado de la rejilla según el tamaño del fichero: SRTM1 (1") y SRTM3 (3")
+_HGT_SIDES = {3601 * 3601 * 2: 3601, 1201 * 1201 * 2: 1201}
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# HGT_NAME ===================================================================================
+
+def hgt_name(lat0: int, lon0: int) -> str:
+    """Nombre SRTM de la tesela cuya esquina suroeste es `(lat0, lon0)`: 'N43W003.hgt'."""
+    ns, ew = ("N" if lat0 >= 0 else "S"), ("E" if lon0 >= 0 else "W")
+    return f"{ns}{abs(lat0):02d}{ew}{abs(lon0):03d}.hgt"
+
+# ============================================================================================
+# DEMTILES
+# ============================================================================================
+
+class DEMTiles:
+    """
+    Teselas SRTM `.hgt` de un directorio, leídas bajo demanda con `numpy.memmap`.
+
+    Cada `.hgt` es una rejilla cuadrada de enteros int16 big-endian (1201² o 3601²) que
+    cubre 1°×1°; la fila 0 es el borde norte y la columna 0 el oeste. Las teselas se abren
+    al primer uso y se mantienen abiertas en una LRU de `max_open`; las que no existen se
+    recuerdan como ausentes (sin volver a mirar el disco).
+
+    Parámetros
+    ----------
+    directory : str
+        Directorio con las teselas (`N43W003.hgt`, …; también en minúsculas).
+    max_open : int, opcional
+        Teselas abiertas a la vez. Por defecto 32.
+
+    Ejemplos
+    --------
+    >>> tiles = DEMTiles("/datos/srtm")                     # doctest: +SKIP
+    >>> tiles.sample(npy.array([43.26]), npy.array([-2.93]))  # doctest: +SKIP
+    array([12.4])
+    """
+
+    def __init__(self, directory: str, max_open: int = DEFAULT_MAX_OPEN):
+        self.directory = directory
+        self.max_open = max(1, int(max_open))
+        self._open: OrderedDict = OrderedDict()    # (lat0, lon0) → memmap | None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, lat0: int, lon0: int) -> str | None:
+        name = hgt_name(lat0, lon0)
+        for candidate in (name, name.lower()):
+            path = os.path.join(self.directory, candidate)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def tile(self, lat0: int, lon0: int):
+        """Rejilla (`numpy.memmap` de solo lectura) de la tesela, o None si no está."""
+        key = (int(lat0), int(lon0))
+        with self._lock:
+            if key in self._open:
+                self._open.move_to_end(key)
+                self.hits += 1
+                return self._open[key]
+            self.misses += 1
+            path = self._path(*key)
+            grid = None
+            if path is not None:
+                side = _HGT_SIDES.get(os.path.getsize(path))
+                if side is None:
+                    raise ValueError(f"{path}: tamaño de tesela .hgt no reconocido")
+                grid = npy.memmap(path, dtype=">i2", mode="r", shape=(side, side))
+            self._open[key] = grid
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)     # el memmap se cierra al liberarse
+            return grid
+
+    def sample(self, lat, lon) -> npy.ndarray:
+        """
+        Altitud del DEM (m) en cada punto, con interpolación bilineal entre las cuatro
+        celdas que lo rodean. NaN fuera de las teselas disponibles o sin dato.
+
+        Notas
+        -----
+        - Vectorizada: los puntos se agrupan por tesela (casi siempre una o dos por
+        actividad) y cada grupo se interpola con cuatro lecturas por índice del memmap,
+        que solo tocan las páginas de disco necesarias.
+        - Si alguna de las cuatro celdas es "sin dato", se interpola con las demás
+        (pesos renormalizados).
+        """
+        lat = npy.asarray(lat, dtype=float)
+        lon = npy.asarray(lon, dtype=float)
+        out = npy.full(lat.shape, npy.nan)
+        valid = npy.isfinite(lat) & npy.isfinite(lon)
+        if not valid.any():
+            return out
+        idx = npy.flatnonzero(valid)
+        lat_v, lon_v = lat[idx], lon[idx]
+        keys = (npy.floor(lat_v).astype(npy.int64) + 90) * 360 + (npy.floor(lon_v).astype(npy.int64) + 180)
+        if keys.min() == keys.max():                   # caso habitual: una sola tesela
+            groups = [(int(keys[0]), slice(None))]
+        else:
+            order = npy.argsort(keys, kind="stable")
+            bounds = npy.flatnonzero(npy.diff(keys[order])) + 1
+            groups = [(int(keys[part[0]]), part) for part in npy.split(order, bounds)]
+        for key, sel in groups:
+            lat0, lon0 = key // 360 - 90, key % 360 - 180
+            grid = self.tile(lat0, lon0)
+            if grid is not None:
+                out[idx[sel]] = _bilinear(grid, lat_v[sel], lon_v[sel], lat0, lon0)
+        return out
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'open': sum(g is not None for g in self._open.values()),
+                    'missing': sum(g is None for g in self._open.values()),
+                    'hits': self.hits, 'misses': self.misses}
+
+# _BILINEAR ==================================================================================
+
+def _bilinear(grid, lat: npy.ndarray, lon: npy.ndarray, lat0: int, lon0: int) -> npy.ndarray:
+    """Interpolación bilineal en una tesela (ver `DEMTiles.sample`)."""
+    n = grid.shape[0] - 1
+    row = (lat0 + 1 - lat) * n
+    col = (lon - lon0) * n
+    r0 = npy.clip(npy.floor(row).astype(npy.int64), 0, n - 1)
+    c0 = npy.clip(npy.floor(col).astype(npy.int64), 0, n - 1)
+    fr, fc = row - r0, col - c0
+    values = npy.stack([grid[r0, c0], grid[r0, c0 + 1], grid[r0 + 1, c0], grid[r0 + 1, c0 + 1]]).astype(float)
+    weights = npy.stack([(1 - fr) * (1 - fc), (1 - fr) * fc, fr * (1 - fc), fr * fc])
+    void = values == HGT_VOID
+    if void.any():
+        weights = npy.where(void, 0.0, weights)
+        values = npy.where(void, 0.0, values)
+        total = weights.sum(axis=0)
+        with npy.errstate(invalid="ignore", divide="ignore"):
+            return npy.where(total > 0, (weights * values).sum(axis=0) / total, npy.nan)
+    return (weights * values).sum(axis=0)
+
+# DEM_TILES ==================================================================================
+
+_SHARED = {}
+_SHARED_LOCK = threading.Lock()
+
+def dem_tiles(directory: str) -> DEMTiles:
+    """Los `DEMTiles` únicos del proceso para `directory` (se crean en el primer uso)."""
+    key = os.path.abspath(directory)
+    with _SHARED_LOCK:
+        if key not in _SHARED:
+            _SHARED[key] = DEMTiles(key)
+        return _SHARED[key]
+
+# CORRECT_ELEVATION ==========================================================================
+
+@profiled()
+def correct_elevation(df: pd.DataFrame, tiles: DEMTiles | str, keep_gps: bool = True) -> pd.DataFrame:
+    """
+    Sustituye la altitud del GPS por la del DEM.
+
+    Parámetros
+    ----------
+    df : pandas.DataFrame
+        Puntos con 'lat', 'lon' y 'ele' (`parse_gpx`).
+    tiles : DEMTiles | str
+        Teselas, o el directorio que las contiene (se usa `dem_tiles(directorio)`).
+    keep_gps : bool, opcional
+        Conservar la altitud original en 'ele_gps'. Por defecto True.
+
+    Devuelve
+    --------
+    pandas.DataFrame
+        Copia de `df` con 'ele' del DEM. Donde no hay tesela (o dato) se mantiene la del
+        GPS. `attrs['ele_source']` es la fracción de puntos corregidos (0–1).
+
+    Notas
+    -----
+    - Se aplica después de `parse_gpx` y antes de `compute_metrics`: el desnivel de los
+    parciales (`make_splits`), la pendiente y el modo de mapa "Altitud" usan la altitud
+    corregida.
+    - Coste: del orden de 1M puntos/s por núcleo con las teselas ya en la caché de
+    páginas del sistema operativo.
+
+    Ejemplos
+    --------
+    >>> df_dem = correct_elevation(parse_gpx(f), "/datos/srtm")   # doctest: +SKIP
+    >>> metrics, df_proc, splits = compute_metrics(df_dem)       # doctest: +SKIP
+    """
+    if isinstance(tiles, str):
+        tiles = dem_tiles(tiles)
+    out = df.copy()
+    if out.empty:
+        return out
+    dem = tiles.sample(out['lat'].to_numpy(dtype=float, na_value=npy.nan),
+                       out['lon'].to_numpy(dtype=float, na_value=npy.nan))
+    found = ~npy.isnan(dem)
+    gps = out['ele'].to_numpy(dtype=float, na_value=npy.nan) if 'ele' in out else npy.full(len(out), npy.nan)
+    if keep_gps:
+        out['ele_gps'] = gps
+    out['ele'] = npy.where(found, dem, gps)
+    out.attrs['ele_source'] = float(found.mean())
+    return out
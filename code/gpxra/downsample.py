@@ -0,0 +1,163 @@
+# ============================================================================================
+# DOWNSAMPLE.PY
+# ============================================================================================
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import numpy as npy
+import pandas as pd
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# _BUCKET_EDGES ==============================================================================
+
+def _bucket_edges(n: int, n_buckets: int, first: int = 0) -> npy.ndarray:
+    """Límites de `n_buckets` cubetas de tamaño (casi) igual sobre `n` índices desde `first`."""
+    return first + npy.floor(npy.linspace(0, n, n_buckets + 1)).astype(npy.int64)
+
+# LTTB_INDICES ===============================================================================
+
+def lttb_indices(x, y, n_out: int) -> npy.ndarray:
+    """
+    Índices seleccionados por *Largest-Triangle-Three-Buckets* (Steinarsson, 2013).
+
+    Conserva el primer y el último punto y, en cada una de las `n_out - 2` cubetas
+    intermedias, el punto que forma el triángulo de mayor área con el punto elegido en la
+    cubeta anterior y la media de la siguiente. Mantiene la forma visual de la serie
+    (picos incluidos) con un número fijo de puntos.
+
+    Parámetros
+    ----------
+    x, y : array-like
+        Eje (p. ej. km, creciente) y valores. Se ignoran los puntos con `y` NaN.
+    n_out : int
+        Número de puntos a conservar (≥ 3).
+
+    Devuelve
+    --------
+    numpy.ndarray[int64]
+        Índices (crecientes) de los puntos seleccionados.
+
+    Notas
+    -----
+    - Solo el recorrido por cubetas es secuencial (`n_out` iteraciones); cada cubeta se
+    evalúa de forma vectorizada, de modo que el coste total es O(n).
+    """
+
+    x = npy.asarray(x, dtype=float)
+    y = npy.asarray(y, dtype=float)
+    valid = npy.flatnonzero(~npy.isnan(y))
+    n = len(valid)
+    if n <= n_out or n_out < 3:
+        return valid
+    xv, yv = x[valid], y[valid]
+
+    edges = _bucket_edges(n - 2, n_out - 2, first=1)
+    # medias de cada cubeta (para el "tercer vértice" del triángulo)
+    sizes = npy.diff(edges)
+    mean_x = npy.add.reduceat(xv[1:n - 1], edges[:-1] - 1) / sizes
+    mean_y = npy.add.reduceat(yv[1:n - 1], edges[:-1] - 1) / sizes
+    mean_x = npy.append(mean_x, xv[-1])
+    mean_y = npy.append(mean_y, yv[-1])
+
+    selected = npy.empty(n_out, dtype=npy.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        cx, cy = mean_x[b + 1], mean_y[b + 1]
+        area = npy.abs((xv[a] - cx) * (yv[lo:hi] - yv[a]) - (xv[a] - xv[lo:hi]) * (cy - yv[a]))
+        a = lo + int(npy.argmax(area))
+        selected[b + 1] = a
+    return valid[selected]
+
+# MINMAX_INDICES =============================================================================
+
+def minmax_indices(x, y, n_out: int) -> npy.ndarray:
+    """
+    Índices del mínimo y el máximo de cada cubeta (`n_out // 2` cubetas), más el primer y
+    el último punto. Garantiza que ningún extremo local desaparece; útil para series con
+    picos estrechos (HR, velocidad). Totalmente vectorizado (`reduceat`).
+    """
+
+    y = npy.asarray(y, dtype=float)
+    valid = npy.flatnonzero(~npy.isnan(y))
+    n = len(valid)
+    if n <= n_out or n_out < 4:
+        return valid
+    yv = y[valid]
+
+    n_buckets = max(1, (n_out - 2) // 2)
+    edges = _bucket_edges(n, n_buckets)
+    starts, sizes = edges[:-1], npy.diff(edges)
+    bucket = npy.repeat(npy.arange(n_buckets), sizes)
+    mins = npy.minimum.reduceat(yv, starts)
+    maxs = npy.maximum.reduceat(yv, starts)
+    # primer índice de cada cubeta que alcanza su mínimo / máximo
+    _, i_min = npy.unique(bucket[yv == mins[bucket]], return_index=True)
+    _, i_max = npy.unique(bucket[yv == maxs[bucket]], return_index=True)
+    hit_min = npy.flatnonzero(yv == mins[bucket])[i_min]
+    hit_max = npy.flatnonzero(yv == maxs[bucket])[i_max]
+    keep = npy.unique(npy.concatenate([[0, n - 1], hit_min, hit_max]))
+    return valid[keep]
+
+# DOWNSAMPLE_FRAME ===========================================================================
+
+DOWNSAMPLE_METHODS = {
+    "lttb": lttb_indices,
+    "minmax": minmax_indices,
+}
+
+def downsample_frame(df: pd.DataFrame, x: str = 'km', columns=None, n_points: int = 1000,
+                     method: str = "lttb") -> pd.DataFrame:
+    """
+    Reduce un DataFrame de series a ~`n_points` filas por columna conservando su forma.
+
+    Parámetros
+    ----------
+    df : pandas.DataFrame
+        Datos ordenados por `x`.
+    x : str, opcional
+        Columna del eje horizontal. Por defecto 'km'.
+    columns : list[str], opcional
+        Series a conservar. Por defecto, todas las numéricas salvo `x`.
+    n_points : int, opcional
+        Puntos objetivo por serie. Por defecto 1000.
+    method : str, opcional
+        "lttb" (por defecto) o "minmax".
+
+    Devuelve
+    --------
+    pandas.DataFrame
+        Filas de `df` seleccionadas (unión de los índices elegidos para cada serie,
+        más el mínimo y el máximo global de cada una), en orden. El tamaño queda
+        acotado por ~`n_points × len(columns)`, sea cual sea la longitud del track.
+
+    Ejemplos
+    --------
+    >>> small = downsample_frame(chart_df, 'km', ['ele', 'speed_kmh'], n_points=800)  # doctest: +SKIP
+    """
+
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"Método de submuestreo desconocido: {method!r} (usa {list(DOWNSAMPLE_METHODS)})")
+    if columns is None:
+        columns = [c for c in df.select_dtypes('number').columns if c != x]
+    if len(df) <= n_points or not columns:
+        return df
+
+    pick = DOWNSAMPLE_METHODS[method]
+    xs = df[x].to_numpy(dtype=float)
+    chosen = []
+    for c in columns:
+        ys = df[c].to_numpy(dtype=float)
+        chosen.append(pick(xs, ys, n_points))
+        if not npy.isnan(ys).all():
+            # los extremos globales siempre se conservan (la cima, la velocidad máxima, …)
+            chosen.append([npy.nanargmin(ys), npy.nanargmax(ys)])
+    keep = npy.unique(npy.concatenate(chosen).astype(npy.int64))
+    return df.iloc[keep]
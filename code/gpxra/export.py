@@ -0,0 +1,232 @@
+# ============================================================================================
+# EXPORT.PY
+# ============================================================================================
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import io
+from xml.sax.saxutils import escape
+import numpy as npy
+import pandas as pd
+from .geo import simplify_indices
+from .io import segment_offsets
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+# Columnas por punto que se exportan (las que falten se omiten)
+POINT_COLUMNS = ['time', 'lat', 'lon', 'ele', 'dist', 'd_dist', 'dt', 'speed', 'moving', 'hr', 'cad']
+
+# Filas por bloque al serializar: acota la memoria temporal sea cual sea el tamaño del track
+CHUNK_ROWS = 50_000
+
+# Formato → (extensión, tipo MIME)
+EXPORT_FORMATS = {
+    "csv": ("csv", "text/csv"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+    "gpx": ("gpx", "application/gpx+xml"),
+}
+
+_GPX_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<gpx version="1.1" creator="GPX Route Analyzer" '
+    'xmlns="http://www.topografix.com/GPX/1/1" '
+    'xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1">\n'
+)
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# _POINT_COLUMNS =============================================================================
+
+def _point_columns(df: pd.DataFrame, columns=None) -> list[str]:
+    return [c for c in (POINT_COLUMNS if columns is None else columns) if c in df.columns]
+
+# _CHUNKS ====================================================================================
+
+def _chunks(n: int, chunk_rows: int):
+    """Límites `(a, b)` de bloques de `chunk_rows` filas sobre `n` filas."""
+    step = max(1, int(chunk_rows))
+    for a in range(0, n, step):
+        yield a, min(a + step, n)
+
+# ITER_CSV ===================================================================================
+
+def iter_csv(df: pd.DataFrame, columns=None, chunk_rows: int = CHUNK_ROWS):
+    """
+    Serializa los puntos a CSV (UTF-8) por bloques.
+
+    Devuelve
+    --------
+    Iterator[bytes]
+        La cabecera y luego un bloque por cada `chunk_rows` filas.
+    """
+    cols = _point_columns(df, columns)
+    yield (",".join(cols) + "\n").encode("utf-8")
+    for a, b in _chunks(len(df), chunk_rows):
+        # filas primero: `df[cols]` copiaría el DataFrame entero en cada bloque
+        yield df.iloc[a:b][cols].to_csv(index=False, header=False).encode("utf-8")
+
+# WRITE_PARQUET ==============================================================================
+
+def write_parquet(df: pd.DataFrame, file, columns=None, chunk_rows: int = CHUNK_ROWS,
+                  compression: str = "zstd") -> None:
+    """
+    Escribe los puntos en Parquet (tipado y comprimido), un *row group* por bloque.
+
+    Parámetros
+    ----------
+    df : pandas.DataFrame
+        Puntos (p. ej. `df_proc`).
+    file : str | file-like
+        Destino.
+    columns : list[str], opcional
+        Columnas a exportar. Por defecto, `POINT_COLUMNS` presentes en `df`.
+    chunk_rows : int, opcional
+        Filas por *row group*.
+    compression : str, opcional
+        Códec de pyarrow ("zstd", "snappy", "gzip", …). Por defecto "zstd".
+
+    Notas
+    -----
+    - Requiere pyarrow. 'time' conserva su zona horaria, 'moving' es booleano y 'hr'/'cad'
+    son numéricas (con nulos donde falten).
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("La exportación a Parquet requiere pyarrow (pip install pyarrow).") from e
+
+    cols = _point_columns(df, columns)
+    table_df = df[cols]
+    for c in ('hr', 'cad'):
+        if c in cols and table_df[c].dtype == object:
+            table_df = table_df.assign(**{c: pd.to_numeric(table_df[c], errors="coerce")})
+    schema = pa.Schema.from_pandas(table_df.iloc[:0], preserve_index=False)
+    with pq.ParquetWriter(file, schema, compression=compression) as writer:
+        for a, b in _chunks(len(table_df), chunk_rows):
+            writer.write_table(pa.Table.from_pandas(table_df.iloc[a:b], schema=schema, preserve_index=False))
+
+# _ISO_TIMES =================================================================================
+
+def _iso_times(times: pd.Series) -> list:
+    """Horas en ISO 8601 (`...Z`) con fracción de segundo solo si la hay; None si falta."""
+    text = times.dt.strftime('%Y-%m-%dT%H:%M:%S.%f').str.rstrip('0').str.rstrip('.') + 'Z'
+    return text.where(times.notna(), None).tolist()
+
+# ITER_GPX ===================================================================================
+
+def iter_gpx(df: pd.DataFrame, name: str = "", simplify_m: float | None = None,
+             chunk_rows: int = CHUNK_ROWS):
+    """
+    Serializa el track a GPX 1.1 por bloques.
+
+    Parámetros
+    ----------
+    df : pandas.DataFrame
+        Puntos con 'lat' y 'lon' (y 'ele', 'time', 'hr', 'cad' si existen).
+    name : str, opcional
+        Nombre de la pista (`<trk><name>`).
+    simplify_m : float, opcional
+        Si se indica, se escribe la ruta simplificada (RDP con esa tolerancia en metros,
+        segmento a segmento) en lugar de todos los puntos.
+    chunk_rows : int, opcional
+        Puntos por bloque.
+
+    Devuelve
+    --------
+    Iterator[bytes]
+        Fragmentos del XML (UTF-8).
+
+    Notas
+    -----
+    - HR y cadencia se escriben como extensión `gpxtpx:TrackPointExtension` de Garmin,
+    que `parse_gpx` vuelve a leer.
+    - Cada segmento (`segment_offsets`) va en su propio `<trkseg>`, y la hora se escribe
+    en UTC con las fracciones de segundo que tenga.
+    """
+    lat_all = df['lat'].to_numpy(dtype=float)
+    lon_all = df['lon'].to_numpy(dtype=float)
+    valid = ~(npy.isnan(lat_all) | npy.isnan(lon_all))
+    offsets = segment_offsets(df)
+    segments = []
+    for start, stop in zip(offsets[:-1], offsets[1:]):
+        pos = start + npy.flatnonzero(valid[start:stop])
+        if simplify_m is not None and len(pos) > 2:
+            pos = pos[simplify_indices(lat_all[pos], lon_all[pos], simplify_m)]
+        if len(pos):
+            segments.append(pos)
+
+    nan = npy.full(len(df), npy.nan)
+    ele_all = df['ele'].to_numpy(dtype=float) if 'ele' in df else nan
+    hr_all = pd.to_numeric(df['hr'], errors="coerce").to_numpy(dtype=float) if 'hr' in df else nan
+    cad_all = pd.to_numeric(df['cad'], errors="coerce").to_numpy(dtype=float) if 'cad' in df else nan
+    time_all = df['time'] if 'time' in df else None
+    if time_all is not None and time_all.dt.tz is not None:
+        time_all = time_all.dt.tz_convert("UTC")
+
+    yield _GPX_HEADER.encode("utf-8")
+    yield f"  <trk>\n    <name>{escape(str(name))}</name>\n".encode("utf-8")
+    for pos in segments:
+        yield b"    <trkseg>\n"
+        for a, b in _chunks(len(pos), chunk_rows):
+            idx = pos[a:b]
+            times = _iso_times(time_all.iloc[idx]) if time_all is not None else [None] * len(idx)
+            lines = []
+            for la, lo, el, t, hr, cad in zip(lat_all[idx], lon_all[idx], ele_all[idx], times, hr_all[idx], cad_all[idx]):
+                pt = f'      <trkpt lat="{la:.7f}" lon="{lo:.7f}">'
+                if el == el:
+                    pt += f'<ele>{el:.1f}</ele>'
+                if isinstance(t, str):
+                    pt += f'<time>{t}</time>'
+                if hr == hr or cad == cad:
+                    pt += '<extensions><gpxtpx:TrackPointExtension>'
+                    pt += f'<gpxtpx:hr>{hr:.0f}</gpxtpx:hr>' if hr == hr else ''
+                    pt += f'<gpxtpx:cad>{cad:.0f}</gpxtpx:cad>' if cad == cad else ''
+                    pt += '</gpxtpx:TrackPointExtension></extensions>'
+                lines.append(pt + '</trkpt>\n')
+            yield "".join(lines).encode("utf-8")
+        yield b"    </trkseg>\n"
+    yield b"  </trk>\n</gpx>\n"
+
+# EXPORT_BYTES ===============================================================================
+
+def export_bytes(df: pd.DataFrame, fmt: str, name: str = "", simplify_m: float | None = None,
+                 columns=None) -> bytes:
+    """
+    Genera el fichero de exportación completo en memoria (para `st.download_button`).
+
+    Parámetros
+    ----------
+    df : pandas.DataFrame
+        Puntos (p. ej. `df_proc`).
+    fmt : str
+        "csv", "parquet" o "gpx" (ver `EXPORT_FORMATS`).
+    name : str, opcional
+        Nombre de la pista (solo GPX).
+    simplify_m : float, opcional
+        Tolerancia de simplificación en metros (solo GPX).
+    columns : list[str], opcional
+        Columnas a exportar (CSV/Parquet).
+
+    Ejemplos
+    --------
+    >>> data = export_bytes(df_proc, "parquet")                    # doctest: +SKIP
+    >>> data = export_bytes(df_proc, "gpx", name="Ruta", simplify_m=5)  # doctest: +SKIP
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato de exportación desconocido: {fmt!r} (usa {list(EXPORT_FORMATS)})")
+    buf = io.BytesIO()
+    if fmt == "parquet":
+        write_parquet(df, buf, columns=columns)
+    else:
+        chunks = iter_csv(df, columns=columns) if fmt == "csv" else iter_gpx(df, name=name, simplify_m=simplify_m)
+        for chunk in chunks:
+            buf.write(chunk)
+    return buf.getvalue()
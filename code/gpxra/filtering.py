@@ -0,0 +1,414 @@
+# ============================================================================================
+# FILTERING.PY
+# ============================================================================================
+#
+# Limpieza del ruido del GPS entre el parseo y las métricas: descarte de puntos imposibles
+# (velocidad o aceleración implícitas) y, opcionalmente, suavizado de Kalman con RTS.
+#
+#   df_clean = filter_gps(parse_gpx(f), smooth=True)
+#   metrics, df_proc, splits = compute_metrics(df_clean)
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import numpy as npy
+import pandas as pd
+from .geo import haversine
+from .io import point_kinematics, segment_offsets
+from .profiling import profiled
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+# Velocidad máxima creíble entre dos puntos (m/s): 35 m/s = 126 km/h
+DEFAULT_MAX_SPEED_MS = 35.0
+
+# Aceleración máxima creíble (m/s²) para un punto aislado que se sale y vuelve
+DEFAULT_MAX_ACCEL_MS2 = 10.0
+
+# Margen del ruido del GPS en la prueba de aceleración: un punto que se aparta e metros
+# cambia las velocidades de llegada y salida en ~e/dt, así que al umbral se le suma
+# `_ACCEL_NOISE_K` · gps_sigma_m / dt
+_ACCEL_NOISE_K = 3.0
+
+# Puntos seguidos que pueden formar un mismo salto (ida y vuelta) y descartarse juntos
+DEFAULT_MAX_RUN = 5
+
+# Pasadas del descarte (cada una recalcula las velocidades sin los puntos ya descartados)
+DEFAULT_PASSES = 3
+
+# Kalman: error típico de la posición del GPS (m) y ruido de aceleración del modelo (m/s²)
+DEFAULT_GPS_SIGMA_M = 5.0
+DEFAULT_ACCEL_SIGMA_MS2 = 1.0
+
+# Incertidumbre inicial de la velocidad al empezar cada segmento (m/s)
+_V0_SIGMA_MS = 10.0
+
+# Cambio relativo de la covarianza por debajo del cual se da por alcanzado su estado
+# estacionario (y se repite para el resto de puntos con el mismo dt)
+_RICCATI_TOL = 1e-12
+
+# Por debajo de este valor los productos del barrido ya no influyen en el resultado
+_SCAN_EPS = 1e-12
+
+_EARTH_R = 6_371_000.0
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# _SECONDS ===================================================================================
+
+def _seconds(time) -> npy.ndarray:
+    """Segundos desde 1970 (float64), NaN donde no hay hora."""
+    values = pd.Series(time).to_numpy(dtype='datetime64[ns]')
+    secs = values.view('int64') / 1e9
+    secs[npy.isnat(values)] = npy.nan
+    return secs
+
+# _SAFE_SPEED ================================================================================
+
+def _safe_speed(d: npy.ndarray, dt: npy.ndarray) -> npy.ndarray:
+    """`d / dt` con el mismo criterio que `parse_gpx`: 0 si dt ≤ 0."""
+    return npy.divide(d, dt, out=npy.zeros_like(d), where=dt > 0)
+
+# GPS_OUTLIERS ===============================================================================
+
+def gps_outliers(lat, lon, t, offsets, max_speed_ms: float = DEFAULT_MAX_SPEED_MS,
+                 max_accel_ms2: float = DEFAULT_MAX_ACCEL_MS2, max_run: int = DEFAULT_MAX_RUN,
+                 passes: int = DEFAULT_PASSES, gps_sigma_m: float = DEFAULT_GPS_SIGMA_M) -> npy.ndarray:
+    """
+    Puntos que el GPS no pudo recorrer: máscara booleana (True = descartar).
+
+    Parámetros
+    ----------
+    lat, lon : array-like
+        Coordenadas (grados).
+    t : array-like
+        Segundos de cada punto (NaN si no tiene hora).
+    offsets : array-like
+        Límites de los segmentos (`segment_offsets`); no se mira entre segmentos.
+    max_speed_ms : float, opcional
+        Velocidad implícita a partir de la cual un tramo es un salto.
+    max_accel_ms2 : float, opcional
+        Aceleración implícita máxima de un punto aislado que se sale de la línea.
+    max_run : int, opcional
+        Largo máximo (en puntos) de una escapada que se descarta entera.
+    passes : int, opcional
+        Pasadas como máximo (se para antes si una no descarta nada).
+    gps_sigma_m : float, opcional
+        Error típico de una posición del GPS: margen de ruido de la prueba de aceleración.
+
+    Devuelve
+    --------
+    numpy.ndarray
+        Máscara de `len(lat)` elementos.
+
+    Notas
+    -----
+    Cada pasada trabaja sobre los puntos aún aceptados, con operaciones sobre arrays:
+    - Escapadas: entre dos saltos (tramos por encima de `max_speed_ms`) separados por como
+    mucho `max_run` puntos, si ir directamente del punto anterior al primer salto al
+    posterior al segundo es creíble, los puntos intermedios se descartan.
+    - Aceleración: un punto cuya velocidad de llegada y de salida superan la del tramo que
+    lo salta en más de `max_accel_ms2` · dt + 3 · `gps_sigma_m` / dt (pico de ida y
+    vuelta). Sin el término del ruido, a 1 Hz y con 5 m de error se descartaría ~1 % de
+    los puntos de un track limpio.
+    - Extremos: el primer (último) punto de un segmento si su tramo es un salto y el
+    siguiente (anterior) no.
+    Los puntos sin hora no se descartan nunca.
+    """
+    lat = npy.asarray(lat, dtype=float)
+    lon = npy.asarray(lon, dtype=float)
+    t = npy.asarray(t, dtype=float)
+    offsets = npy.asarray(offsets)
+    n = len(lat)
+    reject = npy.zeros(n, dtype=bool)
+    if n < 3:
+        return reject
+    seg = npy.repeat(npy.arange(len(offsets) - 1), npy.diff(offsets))
+    usable = npy.isfinite(t) & npy.isfinite(lat) & npy.isfinite(lon)
+
+    for _ in range(max(1, int(passes))):
+        k = npy.flatnonzero(usable & ~reject)
+        if len(k) < 3:
+            break
+        same = seg[k[1:]] == seg[k[:-1]]                      # tramo k[e] → k[e+1]
+        dt = npy.diff(t[k])
+        v = _safe_speed(haversine(lat[k[:-1]], lon[k[:-1]], lat[k[1:]], lon[k[1:]]), dt)
+        jump = same & (v > max_speed_ms)
+        new = npy.zeros(len(k), dtype=bool)
+
+        # escapadas entre dos saltos (no necesariamente seguidos: dentro de la escapada
+        # también puede haber saltos)
+        j = npy.flatnonzero(jump)
+        mark = npy.zeros(len(k) + 1, dtype=npy.int64)
+        for step in range(1, min(max_run, len(j))):
+            j1, j2 = j[:-step], j[step:]
+            near = j2 - j1 <= max_run
+            j1, j2 = j1[near], j2[near]
+            a, b = k[j1], k[j2 + 1]
+            v_skip = _safe_speed(haversine(lat[a], lon[a], lat[b], lon[b]), t[b] - t[a])
+            ok = (seg[a] == seg[b]) & (v_skip <= max_speed_ms)
+            npy.add.at(mark, j1[ok] + 1, 1)
+            npy.add.at(mark, j2[ok] + 1, -1)
+        new |= npy.cumsum(mark)[:-1] > 0
+
+        # picos de aceleración de un punto
+        inner = same[:-1] & same[1:]                          # puntos k[1:-1]
+        a, b = k[:-2], k[2:]
+        v_skip = _safe_speed(haversine(lat[a], lon[a], lat[b], lon[b]), t[b] - t[a])
+        half_dt = 0.5 * (dt[:-1] + dt[1:])
+        excess = npy.minimum(v[:-1], v[1:]) - v_skip
+        limit = max_accel_ms2 * half_dt + _ACCEL_NOISE_K * gps_sigma_m / npy.where(half_dt > 0, half_dt, 1.0)
+        new[1:-1] |= inner & (half_dt > 0) & (excess > limit)
+
+        # extremos de segmento
+        first = npy.concatenate([[True], ~same])              # primer punto (en k) de su segmento
+        last = npy.concatenate([~same, [True]])
+        calm_next = npy.concatenate([same[1:] & ~jump[1:], [False]])
+        calm_prev = npy.concatenate([[False], same[:-1] & ~jump[:-1]])
+        new[:-1] |= first[:-1] & jump & calm_next
+        new[1:] |= last[1:] & jump & calm_prev
+
+        if not new.any():
+            break
+        reject[k[new]] = True
+    return reject
+
+# _AFFINE_SCAN ===============================================================================
+
+def _affine_scan(a11, a12, a21, a22, b1, b2) -> tuple:
+    """
+    Recurrencia `m[k] = A[k] m[k-1] + b[k]` (con `m[-1] = 0`) para todos los k a la vez.
+
+    `A[k] = [[a11, a12], [a21, a22]]` (arrays de n elementos) y `b[k] = [b1, b2]` (arrays
+    (n, d): d columnas independientes). Devuelve `m` como `(m1, m2)`.
+
+    Barrido prefijo de Hillis–Steele: en log2(n) pasos cada elemento compone su
+    transformación con la de `s` posiciones atrás. Se para antes si todas las matrices
+    acumuladas ya son ~0 (filtros estables: olvidan rápido, unos pocos pasos).
+    """
+    a11, a12, a21, a22 = a11.copy(), a12.copy(), a21.copy(), a22.copy()
+    b1, b2 = b1.copy(), b2.copy()
+    n, s = len(a11), 1
+    while s < n:
+        if max(npy.abs(m[s:]).max() for m in (a11, a12, a21, a22)) < _SCAN_EPS:
+            break
+        c11, c12, c21, c22 = a11[s:, None], a12[s:, None], a21[s:, None], a22[s:, None]
+        b1[s:], b2[s:] = (c11 * b1[:-s] + c12 * b2[:-s] + b1[s:],
+                          c21 * b1[:-s] + c22 * b2[:-s] + b2[s:])
+        c11, c12, c21, c22 = a11[s:], a12[s:], a21[s:], a22[s:]
+        a11[s:], a12[s:], a21[s:], a22[s:] = (c11 * a11[:-s] + c12 * a21[:-s],
+                                              c11 * a12[:-s] + c12 * a22[:-s],
+                                              c21 * a11[:-s] + c22 * a21[:-s],
+                                              c21 * a12[:-s] + c22 * a22[:-s])
+        s *= 2
+    return b1, b2
+
+# _RICCATI ===================================================================================
+
+def _riccati(dt: npy.ndarray, start: npy.ndarray, r: float, q: float, c0: float) -> tuple:
+    """
+    Covarianzas `[[a, b], [b, c]]` del Kalman en cada punto: predichas `(pa, pb, pc)` y
+    corregidas `(fa, fb, fc)`, como arrays.
+
+    La recursión (tres escalares por punto) solo depende de `dt` y converge en unas
+    decenas de pasos: dentro de un tramo de puntos con el mismo `dt` (p. ej. 1 Hz), en
+    cuanto la covarianza corregida deja de cambiar se repite para el resto del tramo sin
+    iterar. Con `dt` irregular recorre todos los puntos.
+    """
+    n = len(dt)
+    cuts = npy.flatnonzero(start | npy.concatenate([[True], dt[1:] != dt[:-1]]))
+    bounds = npy.append(cuts, n)
+    ends = npy.repeat(bounds[1:], npy.diff(bounds)).tolist()    # fin del tramo de cada punto
+    dts, starts = dt.tolist(), start.tolist()
+    rows, where, fills = [], [], []
+    a = b = c = 0.0
+    i, last_end = 0, -1
+    while i < n:
+        d = dts[i]
+        if starts[i]:
+            a1, b1, c1 = 1e12, 0.0, c0          # posición desconocida; velocidad ~ c0
+        else:
+            a1 = a + 2 * d * b + d * d * c + q * d ** 3 / 3
+            b1 = b + d * c + q * d * d / 2
+            c1 = c + q * d
+        s = a1 + r
+        da, db, dc = a, b, c
+        a, b, c = a1 * r / s, b1 * r / s, c1 - b1 * b1 / s
+        rows.append((a1, b1, c1, a, b, c))
+        where.append(i)
+        end = ends[i]
+        if (end == last_end and abs(a - da) + abs(b - db) + abs(c - dc)
+                <= _RICCATI_TOL * (abs(a) + abs(b) + abs(c))):
+            fills.append((i + 1, end))
+            i = end
+        else:
+            i += 1
+        last_end = end
+
+    out = npy.empty((n, 6))
+    out[where] = rows
+    for i0, i1 in fills:
+        out[i0:i1] = out[i0 - 1]
+    return tuple(out.T)
+
+# KALMAN_SMOOTH ==============================================================================
+
+def kalman_smooth(x, y, t, offsets, gps_sigma_m: float = DEFAULT_GPS_SIGMA_M,
+                  accel_sigma_ms2: float = DEFAULT_ACCEL_SIGMA_MS2) -> tuple:
+    """
+    Suavizado de Kalman (velocidad constante) con pasada hacia atrás RTS.
+
+    Parámetros
+    ----------
+    x, y : array-like
+        Posiciones proyectadas (m).
+    t : array-like
+        Segundos de cada punto (todos con hora).
+    offsets : array-like
+        Límites de los segmentos: cada uno se filtra por separado.
+    gps_sigma_m : float, opcional
+        Error típico de una posición del GPS.
+    accel_sigma_ms2 : float, opcional
+        Ruido de aceleración del modelo: cuanto menor, más suave.
+
+    Devuelve
+    --------
+    tuple[numpy.ndarray, numpy.ndarray]
+        Posiciones suavizadas `(x, y)`.
+
+    Notas
+    -----
+    - Estado `[posición, velocidad]` por eje; x e y comparten la covarianza (mismo ruido),
+    que no depende de los datos sino solo de los `dt`: `_riccati` la calcula por tramos
+    de `dt` constante hasta su estado estacionario, que se repite en el resto del tramo.
+    - Las medias del filtro y de la pasada RTS son recurrencias afines
+    (`m[k] = A[k] m[k-1] + b[k]`) que se resuelven con `_affine_scan` sobre arrays,
+    para los dos ejes y todos los segmentos a la vez.
+    """
+    z = npy.stack([npy.asarray(x, dtype=float), npy.asarray(y, dtype=float)], axis=-1)   # (n, 2)
+    t = npy.asarray(t, dtype=float)
+    offsets = npy.asarray(offsets)
+    n = len(z)
+    if n < 2:
+        return z[:, 0].copy(), z[:, 1].copy()
+    r, q, c0 = gps_sigma_m ** 2, accel_sigma_ms2 ** 2, _V0_SIGMA_MS ** 2
+    start = npy.zeros(n, dtype=bool)
+    start[offsets[:-1]] = True
+    end = npy.zeros(n, dtype=bool)
+    end[offsets[1:] - 1] = True
+    dt = npy.concatenate([[0.0], npy.maximum(npy.diff(t), 0.0)])
+    dt[start] = 0.0
+
+    pa, pb, pc, fa, fb, fc = _riccati(dt, start, r, q, c0)
+
+    # filtro: m[k] = (I - K H) F[k] m[k-1] + K z[k], K = [pa, pb] / (pa + r)
+    k0, k1 = pa / (pa + r), pb / (pa + r)
+    a11, a12, a21, a22 = 1 - k0, (1 - k0) * dt, -k1, 1 - k1 * dt
+    for m in (a11, a12, a21, a22):
+        m[start] = 0.0
+    pos, vel = _affine_scan(a11, a12, a21, a22, k0[:, None] * z, k1[:, None] * z)
+
+    # RTS: ms[k] = C[k] ms[k+1] + (I - C[k] F[k+1]) m[k], con C[k] = P[k] F[k+1]' P⁻[k+1]⁻¹
+    d = npy.append(dt[1:], 0.0)
+    na, nb, nc = npy.append(pa[1:], 1.0), npy.append(pb[1:], 0.0), npy.append(pc[1:], 1.0)
+    det = na * nc - nb * nb
+    u, w = fa + d * fb, fb + d * fc                  # P F' = [[u, fb], [w, fc]]
+    c11, c12 = (u * nc - fb * nb) / det, (fb * na - u * nb) / det
+    c21, c22 = (w * nc - fc * nb) / det, (fc * na - w * nb) / det
+    for m in (c11, c12, c21, c22):
+        m[end] = 0.0
+    g11, g12 = 1 - c11, -(c11 * d + c12)
+    g21, g22 = -c21, 1 - (c21 * d + c22)
+    b1 = g11[:, None] * pos + g12[:, None] * vel
+    b2 = g21[:, None] * pos + g22[:, None] * vel
+    rev = slice(None, None, -1)
+    smooth, _ = _affine_scan(c11[rev], c12[rev], c21[rev], c22[rev], b1[rev], b2[rev])
+    smooth = smooth[rev]
+    return smooth[:, 0].copy(), smooth[:, 1].copy()
+
+# FILTER_GPS =================================================================================
+
+@profiled()
+def filter_gps(df: pd.DataFrame, max_speed_ms: float = DEFAULT_MAX_SPEED_MS,
+               max_accel_ms2: float = DEFAULT_MAX_ACCEL_MS2, max_run: int = DEFAULT_MAX_RUN,
+               smooth: bool = False, gps_sigma_m: float = DEFAULT_GPS_SIGMA_M,
+               accel_sigma_ms2: float = DEFAULT_ACCEL_SIGMA_MS2) -> pd.DataFrame:
+    """
+    Quita el ruido del GPS de los puntos de `parse_gpx`.
+
+    Parámetros
+    ----------
+    df : pandas.DataFrame
+        Puntos de `parse_gpx` (o de `correct_elevation`).
+    max_speed_ms, max_accel_ms2, max_run : opcional
+        Umbrales del descarte de puntos (ver `gps_outliers`).
+    smooth : bool, opcional
+        Suavizar además las posiciones con `kalman_smooth`. Por defecto False.
+    gps_sigma_m, accel_sigma_ms2 : float, opcional
+        Parámetros del suavizado (ver `kalman_smooth`); `gps_sigma_m` también da el margen
+        de ruido del descarte por aceleración.
+
+    Devuelve
+    --------
+    pandas.DataFrame
+        Copia de `df` sin los puntos descartados, con 'lat' y 'lon' suavizadas si se pide,
+        y 'dist', 'd_dist', 'dt' y 'speed' recalculadas. `attrs['segment_offsets']` se
+        ajusta a las filas que quedan; `attrs['gps_outliers']` es el nº de puntos
+        descartados y `attrs['gps_smoothed']` si se suavizó.
+
+    Notas
+    -----
+    - Se aplica después de `parse_gpx` y antes de `compute_metrics`: un solo pico de
+    posición da un pico de velocidad que infla `max_speed_kmh` y la escala de colores
+    del mapa por velocidad.
+    - El suavizado solo se aplica si todos los puntos tienen hora.
+    - Todo el trabajo por punto es vectorizado; la covarianza del Kalman solo se itera
+    hasta su estado estacionario en cada tramo de `dt` constante (ver `_riccati`).
+
+    Ejemplos
+    --------
+    >>> df_clean = filter_gps(parse_gpx(f), smooth=True)       # doctest: +SKIP
+    >>> df_clean.attrs['gps_outliers']                         # doctest: +SKIP
+    3
+    """
+    out = df.copy()
+    if out.empty:
+        return out
+    offsets = segment_offsets(out)
+    lat = out['lat'].to_numpy(dtype=float, na_value=npy.nan)
+    lon = out['lon'].to_numpy(dtype=float, na_value=npy.nan)
+    t = _seconds(out['time'])
+
+    reject = gps_outliers(lat, lon, t, offsets, max_speed_ms, max_accel_ms2, max_run,
+                          gps_sigma_m=gps_sigma_m)
+    if reject.any():
+        keep = ~reject
+        seg = npy.repeat(npy.arange(len(offsets) - 1), npy.diff(offsets))[keep]
+        counts = npy.bincount(seg, minlength=len(offsets) - 1)
+        offsets = npy.concatenate([[0], npy.cumsum(counts[counts > 0])])
+        attrs = dict(out.attrs)
+        out = out[keep].reset_index(drop=True)
+        out.attrs = attrs
+        lat, lon, t = lat[keep], lon[keep], t[keep]
+
+    smoothed = bool(smooth) and len(out) > 1 and not npy.isnan(t).any()
+    if smoothed:
+        lat0, lon0 = float(npy.nanmean(lat)), float(npy.nanmean(lon))
+        k = npy.radians(1.0) * _EARTH_R
+        kx = k * npy.cos(npy.radians(lat0))
+        x, y = kalman_smooth((lon - lon0) * kx, (lat - lat0) * k, t, offsets, gps_sigma_m, accel_sigma_ms2)
+        lat, lon = lat0 + y / k, lon0 + x / kx
+        out['lat'], out['lon'] = lat, lon
+
+    time = out['time'].to_numpy(dtype='datetime64[ns]')
+    out['dist'], out['d_dist'], out['dt'], out['speed'] = point_kinematics(lat, lon, time, offsets)
+    out.attrs['segment_offsets'] = tuple(int(o) for o in offsets)
+    out.attrs['gps_outliers'] = int(reject.sum())
+    out.attrs['gps_smoothed'] = smoothed
+    return out
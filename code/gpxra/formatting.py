@@ -1,5 +1,13 @@
 import numpy as npy
 
+# Paleta divergente (azul → amarillo → rojo) de las rutas coloreadas por velocidad/altitud.
+# La comparten el mapa (`draw_route`) y las miniaturas (`render_thumbnail`).
+ROUTE_COLORS = [
+    "#313695", "#4575b4", "#74add1", "#abd9e9", "#e0f3f8",
+    "#ffffbf",
+    "#fee090", "#fdae61", "#f46d43", "#d73027", "#a50026",
+]
+
 def hex_to_rgba(hex_color: str, alpha: float) -> str:
     """
     Convierte un color en formato HEX (#RRGGBB) a una cadena CSS `rgba(r, g, b, a)`.
@@ -51,3 +51,108 @@ def haversine(lat1, lon1, lat2, lon2):
     c = 2 * npy.arctan2(npy.sqrt(a), npy.sqrt(1 - a))
 
     return R * c
+
+# Proyección Web Mercator (EPSG:3857) en coordenadas de píxel global, la misma que usan
+# Leaflet/folium y los servidores de teselas `{z}/{x}/{y}`.
+TILE_SIZE = 256
+MAX_MERCATOR_LAT = 85.05112878
+
+def mercator_px(lat, lon, zoom: int, tile_size: int = TILE_SIZE):
+    """
+    Proyecta coordenadas WGS84 a píxeles globales Web Mercator para un nivel de zoom.
+
+    Parámetros
+    ----------
+    lat, lon : float o array-like
+        Latitud y longitud en grados decimales.
+    zoom : int
+        Nivel de zoom (0 = el mundo entero cabe en una tesela).
+    tile_size : int, opcional
+        Tamaño de tesela en píxeles. Por defecto 256.
+
+    Devuelve
+    --------
+    x, y : float o numpy.ndarray
+        Píxel global (origen en la esquina noroeste, `y` crece hacia el sur).
+
+    Notas
+    -----
+    - La latitud se satura a ±85.0511° (límite de Web Mercator).
+    """
+
+    scale = tile_size * (2 ** zoom)
+    lat = npy.clip(npy.asarray(lat, dtype=float), -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT)
+    lon = npy.asarray(lon, dtype=float)
+    x = (lon + 180.0) / 360.0 * scale
+    s = npy.sin(npy.radians(lat))
+    y = (0.5 - npy.log((1 + s) / (1 - s)) / (4 * npy.pi)) * scale
+    return x, y
+
+def mercator_latlon(x, y, zoom: int, tile_size: int = TILE_SIZE):
+    """
+    Inversa de `mercator_px`: convierte píxeles globales Web Mercator a (lat, lon).
+    """
+
+    scale = tile_size * (2 ** zoom)
+    lon = npy.asarray(x, dtype=float) / scale * 360.0 - 180.0
+    n = npy.pi - 2.0 * npy.pi * npy.asarray(y, dtype=float) / scale
+    lat = npy.degrees(npy.arctan(npy.sinh(n)))
+    return lat, lon
+
+def simplify_indices(lat, lon, tolerance_m: float = 10.0):
+    """
+    Índices de los puntos que conserva la simplificación Ramer–Douglas–Peucker de una
+    polilínea con tolerancia `tolerance_m` (metros).
+
+    Parámetros
+    ----------
+    lat, lon : array-like
+        Coordenadas en grados decimales.
+    tolerance_m : float, opcional
+        Desviación máxima (m) permitida entre la línea original y la simplificada.
+
+    Devuelve
+    --------
+    numpy.ndarray[int64]
+        Índices crecientes; siempre incluyen el primer y el último punto.
+
+    Notas
+    -----
+    - Las distancias se miden en una proyección equirectangular local (metros), más que
+    suficiente para la escala de una actividad.
+    - Versión iterativa (pila de tramos pendientes): cada tramo se evalúa de forma
+    vectorizada, sin recursión.
+    """
+
+    lat = npy.asarray(lat, dtype=float)
+    lon = npy.asarray(lon, dtype=float)
+    n = len(lat)
+    if n <= 2:
+        return npy.arange(n, dtype=npy.int64)
+
+    R = 6371000.0
+    x = npy.radians(lon - lon[0]) * R * npy.cos(npy.radians(npy.nanmean(lat)))
+    y = npy.radians(lat - lat[0]) * R
+    keep = npy.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        dx, dy = x[b] - x[a], y[b] - y[a]
+        px, py = x[a + 1:b] - x[a], y[a + 1:b] - y[a]
+        seg2 = dx * dx + dy * dy
+        if seg2 > 0:
+            # distancia al segmento [a, b] (proyección acotada a sus extremos)
+            t = npy.clip((px * dx + py * dy) / seg2, 0.0, 1.0)
+            d2 = (px - t * dx) ** 2 + (py - t * dy) ** 2
+        else:
+            d2 = px * px + py * py
+        i = int(npy.argmax(d2))
+        if d2[i] > tolerance_m * tolerance_m:
+            m = a + 1 + i
+            keep[m] = True
+            stack.append((a, m))
+            stack.append((m, b))
+    return npy.flatnonzero(keep)
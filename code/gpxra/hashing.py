@@ -0,0 +1,33 @@
+import hashlib
+import numpy as npy
+
+def content_hash(data: bytes) -> str:
+    """
+    Huella de contenido (BLAKE2b, 128 bits en hexadecimal) de unos bytes, p. ej. un fichero
+    GPX tal y como se ha subido.
+
+    Ejemplos
+    --------
+    >>> content_hash(b"<gpx/>")  # doctest: +SKIP
+    '4f3c…'
+    """
+
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def array_fingerprint(*arrays, extra=()) -> str:
+    """
+    Huella de contenido de uno o varios arrays (dtype, forma y bytes) más parámetros
+    adicionales hashables como texto (`extra`).
+
+    Sirve como clave de caché de todo lo que se deriva de una ruta: dos rutas con los
+    mismos valores producen la misma huella aunque vengan de ficheros distintos.
+    """
+
+    h = hashlib.blake2b(digest_size=16)
+    for a in arrays:
+        a = npy.ascontiguousarray(a)
+        h.update(f"{a.dtype.str}{a.shape}".encode())
+        h.update(a.tobytes() if a.dtype != object else repr(a.tolist()).encode())
+    for e in extra:
+        h.update(repr(e).encode())
+    return h.hexdigest()
@@ -0,0 +1,332 @@
+# ============================================================================================
+# HEATMAP.PY
+# ============================================================================================
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import base64
+import io
+import os
+import numpy as npy
+import pandas as pd
+from PIL import Image
+from .geo import mercator_px, mercator_latlon, TILE_SIZE
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+# Rampa de color del mapa de calor (de poco a muy transitado)
+HEAT_COLORS = ["#2c7bb6", "#00a6ca", "#00ccbc", "#90eb9d", "#ffff8c", "#f9d057", "#f29e2e", "#e76818", "#d7191c"]
+
+# Distancia de muestreo de los segmentos en píxeles (<1 para que el trazo sea continuo)
+_SAMPLE_STEP_PX = 0.5
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# _TRACK_LATLON ==============================================================================
+
+def _track_latlon(track):
+    """Devuelve (lat, lon) como arrays float a partir de un DataFrame o una tupla (lat, lon)."""
+    if isinstance(track, pd.DataFrame):
+        lat, lon = track['lat'].to_numpy(dtype=float), track['lon'].to_numpy(dtype=float)
+    else:
+        lat, lon = (npy.asarray(a, dtype=float) for a in track)
+    valid = ~(npy.isnan(lat) | npy.isnan(lon))
+    return lat[valid], lon[valid]
+
+# _SPLAT_SEGMENTS ============================================================================
+
+def _splat_segments(x: npy.ndarray, y: npy.ndarray, max_jump_px: float):
+    """
+    Rasteriza con antialiasing la polilínea (x, y) en píxeles globales.
+
+    Cada segmento se muestrea cada `_SAMPLE_STEP_PX` píxeles y cada muestra reparte su
+    peso entre los 4 píxeles vecinos (interpolación bilineal). El número de muestras
+    depende de la longitud en píxeles de la ruta, no del número de puntos GPX.
+
+    Devuelve
+    --------
+    px, py : numpy.ndarray[int64]
+        Píxeles tocados.
+    w : numpy.ndarray[float64]
+        Peso acumulado en cada píxel (longitud de trazo en píxeles).
+    """
+
+    dx, dy = npy.diff(x), npy.diff(y)
+    seg_len = npy.hypot(dx, dy)
+    keep = (seg_len > 0) & (seg_len <= max_jump_px)
+    if not keep.any():
+        # Punto aislado (o todos los segmentos descartados): un único píxel por punto
+        return npy.floor(x).astype(npy.int64), npy.floor(y).astype(npy.int64), npy.ones(len(x))
+
+    x0, y0, dx, dy, seg_len = x[:-1][keep], y[:-1][keep], dx[keep], dy[keep], seg_len[keep]
+    n = npy.ceil(seg_len / _SAMPLE_STEP_PX).astype(npy.int64)
+    seg = npy.repeat(npy.arange(len(n)), n)
+    starts = npy.cumsum(n) - n
+    t = (npy.arange(n.sum()) - starts[seg] + 0.5) / n[seg]
+    sx = x0[seg] + t * dx[seg] - 0.5
+    sy = y0[seg] + t * dy[seg] - 0.5
+    sw = seg_len[seg] / n[seg]
+
+    ix, iy = npy.floor(sx).astype(npy.int64), npy.floor(sy).astype(npy.int64)
+    fx, fy = sx - ix, sy - iy
+    px = npy.concatenate([ix, ix + 1, ix, ix + 1])
+    py = npy.concatenate([iy, iy, iy + 1, iy + 1])
+    w = npy.concatenate([sw * (1 - fx) * (1 - fy), sw * fx * (1 - fy),
+                         sw * (1 - fx) * fy, sw * fx * fy])
+    return px, py, w
+
+# _AUTO_ZOOM =================================================================================
+
+def _auto_zoom(lat_min, lon_min, lat_max, lon_max, max_size: int) -> int:
+    """Mayor zoom (≤ 16) con el que el bbox cabe en `max_size` píxeles por lado."""
+    for zoom in range(16, 0, -1):
+        x0, y0 = mercator_px(lat_max, lon_min, zoom)
+        x1, y1 = mercator_px(lat_min, lon_max, zoom)
+        if max(x1 - x0, y1 - y0) <= max_size:
+            return zoom
+    return 0
+
+# ============================================================================================
+# HEATMAPGRID
+# ============================================================================================
+
+class HeatmapGrid:
+    """
+    Rejilla de densidad Web Mercator que acumula muchas actividades en un único ráster.
+
+    La rejilla empieza vacía y crece (con relleno) a medida que llegan rutas fuera de su
+    extensión, por lo que se pueden añadir actividades nuevas de forma incremental
+    (`add_track`) o fusionar rejillas calculadas por separado (`merge`). La memoria y el
+    tiempo de render dependen del tamaño de la rejilla, no del número de puntos.
+
+    Parámetros
+    ----------
+    zoom : int
+        Nivel de zoom Web Mercator de la rejilla (un píxel de la rejilla = un píxel de
+        tesela a ese zoom).
+    per_track_cap : bool, opcional
+        Si es True (por defecto), cada actividad aporta como máximo 1 a cada píxel, de
+        modo que el valor de un píxel es el número de actividades que pasan por él.
+        Si es False, se acumula la longitud de trazo.
+    max_jump_m : float, opcional
+        Segmentos más largos que esta distancia (saltos de GPS o pausas con el dispositivo
+        apagado) no se dibujan. Por defecto 250 m.
+    max_pixels : int, opcional
+        Límite de tamaño de la rejilla (ancho × alto). Por defecto 64 Mpx.
+
+    Ejemplos
+    --------
+    >>> grid = HeatmapGrid.from_tracks(sessions.values())  # doctest: +SKIP
+    >>> grid.image_overlay().add_to(m)                    # doctest: +SKIP
+    """
+
+    def __init__(self, zoom: int, per_track_cap: bool = True, max_jump_m: float = 250.0,
+                 max_pixels: int = 64_000_000):
+        self.zoom = int(zoom)
+        self.per_track_cap = per_track_cap
+        self.max_jump_m = float(max_jump_m)
+        self.max_pixels = int(max_pixels)
+        self.x0 = 0
+        self.y0 = 0
+        self.counts = npy.zeros((0, 0), dtype=npy.float32)
+        self.n_tracks = 0
+
+    # CONSTRUCTORES ==========================================================================
+
+    @classmethod
+    def from_tracks(cls, tracks, zoom: int | None = None, max_size: int = 2048, **kwargs) -> "HeatmapGrid":
+        """
+        Construye una rejilla a partir de varias actividades (DataFrames con 'lat'/'lon' o
+        tuplas `(lat, lon)`). Si `zoom` es None se elige el mayor zoom con el que el
+        conjunto cabe en `max_size` píxeles por lado.
+        """
+        tracks = [_track_latlon(t) for t in tracks]
+        tracks = [(lat, lon) for lat, lon in tracks if len(lat)]
+        if zoom is None:
+            if tracks:
+                lat_min = min(float(lat.min()) for lat, _ in tracks)
+                lat_max = max(float(lat.max()) for lat, _ in tracks)
+                lon_min = min(float(lon.min()) for _, lon in tracks)
+                lon_max = max(float(lon.max()) for _, lon in tracks)
+                zoom = _auto_zoom(lat_min, lon_min, lat_max, lon_max, max_size)
+            else:
+                zoom = 12
+        grid = cls(zoom, **kwargs)
+        for track in tracks:
+            grid.add_track(track)
+        return grid
+
+    # GEOMETRÍA ==============================================================================
+
+    @property
+    def shape(self):
+        return self.counts.shape
+
+    @property
+    def bounds(self):
+        """Límites `[[lat_sur, lon_oeste], [lat_norte, lon_este]]` (formato folium)."""
+        h, w = self.counts.shape
+        lat_n, lon_w = mercator_latlon(self.x0, self.y0, self.zoom)
+        lat_s, lon_e = mercator_latlon(self.x0 + w, self.y0 + h, self.zoom)
+        return [[float(lat_s), float(lon_w)], [float(lat_n), float(lon_e)]]
+
+    def _ensure_extent(self, x_min: int, y_min: int, x_max: int, y_max: int):
+        """Amplía la rejilla para que contenga los píxeles globales [min, max]."""
+        h, w = self.counts.shape
+        if h and w:
+            x_min, y_min = min(x_min, self.x0), min(y_min, self.y0)
+            x_max, y_max = max(x_max, self.x0 + w - 1), max(y_max, self.y0 + h - 1)
+        new_w, new_h = x_max - x_min + 1, y_max - y_min + 1
+        if (new_w, new_h) == (w, h):
+            return
+        if new_w * new_h > self.max_pixels:
+            raise ValueError(
+                f"La rejilla necesitaría {new_w}x{new_h} píxeles (> {self.max_pixels}); "
+                f"usa un zoom menor que {self.zoom}."
+            )
+        grown = npy.zeros((new_h, new_w), dtype=npy.float32)
+        if h and w:
+            oy, ox = self.y0 - y_min, self.x0 - x_min
+            grown[oy:oy + h, ox:ox + w] = self.counts
+        self.counts, self.x0, self.y0 = grown, x_min, y_min
+
+    # ACUMULACIÓN ============================================================================
+
+    def add_track(self, track) -> None:
+        """Rasteriza una actividad y la suma a la rejilla."""
+        lat, lon = _track_latlon(track)
+        if len(lat) == 0:
+            return
+        x, y = mercator_px(lat, lon, self.zoom)
+        # metros por píxel a la latitud media de la ruta
+        m_per_px = 156543.03392 * npy.cos(npy.radians(float(npy.mean(lat)))) / (2 ** self.zoom)
+        px, py, w = _splat_segments(x, y, self.max_jump_m / m_per_px)
+
+        x_min, y_min = int(px.min()), int(py.min())
+        x_max, y_max = int(px.max()), int(py.max())
+        self._ensure_extent(x_min, y_min, x_max, y_max)
+
+        # Acumulación dispersa: solo se reserva memoria para los píxeles tocados
+        h, w_grid = self.counts.shape
+        flat = (py - self.y0) * w_grid + (px - self.x0)
+        cells, inverse = npy.unique(flat, return_inverse=True)
+        weights = npy.bincount(inverse, weights=w)
+        if self.per_track_cap:
+            weights = npy.minimum(weights, 1.0)
+        self.counts.ravel()[cells] += weights.astype(npy.float32)
+        self.n_tracks += 1
+
+    def add_tracks(self, tracks) -> None:
+        """Añade varias actividades de forma incremental."""
+        for track in tracks:
+            self.add_track(track)
+
+    def merge(self, other: "HeatmapGrid") -> None:
+        """Suma otra rejilla del mismo zoom (p. ej. calculada en otro proceso)."""
+        if other.zoom != self.zoom:
+            raise ValueError(f"No se pueden fusionar rejillas de zoom {self.zoom} y {other.zoom}.")
+        h, w = other.counts.shape
+        if not (h and w):
+            return
+        self._ensure_extent(other.x0, other.y0, other.x0 + w - 1, other.y0 + h - 1)
+        oy, ox = other.y0 - self.y0, other.x0 - self.x0
+        self.counts[oy:oy + h, ox:ox + w] += other.counts
+        self.n_tracks += other.n_tracks
+
+    # RENDER =================================================================================
+
+    def to_rgba(self, counts: npy.ndarray | None = None, vmax: float | None = None) -> npy.ndarray:
+        """
+        Colorea la rejilla (escala logarítmica) y devuelve un array RGBA `uint8`.
+        Los píxeles sin actividad quedan transparentes.
+        """
+        counts = self.counts if counts is None else counts
+        if vmax is None:
+            vmax = float(counts.max()) if counts.size else 0.0
+        norm = npy.log1p(counts) / npy.log1p(vmax) if vmax > 0 else npy.zeros_like(counts)
+        norm = npy.clip(norm, 0.0, 1.0)
+
+        ramp = npy.array([[int(c[i:i + 2], 16) for i in (1, 3, 5)] for c in HEAT_COLORS], dtype=float)
+        pos = norm * (len(ramp) - 1)
+        lo = npy.floor(pos).astype(int)
+        hi = npy.minimum(lo + 1, len(ramp) - 1)
+        frac = (pos - lo)[..., None]
+        rgb = ramp[lo] * (1 - frac) + ramp[hi] * frac
+
+        rgba = npy.empty(counts.shape + (4,), dtype=npy.uint8)
+        rgba[..., :3] = rgb.astype(npy.uint8)
+        rgba[..., 3] = npy.where(counts > 0, 90 + 165 * norm, 0).astype(npy.uint8)
+        return rgba
+
+    def to_png(self) -> bytes:
+        """PNG de la rejilla completa."""
+        buf = io.BytesIO()
+        Image.fromarray(self.to_rgba()).save(buf, format="PNG", optimize=True)
+        return buf.getvalue()
+
+    def image_overlay(self, name: str = "Mapa de calor", opacity: float = 0.85):
+        """
+        Devuelve un `folium.raster_layers.ImageOverlay` con la rejilla incrustada como PNG.
+        Al estar la rejilla en Web Mercator, Leaflet la coloca sin reproyectar.
+        """
+        import folium
+
+        url = "data:image/png;base64," + base64.b64encode(self.to_png()).decode("ascii")
+        return folium.raster_layers.ImageOverlay(
+            image=url, bounds=self.bounds, name=name, opacity=opacity, interactive=False,
+        )
+
+    def write_tiles(self, directory: str, min_zoom: int | None = None) -> list[str]:
+        """
+        Escribe teselas PNG `{z}/{x}/{y}.png` en `directory`, desde el zoom de la rejilla
+        hasta `min_zoom` (por defecto, 2 niveles menos), agregando 2×2 píxeles por nivel.
+        La escala de color es común a todos los niveles.
+
+        Devuelve la lista de ficheros escritos. Se pueden servir localmente y cargar con
+        `folium.TileLayer(tiles="http://…/{z}/{x}/{y}.png", attr="gpxra")`.
+        """
+        h, w = self.counts.shape
+        if not (h and w):
+            return []
+        min_zoom = max(0, self.zoom - 2) if min_zoom is None else int(min_zoom)
+
+        # Alinear la rejilla a teselas del zoom base
+        tx0, ty0 = self.x0 // TILE_SIZE, self.y0 // TILE_SIZE
+        tx1, ty1 = (self.x0 + w - 1) // TILE_SIZE, (self.y0 + h - 1) // TILE_SIZE
+        counts = npy.zeros(((ty1 - ty0 + 1) * TILE_SIZE, (tx1 - tx0 + 1) * TILE_SIZE), dtype=npy.float32)
+        oy, ox = self.y0 - ty0 * TILE_SIZE, self.x0 - tx0 * TILE_SIZE
+        counts[oy:oy + h, ox:ox + w] = self.counts
+
+        written = []
+        for zoom in range(self.zoom, min_zoom - 1, -1):
+            vmax = float(counts.max())
+            for j in range(counts.shape[0] // TILE_SIZE):
+                for i in range(counts.shape[1] // TILE_SIZE):
+                    tile = counts[j * TILE_SIZE:(j + 1) * TILE_SIZE, i * TILE_SIZE:(i + 1) * TILE_SIZE]
+                    if not tile.any():
+                        continue
+                    path = os.path.join(directory, str(zoom), str(tx0 + i), f"{ty0 + j}.png")
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    Image.fromarray(self.to_rgba(tile, vmax=vmax)).save(path, format="PNG")
+                    written.append(path)
+
+            # Siguiente nivel: rejilla alineada a teselas pares y reducida 2×2
+            if tx0 % 2:
+                counts = npy.pad(counts, ((0, 0), (TILE_SIZE, 0))); tx0 -= 1
+            if ty0 % 2:
+                counts = npy.pad(counts, ((TILE_SIZE, 0), (0, 0))); ty0 -= 1
+            if (counts.shape[1] // TILE_SIZE) % 2:
+                counts = npy.pad(counts, ((0, 0), (0, TILE_SIZE)))
+            if (counts.shape[0] // TILE_SIZE) % 2:
+                counts = npy.pad(counts, ((0, TILE_SIZE), (0, 0)))
+            counts = counts.reshape(counts.shape[0] // 2, 2, counts.shape[1] // 2, 2).max(axis=(1, 3))
+            tx0, ty0 = tx0 // 2, ty0 // 2
+
+        return written
@@ -0,0 +1,439 @@
+# ============================================================================================
+# INGEST.PY
+# ============================================================================================
+#
+# Ingesta continua de una carpeta vigilada en la biblioteca de actividades (asyncio):
+#
+#   python -m gpxra.ingest /srv/sync/gpx --library actividades.db --workers 2
+#
+# Los dispositivos sincronizan sus GPX en una carpeta compartida. El ingestor la recorre
+# periódicamente, espera a que cada fichero deje de cambiar (puede estar a medio copiar),
+# descarta los repetidos por hash de contenido, analiza los nuevos en un pool de procesos
+# acotado y escribe los resultados en la biblioteca en transacciones por lotes. Al
+# reiniciar, los ficheros ya procesados (misma ruta, tamaño y mtime) no se vuelven a leer.
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from .hashing import content_hash
+from .library import ActivityLibrary, analyze_activity, save_track
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+# Extensiones que se ingieren (sin distinguir mayúsculas)
+GPX_EXTENSIONS = (".gpx",)
+
+# Un fichero se da por completo cuando lleva este tiempo (s) sin cambiar de tamaño ni mtime
+DEFAULT_SETTLE_S = 2.0
+
+# Intervalo entre recorridos de la carpeta (s)
+DEFAULT_POLL_S = 2.0
+
+# Se escribe en la biblioteca cada `batch_size` resultados o, como muy tarde, a los N s
+DEFAULT_BATCH_DELAY_S = 1.0
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# _WORKER_INGEST =============================================================================
+
+def _worker_ingest(data: bytes, name: str, sport: str | None, threshold: float,
+                   tracks_dir: str | None) -> tuple[dict | None, str | None]:
+    """
+    Análisis en un proceso del pool: parse + métricas y, si hay caché binaria, guarda el
+    track allí mismo (los arrays no vuelven al proceso principal). Devuelve
+    `(fila de resumen, None)` o `(None, error)`: nunca lanza, porque algunas excepciones
+    (p. ej. las de gpxpy) no se pueden deserializar en el proceso principal y romperían
+    el pool.
+    """
+    try:
+        row, track = analyze_activity(data, name, sport, threshold)
+        if tracks_dir:
+            save_track(tracks_dir, row['hash'], track)
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+    return row, None
+
+# SCAN_FOLDER ================================================================================
+
+def scan_folder(folder: str) -> dict:
+    """Ficheros GPX de `folder` (recursivo): ruta → `(tamaño, mtime_ns)`."""
+    found = {}
+    stack = [folder]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith(GPX_EXTENSIONS) and not entry.name.startswith("."):
+                    st = entry.stat()
+                    found[os.path.normpath(entry.path)] = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                continue        # borrado entre el listado y el stat
+    return found
+
+# _READ_FILE =================================================================================
+
+def _read_file(path: str) -> tuple[bytes, str]:
+    """Contenido y hash de un fichero (en un hilo: no bloquea el bucle de eventos)."""
+    with open(path, "rb") as f:
+        data = f.read()
+    return data, content_hash(data)
+
+# ============================================================================================
+# FOLDERINGESTER
+# ============================================================================================
+
+class FolderIngester:
+    """
+    Ingestor de una carpeta vigilada hacia una `ActivityLibrary`.
+
+    Parámetros
+    ----------
+    folder : str
+        Carpeta vigilada (se recorre recursivamente).
+    library : ActivityLibrary
+        Biblioteca destino.
+    workers : int, opcional
+        Procesos de análisis. Por defecto, `os.cpu_count()`.
+    queue_size : int, opcional
+        Ficheros listos en espera de un proceso. Con la cola llena, el recorrido espera
+        (los ficheros siguen en disco: no se pierde nada). Por defecto 64.
+    poll_s : float, opcional
+        Intervalo entre recorridos de la carpeta.
+    settle_s : float, opcional
+        Tiempo sin cambios (tamaño y mtime) para dar un fichero por completo.
+    batch_size : int, opcional
+        Resultados por transacción. Por defecto, el de la biblioteca.
+    batch_delay_s : float, opcional
+        Espera máxima antes de escribir un lote incompleto.
+    sport : str, opcional
+        Deporte con que se anotan las actividades.
+    moving_speed_threshold : float, opcional
+        Umbral de movimiento de `compute_metrics`.
+
+    Notas
+    -----
+    - El vigilante es por sondeo (`os.scandir`): funciona igual en carpetas de red y
+    montajes sincronizados, donde inotify no ve los cambios remotos.
+    - Debounce: un fichero solo se procesa cuando dos recorridos seguidos, separados al
+    menos `settle_s`, ven el mismo tamaño y mtime (o cuando su mtime ya tiene más de
+    `settle_s` de antigüedad, p. ej. al arrancar).
+    - Deduplicación: se calcula el hash del contenido antes de analizar; si ya está en la
+    biblioteca (o en curso) solo se anota el fichero. Así, la misma actividad copiada por
+    dos dispositivos se analiza una vez.
+    - Reanudación: cada fichero procesado se anota en la tabla `files` con su tamaño y
+    mtime; al reiniciar, los que no han cambiado no se vuelven a leer. Si el proceso muere
+    entre escribir una actividad y anotar su fichero, al reiniciar se relee, el hash ya
+    está en la biblioteca y solo se anota.
+    - `metrics()` da los contadores: ficheros vistos, omitidos, repetidos, analizados y
+    fallidos, lotes escritos, ritmo (actividades/s) y retraso (desde que el fichero deja
+    de cambiar hasta que está en la biblioteca).
+
+    Ejemplos
+    --------
+    >>> async def demo():
+    ...     with ActivityLibrary("actividades.db") as lib:
+    ...         async with FolderIngester("/srv/sync/gpx", lib, workers=2) as ingester:
+    ...             await ingester.scan()          # un recorrido
+    ...             await ingester.drain()         # espera a que todo esté escrito
+    ...             return ingester.metrics()
+    >>> asyncio.run(demo())                         # doctest: +SKIP
+    """
+
+    def __init__(self, folder: str, library: ActivityLibrary, workers: int | None = None,
+                 queue_size: int = 64, poll_s: float = DEFAULT_POLL_S, settle_s: float = DEFAULT_SETTLE_S,
+                 batch_size: int | None = None, batch_delay_s: float = DEFAULT_BATCH_DELAY_S,
+                 sport: str | None = None, moving_speed_threshold: float = 0.5):
+        self.folder = os.path.normpath(folder)
+        self.library = library
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.queue_size = int(queue_size)
+        self.poll_s = float(poll_s)
+        self.settle_s = float(settle_s)
+        self.batch_size = int(batch_size or library.batch_size)
+        self.batch_delay_s = float(batch_delay_s)
+        self.sport = sport
+        self.moving_speed_threshold = float(moving_speed_threshold)
+        self._pool = None
+        self._jobs = None           # ficheros listos → procesos
+        self._results = None        # resultados → escritor
+        self._tasks = []
+        self._done = {}             # ruta → (tamaño, mtime_ns) ya anotados en la biblioteca
+        self._settling = {}         # ruta → (tamaño, mtime_ns, visto así desde)
+        self._skipped = set()       # rutas ya procesadas vistas en algún recorrido
+        self._in_progress = set()   # rutas en cola, en análisis o pendientes de escribir
+        self._hashes = set()        # hashes en curso (deduplicación antes de escribir)
+        self._stop = None
+        # contadores
+        self.counts = Counter()     # seen, skipped, duplicates, queued, ingested, failed, batches, …
+        self.started = None
+        self.in_flight = 0
+        self.max_queue_depth = 0
+        self.lag_max = 0.0
+        self._recent = deque(maxlen=1024)    # (instante de escritura, retraso) por actividad
+
+    # CICLO DE VIDA ==========================================================================
+
+    async def start(self) -> "FolderIngester":
+        """Carga el estado de la biblioteca y arranca el pool, los analizadores y el escritor."""
+        if self._pool is None:
+            self.started = time.time()
+            self._done = await asyncio.to_thread(self.library.ingested_files)
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            self._jobs = asyncio.Queue(maxsize=self.queue_size)
+            self._results = asyncio.Queue()
+            self._stop = asyncio.Event()
+            self._tasks = [asyncio.create_task(self._analyze_loop()) for _ in range(self.workers)]
+            self._tasks.append(asyncio.create_task(self._write_loop()))
+        return self
+
+    async def close(self) -> None:
+        """Escribe lo ya analizado y detiene las tareas y el pool."""
+        if self._pool is None:
+            return
+        await self.drain()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._pool = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def run(self) -> None:
+        """Vigila la carpeta hasta `stop()` (un recorrido cada `poll_s`)."""
+        await self.start()
+        while not self._stop.is_set():
+            await self.scan()
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=self.poll_s)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self) -> None:
+        if self._stop is not None:
+            self._stop.set()
+
+    async def drain(self) -> None:
+        """Espera a que todo lo encolado esté analizado y escrito."""
+        await self._jobs.join()
+        await self._results.join()
+
+    # VIGILANCIA =============================================================================
+
+    async def scan(self) -> int:
+        """
+        Un recorrido de la carpeta: encola los ficheros nuevos o modificados que ya no
+        cambian. Devuelve cuántos se han encolado.
+        """
+        if self._pool is None:
+            await self.start()
+        found = await asyncio.to_thread(scan_folder, self.folder)
+        now = time.time()
+        ready = []
+        for path, state in found.items():
+            if path in self._in_progress:
+                continue
+            if self._done.get(path) == state:
+                if path not in self._skipped:
+                    self._skipped.add(path)
+                    self.counts['skipped'] += 1
+                continue
+            previous = self._settling.get(path)
+            if previous is None:
+                self.counts['seen'] += 1
+            since = now if previous is None or previous[:2] != state else previous[2]
+            self._settling[path] = (*state, since)
+            settled = now - since >= self.settle_s or now - state[1] / 1e9 >= self.settle_s
+            if settled:
+                ready.append((path, state, now))
+        for path in set(self._settling) - set(found):
+            del self._settling[path]
+        for path, state, ready_at in ready:
+            self._settling.pop(path, None)
+            self._in_progress.add(path)
+            await self._enqueue(path, state, ready_at)
+        return len(ready)
+
+    async def _enqueue(self, path: str, state: tuple, ready_at: float) -> None:
+        try:
+            data, hash = await asyncio.to_thread(_read_file, path)
+        except OSError as e:
+            await self._results.put((path, state, None, None, f"{type(e).__name__}: {e}", ready_at))
+            return
+        if hash in self._hashes or await asyncio.to_thread(self.library.__contains__, hash):
+            self.counts['duplicates'] += 1
+            await self._results.put((path, state, hash, None, None, ready_at))
+            return
+        self._hashes.add(hash)
+        await self._jobs.put((path, state, hash, data, ready_at))     # espera si la cola está llena
+        self.counts['queued'] += 1
+        self.max_queue_depth = max(self.max_queue_depth, self._jobs.qsize())
+
+    # ANÁLISIS Y ESCRITURA ===================================================================
+
+    async def _analyze_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            path, state, hash, data, ready_at = await self._jobs.get()
+            self.in_flight += 1
+            try:
+                row, error = await loop.run_in_executor(
+                    self._pool, _worker_ingest, data, os.path.relpath(path, self.folder), self.sport,
+                    self.moving_speed_threshold, self.library.tracks_dir,
+                )
+                result = (path, state, hash, row, error, ready_at)
+            except Exception as e:
+                result = (path, state, hash, None, f"{type(e).__name__}: {e}", ready_at)
+            finally:
+                self.in_flight -= 1
+            await self._results.put(result)
+            self._jobs.task_done()
+
+    async def _write_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._results.get()]
+            deadline = loop.time() + self.batch_delay_s
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._results.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._write(batch)
+            except Exception:
+                # p. ej. la base de datos bloqueada más allá del timeout: los ficheros no
+                # quedan anotados y se vuelven a intentar en el siguiente recorrido
+                self.counts['write_errors'] += 1
+                for path, _, hash, _, _, _ in batch:
+                    self._in_progress.discard(path)
+                    self._hashes.discard(hash)
+            finally:
+                for _ in batch:
+                    self._results.task_done()
+
+    async def _write(self, batch: list) -> None:
+        """Un lote: actividades nuevas y ficheros procesados (transacciones por lotes)."""
+        rows = [row for _, _, _, row, _, _ in batch if row is not None]
+        files = [
+            {'path': path, 'size': state[0], 'mtime_ns': state[1], 'hash': hash, 'error': error,
+             'ingested_ts': time.time()}
+            for path, state, hash, _, error, _ in batch
+        ]
+        if rows:
+            await asyncio.to_thread(self.library.insert, rows)
+        await asyncio.to_thread(self.library.record_files, files)
+        now = time.time()
+        self.counts['batches'] += 1
+        for path, state, hash, row, error, ready_at in batch:
+            self._in_progress.discard(path)
+            self._hashes.discard(hash)
+            self._done[path] = state
+            self._skipped.add(path)
+            if error is not None:
+                self.counts['failed'] += 1
+            elif row is not None:
+                self.counts['ingested'] += 1
+                lag = now - ready_at
+                self.lag_max = max(self.lag_max, lag)
+                self._recent.append((now, lag))
+
+    # CONTADORES =============================================================================
+
+    def metrics(self, window_s: float = 60.0) -> dict:
+        """
+        Contadores del ingestor. 'throughput_per_s' es el nº de actividades escritas por
+        segundo en los últimos `window_s` s; el retraso va desde que el fichero se da por
+        completo hasta que está en la biblioteca.
+        """
+        now = time.time()
+        recent = [(t, lag) for t, lag in self._recent if now - t <= window_s]
+        lags = sorted(lag for _, lag in recent)
+        pct = lambda q: lags[min(len(lags) - 1, int(q * len(lags)))] if lags else None
+        uptime = now - self.started if self.started else 0.0
+        return {
+            'files': {k: self.counts[k] for k in ('seen', 'skipped', 'duplicates', 'queued', 'ingested', 'failed')},
+            'batches': self.counts['batches'],
+            'write_errors': self.counts['write_errors'],
+            'throughput_per_s': len(recent) / min(window_s, max(uptime, 1e-9)) if recent else 0.0,
+            'lag_s': {'p50': pct(0.50), 'p95': pct(0.95), 'max': self.lag_max},
+            'backlog': {
+                'settling': len(self._settling),
+                'queue': self._jobs.qsize() if self._jobs is not None else 0,
+                'max_queue': self.max_queue_depth,
+                'in_flight': self.in_flight,
+                'writing': self._results.qsize() if self._results is not None else 0,
+            },
+            'workers': self.workers,
+            'uptime_s': uptime,
+        }
+
+# ============================================================================================
+# MAIN
+# ============================================================================================
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m gpxra.ingest",
+                                     description="Ingesta continua de una carpeta de GPX en la biblioteca.")
+    parser.add_argument("folder", help="Carpeta vigilada (recursiva).")
+    parser.add_argument("--library", required=True, help="Base de datos SQLite de la biblioteca.")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos de análisis (por defecto, nº de CPUs).")
+    parser.add_argument("--poll", type=float, default=DEFAULT_POLL_S, help="Segundos entre recorridos.")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE_S,
+                        help="Segundos sin cambios para dar un fichero por completo.")
+    parser.add_argument("--sport", default=None, help="Deporte con que se anotan las actividades.")
+    parser.add_argument("--stats", type=float, default=30.0,
+                        help="Muestra los contadores en stderr cada N s (0 = nunca).")
+    args = parser.parse_args(argv)
+
+    async def report(ingester):
+        import sys
+        while True:
+            await asyncio.sleep(args.stats)
+            print(json.dumps(ingester.metrics(), ensure_ascii=False), file=sys.stderr, flush=True)
+
+    async def run():
+        with ActivityLibrary(args.library) as library:
+            async with FolderIngester(args.folder, library, workers=args.workers, poll_s=args.poll,
+                                      settle_s=args.settle, sport=args.sport) as ingester:
+                print(f"Vigilando {ingester.folder} → {args.library} ({ingester.workers} procesos)")
+                reporter = asyncio.create_task(report(ingester)) if args.stats > 0 else None
+                try:
+                    await ingester.run()
+                finally:
+                    if reporter is not None:
+                        reporter.cancel()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
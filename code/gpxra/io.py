@@ -4,7 +4,139 @@ from datetime import datetime, timezone
 import gpxpy
 import gpxpy.gpx
 from .geo import haversine
+from .profiling import profiled
 
+# Columnas por punto que se extraen de cada segmento
+_POINT_FIELDS = ('time', 'lat', 'lon', 'ele', 'hr', 'cad')
+
+# _SENSOR_VALUES =============================================================================
+
+def _sensor_values(p):
+    """(hr, cad) de las extensiones XML de un punto (p. ej. Garmin/TCX), NaN si no están."""
+    hr = npy.nan
+    cad = npy.nan
+    try:
+        for ext in p.extensions:
+            for child in ext.iter():
+                tag = child.tag.lower()
+                if tag.endswith('heartrate') or tag.endswith('hr'):
+                    try:
+                        hr = int(child.text)
+                    except Exception:
+                        pass
+                if tag.endswith('cadence') or tag.endswith('cad'):
+                    try:
+                        cad = int(child.text)
+                    except Exception:
+                        pass
+    except Exception:
+        pass
+    return hr, cad
+
+# _SEGMENT_COLUMNS ===========================================================================
+
+def _segment_columns(segment) -> dict:
+    """Arrays de un `<trkseg>` (en el orden del fichero): time, lat, lon, ele, hr, cad."""
+    points = segment.points
+    # la hora se toma como UTC tal cual viene (sin convertir zonas)
+    times = [p.time.replace(tzinfo=None) if isinstance(p.time, datetime) else None for p in points]
+    sensors = [_sensor_values(p) if p.extensions else (npy.nan, npy.nan) for p in points]
+    return {
+        'time': npy.array(times, dtype='datetime64[ns]'),
+        'lat': npy.array([p.latitude for p in points], dtype=float),
+        'lon': npy.array([p.longitude for p in points], dtype=float),
+        'ele': npy.array([npy.nan if p.elevation is None else p.elevation for p in points], dtype=float),
+        'hr': npy.array([hr for hr, _ in sensors], dtype=float),
+        'cad': npy.array([cad for _, cad in sensors], dtype=float),
+    }
+
+# _MERGE_RUNS ================================================================================
+
+def _merge_two(keys: npy.ndarray, a: npy.ndarray, b: npy.ndarray) -> npy.ndarray:
+    """Mezcla estable de dos listas de índices cuyas `keys` ya están ordenadas."""
+    ka, kb = keys[a], keys[b]
+    out = npy.empty(len(a) + len(b), dtype=npy.int64)
+    # posición final: la propia más las de la otra racha que van antes (a gana en empates)
+    out[npy.arange(len(a)) + npy.searchsorted(kb, ka, side='left')] = a
+    out[npy.arange(len(b)) + npy.searchsorted(ka, kb, side='right')] = b
+    return out
+
+def _time_order(keys: npy.ndarray, offsets: npy.ndarray) -> npy.ndarray | None:
+    """
+    Permutación que ordena `keys` de forma estable, o None si ya están ordenadas.
+
+    Los segmentos `keys[offsets[i]:offsets[i+1]]` se ordenan por separado (solo los que
+    lo necesitan) y se mezclan por parejas (k-way merge, O(n log k)).
+    """
+    if len(keys) < 2 or npy.all(keys[1:] >= keys[:-1]):
+        return None
+    runs = []
+    for a, b in zip(offsets[:-1], offsets[1:]):
+        run = npy.arange(a, b)
+        seg = keys[a:b]
+        if len(seg) > 1 and not npy.all(seg[1:] >= seg[:-1]):
+            run = run[npy.argsort(seg, kind='stable')]
+        runs.append(run)
+    while len(runs) > 1:
+        runs = [_merge_two(keys, runs[i], runs[i + 1]) if i + 1 < len(runs) else runs[i]
+                for i in range(0, len(runs), 2)]
+    return runs[0]
+
+def _merged_offsets(labels: npy.ndarray) -> npy.ndarray:
+    """
+    Límites de segmento tras ordenar por tiempo (`labels`: segmento de origen de cada
+    punto). Un cambio de etiqueta solo es un límite si el segmento anterior ya no tiene
+    más puntos y el siguiente empieza ahí; los segmentos que se solapan en el tiempo
+    (etiquetas alternadas) quedan como uno solo, sin cortes entre sus puntos.
+    """
+    n = len(labels)
+    changes = npy.flatnonzero(labels[1:] != labels[:-1]) + 1
+    if len(changes):
+        pos = npy.arange(n)
+        first = npy.full(labels.max() + 1, n)
+        last = npy.full(labels.max() + 1, -1)
+        npy.minimum.at(first, labels, pos)
+        npy.maximum.at(last, labels, pos)
+        changes = changes[(last[labels[changes - 1]] == changes - 1) & (first[labels[changes]] == changes)]
+    return npy.concatenate([[0], changes, [n]])
+
+# SEGMENT_OFFSETS ============================================================================
+
+def segment_offsets(df: pd.DataFrame) -> npy.ndarray:
+    """
+    Límites de los segmentos de un DataFrame de `parse_gpx` (o derivado): array
+    `[0, …, len(df)]` con el índice del primer punto de cada segmento. Si no hay
+    información de segmentos (o no cuadra con `df`), un único segmento.
+    """
+    offsets = df.attrs.get('segment_offsets')
+    if offsets is None or len(offsets) < 2 or offsets[-1] != len(df):
+        return npy.array([0, len(df)])
+    return npy.asarray(offsets)
+
+# POINT_KINEMATICS ===========================================================================
+
+def point_kinematics(lat: npy.ndarray, lon: npy.ndarray, time: npy.ndarray, offsets) -> tuple:
+    """
+    Columnas por punto de `parse_gpx` a partir de las coordenadas, la hora
+    (`datetime64[ns]`, NaT si falta) y los límites de segmento: `(dist, d_dist, dt, speed)`.
+    Sin distancia entre segmentos (`d_dist` = 0 en el primer punto de cada uno).
+    """
+    n = len(lat)
+    d_dist, dt = npy.zeros(n), npy.zeros(n)
+    if n > 1:
+        d_dist[1:] = haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
+        d_dist[npy.asarray(offsets)[1:-1]] = 0.0      # sin distancia entre segmentos
+        valid = ~npy.isnat(time[1:]) & ~npy.isnat(time[:-1])
+        dt[1:] = npy.where(valid, (time[1:] - time[:-1]) / npy.timedelta64(1, 's'), 0.0)
+
+    #speed = npy.nan_to_num(d_dist / dt, nan=0.0, posinf=0.0, neginf=0.0)
+    speed = npy.divide(d_dist, dt, out=npy.zeros_like(d_dist), where=dt>0)
+    speed = npy.nan_to_num(speed, nan=0.0, posinf=0.0, neginf=0.0)
+    return npy.cumsum(d_dist), d_dist, dt, speed
+
+# PARSE_GPX ==================================================================================
+
+@profiled()
 def parse_gpx(file) -> pd.DataFrame:
     """
     Parsea un fichero GPX (pistas) y devuelve un DataFrame “ordenado” de puntos
@@ -26,8 +158,10 @@ def parse_gpx(file) -> pd.DataFrame:
         - ele    : float – altitud en metros (se completa con ffill/bfill para evitar NaN).
         - hr     : float – frecuencia cardiaca en bpm (si está en extensiones), NaN si no.
         - cad    : float – cadencia en rpm (si está en extensiones), NaN si no.
-        - dist   : float – distancia acumulada en metros a lo largo del track.
-        - d_dist : float – distancia incremental (m) entre este punto y el anterior.
+        - dist   : float – distancia acumulada en metros a lo largo del track (sin contar
+                   los saltos entre segmentos).
+        - d_dist : float – distancia incremental (m) entre este punto y el anterior (0 en
+                   el primer punto de cada segmento).
         - dt     : float – tiempo incremental (s) entre este punto y el anterior.
         - speed  : float – velocidad instantánea (m/s), división segura (0 si dt ≤ 0).
 
@@ -39,7 +173,15 @@ def parse_gpx(file) -> pd.DataFrame:
     pueden no estar presentes.
     - La distancia incremental se calcula con la fórmula de haversine (Tierra esférica,
     R = 6_371_000 m). Para precisión geodésica mayor, usar métodos elipsoidales.
-    - El resultado se ordena por `time` y se eliminan duplicados por (`time`, `lat`, `lon`).
+    - Los límites de los `<trkseg>` se conservan en `df.attrs['segment_offsets']`: tupla
+    de enteros `(0, …, len(df))` con el primer índice de cada segmento (ver
+    `segment_offsets`).
+    - El resultado queda ordenado por `time` (los puntos sin hora, al final). Si los
+    segmentos ya vienen ordenados, que es lo habitual, no se ordena nada; si no, se
+    ordena cada segmento y se mezclan (k-way merge) manteniendo el orden del fichero
+    entre puntos con la misma hora. Los segmentos que se solapan en el tiempo quedan
+    fundidos en uno (ver `_merged_offsets`).
+    - Se eliminan los puntos consecutivos repetidos (mismos `time`, `lat` y `lon`).
     - `speed` se calcula con `npy.divide(..., where=dt>0)` para evitar avisos de división
     por cero y se sanea con `npy.nan_to_num`.
 
@@ -60,59 +202,43 @@ def parse_gpx(file) -> pd.DataFrame:
         content = content.decode("utf-8", errors="ignore")
     gpx = gpxpy.parse(content)
 
-    records = []
-    for track in gpx.tracks:
-        for segment in track.segments:
-            for p in segment.points:
-                hr = None
-                cad = None
-                try:
-                    if p.extensions:
-                        for ext in p.extensions:
-                            for child in ext.iter():
-                                tag = child.tag.lower()
-                                if tag.endswith('heartrate') or tag.endswith('hr'):
-                                    try:
-                                        hr = int(child.text)
-                                    except Exception:
-                                        pass
-                                if tag.endswith('cadence') or tag.endswith('cad'):
-                                    try:
-                                        cad = int(child.text)
-                                    except Exception:
-                                        pass
-                except Exception:
-                    pass
-                records.append({
-                    'time': p.time.replace(tzinfo=timezone.utc) if isinstance(p.time, datetime) else None,
-                    'lat': p.latitude,
-                    'lon': p.longitude,
-                    'ele': p.elevation,
-                    'hr': hr,
-                    'cad': cad,
-                })
-    df = pd.DataFrame.from_records(records)
-
-    if df.empty:
-        return df
-
-    df = df.sort_values('time').drop_duplicates(subset=['time', 'lat', 'lon']).reset_index(drop=True)
-    lat, lon = df['lat'].values, df['lon'].values
-    ele = df['ele'].ffill().bfill().values
-    d, d_dist, dt = npy.zeros(len(df)), npy.zeros(len(df)), npy.zeros(len(df))
-
-    for i in range(1, len(df)):
-        dxy = haversine(lat[i-1], lon[i-1], lat[i], lon[i])
-        d_dist[i] = dxy
-        d[i] = d[i-1] + dxy
-        if pd.notnull(df.loc[i, 'time']) and pd.notnull(df.loc[i-1, 'time']):
-            dt[i] = (df.loc[i, 'time'] - df.loc[i-1, 'time']).total_seconds()
+    segments = [_segment_columns(segment) for track in gpx.tracks for segment in track.segments
+                if segment.points]
+    if not segments:
+        return pd.DataFrame()
 
-    #speed = npy.nan_to_num(d_dist / dt, nan=0.0, posinf=0.0, neginf=0.0)
-    speed = npy.divide(d_dist, dt, out=npy.zeros_like(d_dist), where=dt>0)
-    speed = npy.nan_to_num(speed, nan=0.0, posinf=0.0, neginf=0.0)
+    cols = {name: npy.concatenate([seg[name] for seg in segments]) for name in _POINT_FIELDS}
+    offsets = npy.concatenate([[0], npy.cumsum([len(seg['lat']) for seg in segments])])
+    labels = npy.repeat(npy.arange(len(segments)), npy.diff(offsets))
+
+    # orden por tiempo (NaT al final) solo si hace falta; luego, duplicados consecutivos
+    keys = cols['time'].view('int64').copy()
+    keys[npy.isnat(cols['time'])] = npy.iinfo(npy.int64).max
+    order = _time_order(keys, offsets)
+    if order is not None:
+        keys, labels = keys[order], labels[order]
+        cols = {name: values[order] for name, values in cols.items()}
+    keep = npy.ones(len(keys), dtype=bool)
+    keep[1:] = ((keys[1:] != keys[:-1]) | (cols['lat'][1:] != cols['lat'][:-1])
+                | (cols['lon'][1:] != cols['lon'][:-1]))
+    if not keep.all():
+        labels = labels[keep]
+        cols = {name: values[keep] for name, values in cols.items()}
+    offsets = _merged_offsets(labels)
+
+    lat, lon, time = cols['lat'], cols['lon'], cols['time']
+    d, d_dist, dt, speed = point_kinematics(lat, lon, time, offsets)
 
-    df['ele'] = ele
+    df = pd.DataFrame({
+        'time': pd.DatetimeIndex(time).tz_localize(timezone.utc),
+        'lat': lat,
+        'lon': lon,
+        'ele': pd.Series(cols['ele']).ffill().bfill().to_numpy(),
+        'hr': cols['hr'],
+        'cad': cols['cad'],
+    })
     df['dist'], df['d_dist'], df['dt'], df['speed'] = d, d_dist, dt, speed
+    # tupla y no array: pandas compara los attrs con == al concatenar
+    df.attrs['segment_offsets'] = tuple(offsets.tolist())
 
     return df
@@ -0,0 +1,506 @@
+# ============================================================================================
+# LIBRARY.PY
+# ============================================================================================
+#
+# Biblioteca persistente de actividades sobre SQLite (biblioteca estándar):
+#
+#   lib = ActivityLibrary("actividades.db")
+#   lib.add_many((p.name, p.read_bytes()) for p in Path("archivo").glob("*.gpx"))
+#   lib.query(min_km=80, start="2026-01-01", end="2027-01-01", bbox=(43.2, -3.0, 43.3, -2.9))
+#
+# Una fila por actividad con el resumen de `compute_metrics`, hora de inicio, bbox y hash de
+# contenido; el bbox se indexa con un R*Tree. Los puntos no van en la base de datos: cada
+# track se guarda como `.npz` (`Track.save`) en un directorio junto a ella.
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import io
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+import numpy as npy
+import pandas as pd
+from .hashing import content_hash
+from .io import parse_gpx
+from .metrics import compute_metrics
+from .track import Track
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+# Columnas de la tabla `activities` (además de 'id'), en el orden en que se insertan
+SUMMARY_COLUMNS = [
+    'hash', 'name', 'sport', 'start_ts', 'end_ts', 'points', 'distance_km', 'elapsed_time_s',
+    'moving_time_s', 'avg_moving_speed_kmh', 'max_speed_kmh', 'elev_gain_m',
+    'min_lat', 'max_lat', 'min_lon', 'max_lon', 'start_lat', 'start_lon', 'end_lat', 'end_lon',
+    'added_ts',
+]
+
+# Columnas de la tabla `files`
+FILE_COLUMNS = ['path', 'size', 'mtime_ns', 'hash', 'error', 'ingested_ts']
+
+# Filas por transacción en las inserciones en bloque
+DEFAULT_BATCH_SIZE = 500
+
+# Conexiones abiertas a la vez (lectores concurrentes en WAL; un solo escritor)
+DEFAULT_POOL_SIZE = 4
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS activities (
+    id                   INTEGER PRIMARY KEY,
+    hash                 TEXT NOT NULL UNIQUE,
+    name                 TEXT,
+    sport                TEXT,
+    start_ts             REAL,
+    end_ts               REAL,
+    points               INTEGER,
+    distance_km          REAL,
+    elapsed_time_s       REAL,
+    moving_time_s        REAL,
+    avg_moving_speed_kmh REAL,
+    max_speed_kmh        REAL,
+    elev_gain_m          REAL,
+    min_lat REAL, max_lat REAL, min_lon REAL, max_lon REAL,
+    start_lat REAL, start_lon REAL, end_lat REAL, end_lon REAL,
+    added_ts             REAL
+);
+CREATE INDEX IF NOT EXISTS activities_start ON activities (start_ts);
+CREATE INDEX IF NOT EXISTS activities_distance ON activities (distance_km);
+CREATE INDEX IF NOT EXISTS activities_sport ON activities (sport, start_ts);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS activity_bbox USING rtree (id, min_lat, max_lat, min_lon, max_lon);
+
+CREATE TRIGGER IF NOT EXISTS activities_bbox_insert AFTER INSERT ON activities
+WHEN new.min_lat IS NOT NULL BEGIN
+    INSERT INTO activity_bbox VALUES (new.id, new.min_lat, new.max_lat, new.min_lon, new.max_lon);
+END;
+CREATE TRIGGER IF NOT EXISTS activities_bbox_delete AFTER DELETE ON activities BEGIN
+    DELETE FROM activity_bbox WHERE id = old.id;
+END;
+
+-- Ficheros ya procesados por la ingesta (`gpxra.ingest`), para reanudar sin releerlos
+CREATE TABLE IF NOT EXISTS files (
+    path        TEXT PRIMARY KEY,
+    size        INTEGER,
+    mtime_ns    INTEGER,
+    hash        TEXT,
+    error       TEXT,
+    ingested_ts REAL
+);
+"""
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# _TIMESTAMP =================================================================================
+
+def _timestamp(value) -> float | None:
+    """Fecha (str, datetime, Timestamp) → segundos desde 1970 en UTC (las naive se toman como UTC)."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize("UTC")
+    return ts.timestamp()
+
+# _FLOAT =====================================================================================
+
+def _float(value) -> float | None:
+    """Escalar de NumPy/pandas → float de Python (None si falta o no es finito)."""
+    if value is None or pd.isna(value):
+        return None
+    value = float(value)
+    return value if npy.isfinite(value) else None
+
+# SUMMARY_ROW ================================================================================
+
+def summary_row(metrics: dict, df_proc: pd.DataFrame, hash: str, name: str | None = None,
+                sport: str | None = None) -> dict:
+    """
+    Fila de la tabla `activities` (`SUMMARY_COLUMNS`) a partir de la salida de
+    `compute_metrics`: resumen, hora de inicio y fin, bbox y primer/último punto.
+    """
+    lat = df_proc['lat'].to_numpy(dtype=float, na_value=npy.nan)
+    lon = df_proc['lon'].to_numpy(dtype=float, na_value=npy.nan)
+    valid = ~(npy.isnan(lat) | npy.isnan(lon))
+    lat, lon = lat[valid], lon[valid]
+    time_ = df_proc['time'].dropna() if 'time' in df_proc else pd.Series([], dtype=object)
+    ele = df_proc['ele'] if 'ele' in df_proc else pd.Series([], dtype=float)
+    has_pos = len(lat) > 0
+    return {
+        'hash': hash,
+        'name': name,
+        'sport': sport,
+        'start_ts': _timestamp(time_.iloc[0]) if len(time_) else None,
+        'end_ts': _timestamp(time_.iloc[-1]) if len(time_) else None,
+        'points': int(len(df_proc)),
+        'distance_km': _float(metrics.get('distance_km')),
+        'elapsed_time_s': _float(metrics.get('elapsed_time_s')),
+        'moving_time_s': _float(metrics.get('moving_time_s')),
+        'avg_moving_speed_kmh': _float(metrics.get('avg_moving_speed_kmh')),
+        'max_speed_kmh': _float(metrics.get('max_speed_kmh')),
+        'elev_gain_m': _float(ele.diff().clip(lower=0).sum()) if len(ele) else None,
+        'min_lat': float(lat.min()) if has_pos else None,
+        'max_lat': float(lat.max()) if has_pos else None,
+        'min_lon': float(lon.min()) if has_pos else None,
+        'max_lon': float(lon.max()) if has_pos else None,
+        'start_lat': float(lat[0]) if has_pos else None,
+        'start_lon': float(lon[0]) if has_pos else None,
+        'end_lat': float(lat[-1]) if has_pos else None,
+        'end_lon': float(lon[-1]) if has_pos else None,
+        'added_ts': time.time(),
+    }
+
+# ANALYZE_ACTIVITY ===========================================================================
+
+def analyze_activity(data: bytes, name: str | None = None, sport: str | None = None,
+                     moving_speed_threshold: float = 0.5) -> tuple[dict, Track]:
+    """
+    Parsea un GPX y calcula sus métricas: `(fila de resumen, Track compacto de df_proc)`.
+    Función de nivel de módulo para poder ejecutarse en un pool de procesos.
+    """
+    df = parse_gpx(io.BytesIO(data))
+    if df.empty:
+        raise ValueError("el GPX no contiene puntos de track")
+    metrics, df_proc, _ = compute_metrics(df, moving_speed_threshold)
+    row = summary_row(metrics, df_proc, content_hash(data), name=name, sport=sport)
+    return row, Track.from_frame(df_proc, compact=True)
+
+# TRACK_FILE / SAVE_TRACK ====================================================================
+
+def track_file(tracks_dir: str, hash: str) -> str:
+    """Fichero del track de una actividad en la caché binaria."""
+    return os.path.join(tracks_dir, f"{hash}.npz")
+
+def save_track(tracks_dir: str, hash: str, track: Track) -> None:
+    """
+    Guarda un track en la caché binaria (si no estaba). Se escribe en un temporal y se
+    renombra, así que un lector nunca ve un fichero a medias, aunque escriban varios
+    procesos a la vez.
+    """
+    path = track_file(tracks_dir, hash)
+    if os.path.exists(path):
+        return
+    tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp.npz"
+    track.save(tmp)
+    os.replace(tmp, path)
+
+# ============================================================================================
+# CONNECTIONPOOL
+# ============================================================================================
+
+class ConnectionPool:
+    """
+    Conexiones SQLite reutilizables entre hilos (hasta `size` abiertas a la vez).
+
+    Cada conexión se abre en modo WAL (los lectores no bloquean al escritor ni al revés)
+    con `synchronous=NORMAL` y espera hasta `timeout` s si la base de datos está ocupada.
+    Con `path=":memory:"` solo hay una conexión (cada una vería una base de datos distinta).
+    """
+
+    def __init__(self, path: str, size: int = DEFAULT_POOL_SIZE, timeout: float = 30.0):
+        self.path = path
+        self.timeout = float(timeout)
+        self.size = 1 if path == ":memory:" else max(1, int(size))
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._all: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                               isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Presta una conexión durante el bloque `with` (en modo autocommit)."""
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._open()
+            try:
+                yield conn
+            finally:
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def transaction(self):
+        """Conexión con una transacción `BEGIN IMMEDIATE` (commit al salir, rollback si falla)."""
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all.clear()
+        self._idle = queue.LifoQueue()
+
+# ============================================================================================
+# ACTIVITYLIBRARY
+# ============================================================================================
+
+class ActivityLibrary:
+    """
+    Biblioteca persistente de actividades: resumen en SQLite y puntos en una caché binaria.
+
+    Parámetros
+    ----------
+    path : str
+        Fichero de la base de datos (se crea si no existe) o ":memory:".
+    tracks_dir : str, opcional
+        Directorio de los tracks (`<hash>.npz`). Por defecto, `<path>.tracks` junto a la
+        base de datos; con ":memory:", ninguno (no se guardan los puntos).
+    pool_size : int, opcional
+        Conexiones simultáneas (ver `ConnectionPool`).
+    batch_size : int, opcional
+        Filas por transacción en `add_many` / `insert`.
+
+    Notas
+    -----
+    - Una actividad se identifica por el hash de contenido del GPX: añadir dos veces el
+    mismo fichero no duplica la fila (se conserva la primera).
+    - El bbox de cada actividad se indexa en un R*Tree (`activity_bbox`); la hora de
+    inicio, la distancia y el deporte, con índices B-tree. Una consulta combinada sobre
+    decenas de miles de actividades tarda milisegundos.
+    - Las inserciones van en transacciones de `batch_size` filas (`executemany`): insertar
+    fila a fila con commit cada vez es órdenes de magnitud más lento.
+    - Es seguro usarla desde varios hilos.
+
+    Ejemplos
+    --------
+    >>> lib = ActivityLibrary("actividades.db")
+    >>> lib.add(open("ruta.gpx", "rb").read(), name="ruta.gpx", sport="ciclismo")   # doctest: +SKIP
+    >>> lib.query(sport="ciclismo", min_km=80, start="2026-01-01", end="2027-01-01",
+    ...           bbox=(43.2, -3.0, 43.3, -2.9))                                  # doctest: +SKIP
+    >>> lib.track(row_hash).to_frame()                                             # doctest: +SKIP
+    """
+
+    def __init__(self, path: str, tracks_dir: str | None = None, pool_size: int = DEFAULT_POOL_SIZE,
+                 batch_size: int = DEFAULT_BATCH_SIZE):
+        self.path = path
+        if tracks_dir is None and path != ":memory:":
+            tracks_dir = f"{path}.tracks"
+        self.tracks_dir = tracks_dir
+        if tracks_dir:
+            os.makedirs(tracks_dir, exist_ok=True)
+        self.batch_size = max(1, int(batch_size))
+        self.pool = ConnectionPool(path, size=pool_size)
+        with self.pool.connection() as conn:
+            conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.pool.close()
+
+    def __enter__(self) -> "ActivityLibrary":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM activities").fetchone()[0]
+
+    def __contains__(self, hash: str) -> bool:
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT 1 FROM activities WHERE hash = ?", (hash,)).fetchone() is not None
+
+    # ESCRITURA ==============================================================================
+
+    def _track_path(self, hash: str) -> str | None:
+        return track_file(self.tracks_dir, hash) if self.tracks_dir else None
+
+    def insert(self, rows, tracks=None) -> int:
+        """
+        Inserta filas de resumen (`summary_row`) en transacciones de `batch_size` y, si se
+        pasan, guarda sus tracks (`tracks[i]` es el de `rows[i]`). Las filas cuyo hash ya
+        está en la biblioteca se ignoran. Devuelve el nº de filas nuevas.
+        """
+        rows = list(rows)
+        if tracks is not None and self.tracks_dir:
+            for row, track in zip(rows, tracks):
+                if track is not None:
+                    save_track(self.tracks_dir, row['hash'], track)
+        sql = (f"INSERT OR IGNORE INTO activities ({', '.join(SUMMARY_COLUMNS)}) "
+               f"VALUES ({', '.join('?' * len(SUMMARY_COLUMNS))})")
+        added = 0
+        for i in range(0, len(rows), self.batch_size):
+            batch = [tuple(row.get(c) for c in SUMMARY_COLUMNS) for row in rows[i:i + self.batch_size]]
+            with self.pool.transaction() as conn:
+                added += conn.executemany(sql, batch).rowcount
+        return added
+
+    def add(self, data: bytes, name: str | None = None, sport: str | None = None,
+            moving_speed_threshold: float = 0.5) -> str:
+        """Analiza y añade un GPX (si no estaba). Devuelve su hash de contenido."""
+        hash = content_hash(data)
+        if hash not in self:
+            row, track = analyze_activity(data, name, sport, moving_speed_threshold)
+            self.insert([row], [track])
+        return hash
+
+    def add_many(self, items, sport: str | None = None, moving_speed_threshold: float = 0.5) -> list[str]:
+        """
+        Analiza y añade muchos GPX `(nombre, bytes)`, escribiendo en lotes de `batch_size`.
+        Los ficheros que ya están (por hash) no se vuelven a analizar. Devuelve los hashes,
+        en orden; los que no se han podido leer se omiten.
+        """
+        hashes, rows, tracks = [], [], []
+        for name, data in items:
+            hash = content_hash(data)
+            hashes.append(hash)
+            if hash in self or any(r['hash'] == hash for r in rows):
+                continue
+            try:
+                row, track = analyze_activity(data, name, sport, moving_speed_threshold)
+            except Exception:
+                hashes.pop()
+                continue
+            rows.append(row)
+            tracks.append(track)
+            if len(rows) >= self.batch_size:
+                self.insert(rows, tracks)
+                rows, tracks = [], []
+        if rows:
+            self.insert(rows, tracks)
+        return hashes
+
+    def record_files(self, rows) -> None:
+        """
+        Anota ficheros procesados (`FILE_COLUMNS`: ruta, tamaño, mtime, hash y error, si lo
+        hubo), en transacciones de `batch_size`. Una ruta ya anotada se sobrescribe.
+        """
+        rows = [tuple(row.get(c) for c in FILE_COLUMNS) for row in rows]
+        sql = (f"INSERT OR REPLACE INTO files ({', '.join(FILE_COLUMNS)}) "
+               f"VALUES ({', '.join('?' * len(FILE_COLUMNS))})")
+        for i in range(0, len(rows), self.batch_size):
+            with self.pool.transaction() as conn:
+                conn.executemany(sql, rows[i:i + self.batch_size])
+
+    def ingested_files(self) -> dict:
+        """Ficheros ya procesados: ruta → `(tamaño, mtime_ns)`."""
+        with self.pool.connection() as conn:
+            return {path: (size, mtime_ns) for path, size, mtime_ns
+                    in conn.execute("SELECT path, size, mtime_ns FROM files")}
+
+    def remove(self, hash: str) -> bool:
+        """Borra una actividad (fila y track). True si existía."""
+        with self.pool.transaction() as conn:
+            deleted = conn.execute("DELETE FROM activities WHERE hash = ?", (hash,)).rowcount > 0
+        path = self._track_path(hash)
+        if path and os.path.exists(path):
+            os.remove(path)
+        return deleted
+
+    # LECTURA ================================================================================
+
+    def query(self, min_km: float | None = None, max_km: float | None = None, start=None, end=None,
+              bbox=None, sport: str | None = None, limit: int | None = None, exact: bool = False) -> pd.DataFrame:
+        """
+        Actividades que cumplen todos los filtros indicados, ordenadas por hora de inicio.
+
+        Parámetros
+        ----------
+        min_km, max_km : float, opcional
+            Distancia mínima / máxima (km).
+        start, end : str | datetime, opcional
+            Inicio de la actividad en `[start, end)` (las fechas sin zona se toman en UTC).
+        bbox : tuple, opcional
+            `(lat_min, lon_min, lat_max, lon_max)`: actividades cuyo bbox lo corta (R*Tree).
+        sport : str, opcional
+            Deporte exacto.
+        limit : int, opcional
+            Máximo de filas.
+        exact : bool, opcional
+            Con `bbox`, comprueba además con los puntos de cada candidata que la ruta
+            pasa de verdad por él (necesita los tracks en la caché binaria).
+
+        Devuelve
+        --------
+        pandas.DataFrame
+            'id' y `SUMMARY_COLUMNS`, con 'start'/'end' como fechas UTC.
+        """
+        where, params = [], []
+        source = "activities a"
+        if bbox is not None:
+            # CROSS JOIN fija el orden: primero el R*Tree y luego cada candidata por su id
+            # (si no, SQLite puede recorrer el índice de fechas y consultar el R*Tree fila a fila)
+            lat_min, lon_min, lat_max, lon_max = (float(v) for v in bbox)
+            source = "activity_bbox r CROSS JOIN activities a ON r.id = a.id"
+            where += ["r.max_lat >= ?", "r.min_lat <= ?", "r.max_lon >= ?", "r.min_lon <= ?"]
+            params += [lat_min, lat_max, lon_min, lon_max]
+        if min_km is not None:
+            where.append("a.distance_km >= ?"); params.append(float(min_km))
+        if max_km is not None:
+            where.append("a.distance_km <= ?"); params.append(float(max_km))
+        if start is not None:
+            where.append("a.start_ts >= ?"); params.append(_timestamp(start))
+        if end is not None:
+            where.append("a.start_ts < ?"); params.append(_timestamp(end))
+        if sport is not None:
+            where.append("a.sport = ?"); params.append(sport)
+        sql = f"SELECT a.id, {', '.join('a.' + c for c in SUMMARY_COLUMNS)} FROM {source}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY a.start_ts"
+        if limit is not None and not (exact and bbox is not None):
+            sql += f" LIMIT {int(limit)}"
+        with self.pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        df = pd.DataFrame(rows, columns=['id', *SUMMARY_COLUMNS])
+        if exact and bbox is not None and len(df):
+            keep = [self._passes_through(h, lat_min, lon_min, lat_max, lon_max) for h in df['hash']]
+            df = df[keep].reset_index(drop=True)
+            if limit is not None:
+                df = df.head(int(limit))
+        df['start'] = pd.to_datetime(df['start_ts'], unit='s', utc=True)
+        df['end'] = pd.to_datetime(df['end_ts'], unit='s', utc=True)
+        return df
+
+    def _passes_through(self, hash: str, lat_min, lon_min, lat_max, lon_max) -> bool:
+        track = self.track(hash)
+        if track is None:
+            return False
+        lat, lon = track['lat'], track['lon']
+        return bool(npy.any((lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)))
+
+    def get(self, hash: str) -> dict | None:
+        """Fila de resumen de una actividad (o None)."""
+        with self.pool.connection() as conn:
+            row = conn.execute(f"SELECT id, {', '.join(SUMMARY_COLUMNS)} FROM activities WHERE hash = ?",
+                               (hash,)).fetchone()
+        return None if row is None else dict(zip(['id', *SUMMARY_COLUMNS], row))
+
+    def track(self, hash: str) -> Track | None:
+        """Puntos de una actividad (`Track` compacto de `df_proc`) o None si no están en la caché."""
+        path = self._track_path(hash)
+        if not path or not os.path.exists(path):
+            return None
+        return Track.load(path)
@@ -14,6 +14,9 @@ from folium.plugins import MiniMap, Fullscreen, MeasureControl, Draw, PolyLineTe
 from branca.colormap import LinearColormap
 import numpy as npy
 import pandas as pd
+from .formatting import ROUTE_COLORS
+from .metrics import compute_grade, detect_stops
+from .profiling import profiled
 
 # ============================================================================================
 # CONFIGURACIÓN
@@ -58,6 +61,7 @@ def build_map(center, base_key: str, show_minimap: bool = True, show_measure: bo
 
 # PREPARE_COORDS =============================================================================
 
+@profiled()
 def prepare_coords(df_proc: pd.DataFrame, max_points: int) -> pd.DataFrame:
     """Submuestrea puntos y añade speed_kmh para pintar en el mapa."""
     coords_df = df_proc[['lat','lon','ele','speed','dist','time']].dropna(subset=['lat','lon']).copy()
@@ -80,6 +84,7 @@ def _robust_min_max(values: pd.Series, mode: str):
 
 # DRAW_ROUTE =================================================================================
 
+@profiled()
 def draw_route(m, coords_df: pd.DataFrame, map_mode: str, color_range_mode: str, point_radius: int, color_hex: str):
     """Dibuja línea única o puntos coloreados por velocidad/altitud."""
     if coords_df.empty:
@@ -117,24 +122,14 @@ def draw_route(m, coords_df: pd.DataFrame, map_mode: str, color_range_mode: str,
     if map_mode == "Velocidad":
         values = coords_df['speed_kmh']
         vmin, vmax = _robust_min_max(values)
-        cmap = LinearColormap(
-            ["#313695","#4575b4","#74add1","#abd9e9","#e0f3f8",
-             "#ffffbf",
-             "#fee090","#fdae61","#f46d43","#d73027","#a50026"],
-            vmin=vmin, vmax=vmax
-        )
+        cmap = LinearColormap(ROUTE_COLORS, vmin=vmin, vmax=vmax)
         cmap.caption = "Velocidad (km/h)"
 
     # Línea coloreada por altitud
     if map_mode == "Altitud":
         values = coords_df['ele']
         vmin, vmax = _robust_min_max(values)
-        cmap = LinearColormap(
-            ["#313695","#4575b4","#74add1","#abd9e9","#e0f3f8",
-             "#ffffbf",
-             "#fee090","#fdae61","#f46d43","#d73027","#a50026"],
-            vmin=vmin, vmax=vmax
-        )
+        cmap = LinearColormap(ROUTE_COLORS, vmin=vmin, vmax=vmax)
         cmap.caption = "Altitud (m)"
 
     m.add_child(cmap)
@@ -197,8 +192,104 @@ def add_start_end_markers(m, coords_df: pd.DataFrame, layer=None):
     _add_marker(target, start, f"Inicio: {start['time']}", "green", "play")
     _add_marker(target, end, f"Fin: {end['time']}", "red", "flag-checkered")
 
+# MARKER_POSITIONS ===========================================================================
+
+def _interpolate_at(axis: npy.ndarray, targets: npy.ndarray, *values: npy.ndarray):
+    """
+    Interpola linealmente `values` en las posiciones `targets` de un eje monótono
+    no decreciente (`axis`). Usa `searchsorted`, por lo que el coste es
+    O(M·log N) para M objetivos sobre N puntos.
+    """
+    idx = npy.searchsorted(axis, targets, side="left")
+    idx = npy.clip(idx, 1, len(axis) - 1)
+    a0, a1 = axis[idx - 1], axis[idx]
+    span = a1 - a0
+    frac = npy.divide(targets - a0, span, out=npy.ones_like(targets, dtype=float), where=span > 0)
+    return [v[idx - 1] + frac * (v[idx] - v[idx - 1]) for v in values]
+
+
+def marker_positions(df_proc: pd.DataFrame, every_km: float = 0, every_min: float = 0) -> pd.DataFrame:
+    """
+    Calcula la posición exacta de los hitos cada N km y/o cada N minutos.
+
+    Parámetros
+    ----------
+    df_proc : pandas.DataFrame
+        Puntos del track con, al menos, 'lat', 'lon' y 'dist' (m). Para hitos por
+        tiempo se necesita además 'time'.
+    every_km : float, opcional
+        Separación de los hitos de distancia en km. 0 (por defecto) los desactiva.
+    every_min : float, opcional
+        Separación de los hitos de tiempo transcurrido en minutos. 0 (por defecto)
+        los desactiva.
+
+    Devuelve
+    --------
+    pandas.DataFrame
+        Una fila por hito con las columnas:
+        - kind  : str – 'km' o 'min'.
+        - value : float – km o minutos del hito.
+        - lat, lon : float – posición interpolada sobre la ruta.
+        - km    : float – distancia acumulada en el hito.
+
+    Notas
+    -----
+    - La distancia y el tiempo acumulados son monótonos, así que cada hito se
+    localiza con `npy.searchsorted` y se interpola linealmente entre los dos
+    puntos que lo rodean (no se "salta" al punto más cercano).
+    - No copia `df_proc`: trabaja sobre vistas NumPy de las columnas necesarias,
+    por lo que escala a rutas de ultradistancia con cientos de hitos.
+
+    Ejemplos
+    --------
+    >>> marker_positions(df_proc, every_km=5).head()  # doctest: +SKIP
+    """
+
+    columns = ['kind', 'value', 'lat', 'lon', 'km']
+    if df_proc.empty:
+        return pd.DataFrame(columns=columns)
+
+    lat = df_proc['lat'].to_numpy(dtype=float)
+    lon = df_proc['lon'].to_numpy(dtype=float)
+    dist = df_proc['dist'].to_numpy(dtype=float)
+    valid = ~(npy.isnan(lat) | npy.isnan(lon))
+    if not valid.all():
+        lat, lon, dist = lat[valid], lon[valid], dist[valid]
+    if len(dist) < 2:
+        return pd.DataFrame(columns=columns)
+
+    frames = []
+    if every_km and every_km > 0:
+        targets = npy.arange(every_km, dist[-1] / 1000.0 + 1e-9, every_km)
+        if len(targets):
+            m_lat, m_lon = _interpolate_at(dist, targets * 1000.0, lat, lon)
+            frames.append(pd.DataFrame({'kind': 'km', 'value': targets,
+                                        'lat': m_lat, 'lon': m_lon, 'km': targets}))
+
+    if every_min and every_min > 0 and 'time' in df_proc.columns:
+        elapsed = (df_proc['time'] - df_proc['time'].iloc[0]).dt.total_seconds().to_numpy()
+        if not valid.all():
+            elapsed = elapsed[valid]
+        if not npy.isnan(elapsed).any():
+            targets = npy.arange(every_min, elapsed[-1] / 60.0 + 1e-9, every_min)
+            if len(targets):
+                m_lat, m_lon, m_dist = _interpolate_at(elapsed, targets * 60.0, lat, lon, dist)
+                frames.append(pd.DataFrame({'kind': 'min', 'value': targets,
+                                            'lat': m_lat, 'lon': m_lon, 'km': m_dist / 1000.0}))
+
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)[columns]
+
 # ADD_KM_MARKERS =============================================================================
 
+def _marker_label(kind: str, value: float) -> str:
+    if kind == 'km':
+        return f"{value:g}"
+    minutes = int(round(value))
+    return f"{minutes // 60}h{minutes % 60:02d}" if minutes >= 60 else f"{minutes}'"
+
+
 def add_km_markers(
     m,
     df_proc: pd.DataFrame,
@@ -211,30 +302,36 @@ def add_km_markers(
     arrow_size_px: int = 18,
     arrow_offset_px: int = 8,
     arrow_spacing: int = 3,         # nº de espacios entre flechas
+    every_min: int = 0,
 ):
     """
-    Esta función coloca marcas cada N km y/o flechas en el sentido de marcha sobre la ruta.
+    Esta función coloca marcas cada N km y/o cada N minutos y flechas en el sentido de
+    marcha sobre la ruta.
     - Si `layer` es None, añade al mapa directamente.
+    - Las posiciones de los hitos se calculan con `marker_positions` (interpoladas).
+    - Si `every_min > 0`, añade además hitos de tiempo transcurrido.
     - Si `show_arrows=True`, dibuja flechas siguiendo la polilínea de la ruta.
     """
     target = layer if layer is not None else m
 
-    # 1) Hitos cada N km (opcional)
-    if show_km_labels and every_km > 0:
-        df = df_proc.copy()
-        if 'km' not in df.columns:
-            df['km'] = df['dist'] / 1000.0
-        kms = np.arange(every_km, np.floor(df['km'].max()) + 1, every_km)
-        for k in kms:
-            i = (df['km'] - k).abs().idxmin()
-            row = df.loc[i]
+    # 1) Hitos cada N km y/o N minutos (opcional)
+    if show_km_labels and (every_km > 0 or every_min > 0):
+        markers = marker_positions(df_proc, every_km=every_km, every_min=every_min)
+        for kind, value, lat, lon, km in markers.itertuples(index=False):
+            label = _marker_label(kind, value)
+            if kind == 'km':
+                tooltip = f"Km {label}"
+                style = "color:#333;border:1px solid #999;"
+            else:
+                tooltip = f"Tiempo {label} · km {km:.1f}"
+                style = "color:#1f4e79;border:1px dashed #1f4e79;font-style:italic;"
             folium.Marker(
-                [row['lat'], row['lon']],
-                tooltip=f"Km {int(k)}",
+                [lat, lon],
+                tooltip=tooltip,
                 icon=folium.DivIcon(
-                    html=f"<div style='font-weight:700;color:#333;background:rgba(255,255,255,.8);"
-                         f"padding:2px 4px;border-radius:4px;border:1px solid #999;'>"
-                         f"{int(k)}</div>"
+                    html=f"<div style='font-weight:700;background:rgba(255,255,255,.8);"
+                         f"padding:2px 4px;border-radius:4px;{style}'>"
+                         f"{label}</div>"
                 )
             ).add_to(target)
 
@@ -261,10 +358,18 @@ def add_km_markers(
 
 # ADD_KEY_POINT_MARKERS ======================================================================
 
+@profiled()
 def add_key_point_markers(
     m, df_proc: pd.DataFrame, grade_window: int = 9, min_stop_seconds: int = 60,
-    format_time_fn=None, layers: dict | None = None
+    format_time_fn=None, layers: dict | None = None, grade: pd.Series | None = None,
+    stops: pd.DataFrame | None = None
 ):
+    """
+    Añade los marcadores de puntos clave: altitud máx/mín, velocidad máx, pendiente
+    máx/mín (suavizada) y pausas ≥ `min_stop_seconds`.
+    - `grade` y `stops` permiten reutilizar la pendiente (`compute_grade`) y las pausas
+    (`detect_stops`) ya calculadas; si son None se calculan aquí.
+    """
     df_full = df_proc.dropna(subset=['lat','lon']).copy()
     # Elegir destino por capa si existen; si no, el propio mapa
     L_alt  = layers.get("altitude")    if layers else m
@@ -288,10 +393,7 @@ def add_key_point_markers(
 
     # Pendiente máx/min (suavizada)
     if {'ele','d_dist'}.issubset(df_full.columns):
-        grade_raw = 100.0 * df_full['ele'].diff() / df_full['d_dist'].replace(0, npy.nan)
-        win = max(1, int(grade_window))
-        grade_pct = grade_raw.rolling(window=win, min_periods=1, center=True).median().fillna(0)
-        df_full['grade_pct'] = grade_pct
+        df_full['grade_pct'] = compute_grade(df_full, grade_window) if grade is None else grade.reindex(df_full.index)
         if df_full['grade_pct'].notna().any():
             r_max_g = df_full.loc[df_full['grade_pct'].idxmax()]
             r_min_g = df_full.loc[df_full['grade_pct'].idxmin()]
@@ -299,21 +401,48 @@ def add_key_point_markers(
             _add_marker(L_perf, r_min_g, f"Pendiente mín.: {r_min_g['grade_pct']:.1f}% · {r_min_g['time']}", "blue", "arrow-down")
 
     # Pausas ≥ umbral
-    if {'moving','dt'}.issubset(df_full.columns) and df_full['dt'].notna().any():
-        # Analizamos todas las paradas en la ruta
-        tmp = df_full[['time','lat','lon','dt','moving']].copy()
-        tmp['is_stop'] = ~tmp['moving']
-        tmp['grp'] = (tmp['is_stop'] != tmp['is_stop'].shift()).cumsum()
-        stops = tmp[tmp['is_stop']].groupby('grp').agg(dur_s=('dt','sum'))
-        # Seleccionamos aquellas paradas con un tiempo superior a min_stop_seconds segundos
-        # Por defecto son 60 segundos (1 minuto) aquellas paradas que se representarán en el mapa
-        stops = stops[stops['dur_s'] >= int(min_stop_seconds)]
-        # Anadimos un marcador por cada parada
-        for gid, row_s in stops.iterrows():
-            seg = tmp[tmp['grp'] == gid]
-            mid_idx = seg.index[len(seg)//2]
-            r_stop = df_full.loc[mid_idx]
-            t0 = seg['time'].iloc[0].strftime("%H:%M:%S")
-            t1 = seg['time'].iloc[-1].strftime("%H:%M:%S")
-            dur_txt = format_time_fn(float(row_s['dur_s'])) if format_time_fn else f"{row_s['dur_s']:.0f}s"
-            _add_marker(L_stop, r_stop, f"Pausa {dur_txt} · {t0}–{t1}", "gray", "pause")
+    if stops is None:
+        stops = detect_stops(df_full, min_stop_seconds)
+    # Anadimos un marcador por cada parada
+    for _, row_s in stops.iterrows():
+        t0 = row_s['t0'].strftime("%H:%M:%S")
+        t1 = row_s['t1'].strftime("%H:%M:%S")
+        dur_txt = format_time_fn(float(row_s['dur_s'])) if format_time_fn else f"{row_s['dur_s']:.0f}s"
+        _add_marker(L_stop, row_s, f"Pausa {dur_txt} · {t0}–{t1}", "gray", "pause")
+
+# ADD_COMPARISON_LAYER =======================================================================
+
+def add_comparison_layer(m, tracks: dict, colors: dict, ghosts: pd.DataFrame | None = None,
+                         max_points: int = 1500, add_layer_control: bool = True):
+    """
+    Dibuja varias actividades superpuestas (una línea por actividad, cada una en su color)
+    y, si se pasa `ghosts` (salida de `ghost_positions`), la posición de cada una en el
+    instante elegido de la "carrera fantasma".
+
+    `tracks` es un dict nombre → puntos ('lat', 'lon'); cada actividad se dibuja sobre
+    sus propios puntos, submuestreados a ~`max_points`. Con `add_layer_control` (por
+    defecto) añade también el control de capas; pasar False si el mapa ya tiene uno
+    (p. ej. de `create_layers`).
+    """
+    routes = folium.FeatureGroup(name="Actividades", show=True)
+    for name, df in tracks.items():
+        coords = df[['lat', 'lon']].dropna()
+        step = max(1, len(coords) // max_points)
+        positions = coords.iloc[::step].values.tolist()
+        if len(positions) > 1:
+            folium.PolyLine(positions, weight=4, opacity=0.8, color=colors.get(name, "#1f77b4"),
+                            tooltip=str(name)).add_to(routes)
+    routes.add_to(m)
+
+    if ghosts is not None and not ghosts.empty:
+        layer = folium.FeatureGroup(name="Fantasmas", show=True)
+        for _, row in ghosts.iterrows():
+            folium.CircleMarker(
+                location=[row['lat'], row['lon']],
+                radius=8, weight=2, color="#ffffff", fill=True, fill_opacity=1.0,
+                fill_color=colors.get(row['track'], "#1f77b4"),
+                tooltip=f"{row['track']} · km {row['km']:.2f} · {row['delta_s']:+.0f} s",
+            ).add_to(layer)
+        layer.add_to(m)
+    if add_layer_control:
+        folium.LayerControl(collapsed=False).add_to(m)
@@ -8,6 +8,7 @@
 
 import pandas as pd
 import numpy as npy
+from .profiling import profiled
 
 # ============================================================================================
 # FUNCIONES
@@ -15,6 +16,7 @@ import numpy as npy
 
 # MAKE_SPLITS ================================================================================
 
+@profiled()
 def make_splits(df_proc: pd.DataFrame, split_km: int) -> pd.DataFrame:
     df = df_proc.copy()
     if 'km' not in df.columns:
@@ -37,8 +39,64 @@ def make_splits(df_proc: pd.DataFrame, split_km: int) -> pd.DataFrame:
         )
     return agg
 
+# COMPUTE_GRADE ==============================================================================
+
+def compute_grade(df_proc: pd.DataFrame, grade_window: int = 9) -> pd.Series:
+    """
+    Pendiente (%) por punto, `100 * Δaltitud / Δdistancia`, suavizada con una mediana
+    móvil centrada de `grade_window` puntos. Los puntos sin avance (`d_dist == 0`) no
+    aportan a la mediana; los huecos que queden se rellenan con 0.
+    """
+    grade_raw = 100.0 * df_proc['ele'].diff() / df_proc['d_dist'].replace(0, npy.nan)
+    win = max(1, int(grade_window))
+    return grade_raw.rolling(window=win, min_periods=1, center=True).median().fillna(0)
+
+# DETECT_STOPS ===============================================================================
+
+def detect_stops(df_proc: pd.DataFrame, min_stop_seconds: float = 60) -> pd.DataFrame:
+    """
+    Detecta las pausas: rachas consecutivas de puntos no `moving` cuya duración (suma de
+    `dt`) es de al menos `min_stop_seconds`.
+
+    Devuelve
+    --------
+    pandas.DataFrame
+        Una fila por pausa con:
+        - 'idx'   : etiqueta (índice de `df_proc`) del punto central de la pausa.
+        - 'lat', 'lon' : posición del punto central.
+        - 't0', 't1'   : hora del primer y último punto de la pausa.
+        - 'dur_s' : duración en segundos.
+
+    Notas
+    -----
+    - Se ignoran los puntos sin lat/lon. Totalmente vectorizado: las rachas se localizan
+    con `npy.diff` sobre la máscara de parada y la duración con una suma acumulada.
+    """
+    columns = ['idx', 'lat', 'lon', 't0', 't1', 'dur_s']
+    if df_proc.empty or not {'moving', 'dt'}.issubset(df_proc.columns):
+        return pd.DataFrame(columns=columns)
+    df = df_proc.dropna(subset=['lat', 'lon'])
+    is_stop = ~df['moving'].to_numpy(dtype=bool)
+    edges = npy.flatnonzero(npy.diff(npy.concatenate([[0], is_stop.astype(npy.int8), [0]])))
+    starts, ends = edges[::2], edges[1::2]          # rachas [start, end)
+    cum_dt = npy.concatenate([[0.0], npy.cumsum(npy.nan_to_num(df['dt'].to_numpy(dtype=float)))])
+    dur = cum_dt[ends] - cum_dt[starts]
+    keep = dur >= min_stop_seconds
+    starts, ends, dur = starts[keep], ends[keep], dur[keep]
+    mid = starts + (ends - starts) // 2
+    time = df['time']
+    return pd.DataFrame({
+        'idx': df.index[mid],
+        'lat': df['lat'].to_numpy()[mid],
+        'lon': df['lon'].to_numpy()[mid],
+        't0': time.iloc[starts].to_numpy(),
+        't1': time.iloc[ends - 1].to_numpy(),
+        'dur_s': dur,
+    }, columns=columns)
+
 # COMPUTE_METRICS ============================================================================
 
+@profiled()
 def compute_metrics(df: pd.DataFrame, moving_speed_threshold=0.5):
     """
     Calcula métricas agregadas de la actividad y genera columnas auxiliares y
@@ -92,6 +150,8 @@ def compute_metrics(df: pd.DataFrame, moving_speed_threshold=0.5):
     - `ritmo_min_km` puede ser NaN en splits sin distancia en movimiento.
     - Se asume que `df` está ordenado por `time`. Si está vacío, devuelve `{}`, `df`
     sin cambios y un DataFrame de splits vacío.
+    - Es `apply_moving_threshold(base_metrics(df), umbral)`: el pipeline cachea las dos
+    partes por separado, así que cambiar el umbral solo rehace la segunda.
 
     Ejemplos
     --------
@@ -101,18 +161,46 @@ def compute_metrics(df: pd.DataFrame, moving_speed_threshold=0.5):
     >>> splits[['km_inicio','dist_moving','time_moving']].head()  # doctest: +SKIP
     """
 
-    if df.empty:
-        return {}, df, pd.DataFrame()
+    return apply_moving_threshold(base_metrics(df), moving_speed_threshold)
 
+# BASE_METRICS ===============================================================================
+
+@profiled()
+def base_metrics(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Parte de `compute_metrics` que no depende del umbral de movimiento: copia de `df` con
+    'km' y 'split' (cada 5 km). `apply_moving_threshold` completa el resto.
+    """
+    if df.empty:
+        return df
     df = df.copy()
-    df['moving'] = df['speed'] > moving_speed_threshold
+    df['km'] = df['dist'] / 1000.0
+    df['split'] = npy.floor(df['km'] / 5).astype(int)
+    return df
+
+# APPLY_MOVING_THRESHOLD =====================================================================
+
+@profiled()
+def apply_moving_threshold(df_base: pd.DataFrame, moving_speed_threshold=0.5):
+    """
+    Parte de `compute_metrics` que depende del umbral, sobre la salida de `base_metrics`:
+    columna 'moving', métricas globales y parciales de 5 km. Devuelve lo mismo que
+    `compute_metrics`.
+
+    El DataFrame devuelto comparte las columnas de `df_base` (copia superficial más
+    'moving'): cambiar el umbral no rehace ni copia la distancia ni el resto de columnas
+    por punto. Por eso `df_base` no debe modificarse in situ después.
+    """
+    if df_base.empty:
+        return {}, df_base, pd.DataFrame()
+
+    df = df_base.copy(deep=False)
+    df.insert(df.columns.get_loc('km'), 'moving', df['speed'] > moving_speed_threshold)
     total_dist_m = df.loc[df['moving'], 'd_dist'].sum()
     elapsed_s = (df['time'].iloc[-1] - df['time'].iloc[0]).total_seconds()
     moving_s = df.loc[df['moving'], 'dt'].sum()
     avg_moving_speed = total_dist_m / moving_s if moving_s > 0 else 0.0
-    max_speed = df['speed'].max()
-    df['km'] = df['dist'] / 1000.0
-    df['split'] = npy.floor(df['km'] / 5).astype(int)
+    max_speed = float(df['speed'].max())
 
     splits = (
         df.groupby('split', as_index=False)
@@ -0,0 +1,295 @@
+# ============================================================================================
+# PIPELINE.PY
+# ============================================================================================
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable
+import pandas as pd
+from .cache import TrackCache
+from .compare import compare_activities
+from .dem import correct_elevation
+from .filtering import filter_gps
+from .hashing import content_hash
+from .io import parse_gpx
+from .metrics import apply_moving_threshold, base_metrics, make_splits, compute_grade, detect_stops
+from .resample import resample
+from .track import Track
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+# Modo de memoria reducida por defecto (tracks compactos en la caché compartida);
+# configurable con GPXRA_COMPACT_TRACKS=1
+DEFAULT_COMPACT = os.environ.get("GPXRA_COMPACT_TRACKS", "0").lower() not in ("", "0", "false", "no")
+
+# ============================================================================================
+# ESTRUCTURAS
+# ============================================================================================
+
+@dataclass(frozen=True)
+class Stage:
+    """Resultado de una etapa: su clave de caché (derivada de sus entradas reales) y su valor."""
+    key: str
+    value: Any
+
+@dataclass(frozen=True)
+class StageTiming:
+    """Tiempo de una etapa en la ejecución actual y si se sirvió desde la caché."""
+    stage: str
+    label: str
+    seconds: float
+    cached: bool
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# STAGE_KEY ==================================================================================
+
+def stage_key(*parts) -> str:
+    """Clave de una etapa a partir de las claves de sus etapas previas y sus parámetros."""
+    return content_hash(repr(parts).encode("utf-8"))
+
+# ============================================================================================
+# ANALYSISPIPELINE
+# ============================================================================================
+
+class AnalysisPipeline:
+    """
+    Pipeline de análisis por etapas con memoización:
+
+        parse → metrics_base → metrics (umbral) → splits / stops ─┐
+          └──────→ grade ─────────────────────────────────────────┴→ map / charts
+
+    Cada etapa se cachea con una clave derivada del hash de contenido de sus entradas
+    reales (bytes del GPX, clave de la etapa anterior y parámetros propios). Así, cambiar
+    un control solo invalida las etapas que dependen de él: mover el tamaño del parcial
+    recalcula `splits`, pero no vuelve a parsear ni a calcular métricas, y cambiar el umbral
+    de movimiento solo rehace 'moving' y el resumen (`metrics`), no las columnas por punto
+    (`metrics_base`).
+
+    Parámetros
+    ----------
+    max_entries : int, opcional
+        Nº máximo de resultados en caché (LRU). Por defecto 64.
+    track_cache : TrackCache, opcional
+        Caché compartida por el proceso (`shared_track_cache()`). Si se indica, los
+        resultados de `parse`, `metrics_base` y `metrics` se guardan en ella como `Track` de
+        solo lectura: varias sesiones con el mismo GPX comparten los mismos arrays, y cada
+        etapa reutiliza los de la anterior (solo añade sus columnas nuevas).
+    compact : bool, opcional
+        Modo de memoria reducida: los `Track` de la caché compartida se guardan compactos
+        (`Track.from_frame(df, compact=True)`). Por defecto, `GPXRA_COMPACT_TRACKS`.
+
+    Notas
+    -----
+    - `timings` contiene un `StageTiming` por cada etapa solicitada desde el último
+    `start_run()`, con su duración y si fue un acierto de caché.
+    - Los valores en caché se comparten entre ejecuciones: no deben modificarse in situ.
+    - Es seguro usarlo desde varios hilos (un `RLock` protege la caché).
+    - Con `track_cache`, los DataFrames de `parse` y `metrics` son de solo lectura:
+    escribir en ellos in situ lanza `ValueError` (usar `df.copy()`).
+
+    Ejemplos
+    --------
+    >>> pipe = AnalysisPipeline()
+    >>> parsed = pipe.parse(gpx_bytes, label="ruta.gpx")     # doctest: +SKIP
+    >>> met = pipe.metrics(parsed, moving_speed_threshold=0.5)  # doctest: +SKIP
+    >>> metrics, df_proc, splits = met.value                   # doctest: +SKIP
+    >>> pipe.timings                                           # doctest: +SKIP
+    """
+
+    def __init__(self, max_entries: int = 64, track_cache: TrackCache | None = None,
+                 compact: bool = DEFAULT_COMPACT):
+        self.max_entries = int(max_entries)
+        self.track_cache = track_cache
+        self.compact = bool(compact)
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.RLock()
+        self.timings: list[StageTiming] = []
+
+    def start_run(self) -> None:
+        """Empieza una nueva ejecución (vacía `timings`)."""
+        self.timings = []
+
+    def timings_frame(self) -> pd.DataFrame:
+        """`timings` como DataFrame (etapa, etiqueta, ms, caché)."""
+        return pd.DataFrame(
+            [(t.stage, t.label, t.seconds * 1000.0, t.cached) for t in self.timings],
+            columns=['stage', 'label', 'ms', 'cached'],
+        )
+
+    def run(self, stage: str, key: str, fn: Callable, *args, label: str = "", memoize: bool = True,
+            **kwargs) -> Stage:
+        """
+        Ejecuta `fn(*args, **kwargs)` como etapa `stage` con clave `key`, o devuelve el
+        resultado en caché. Sirve también para etapas propias de la aplicación. Con
+        `memoize=False` solo se cronometra: para resultados grandes que no conviene retener
+        (p. ej. ficheros de exportación).
+        """
+        full_key = (stage, key)
+        t0 = time.perf_counter()
+        with self._lock:
+            hit = memoize and full_key in self._cache
+            if hit:
+                self._cache.move_to_end(full_key)
+                value = self._cache[full_key]
+        if not hit:
+            value = fn(*args, **kwargs)
+            if memoize:
+                with self._lock:
+                    self._cache[full_key] = value
+                    while len(self._cache) > self.max_entries:
+                        self._cache.popitem(last=False)
+        self.timings.append(StageTiming(stage, label, time.perf_counter() - t0, hit))
+        return Stage(key, value)
+
+    def _shared(self, stage: str, key: str, fn: Callable, freeze: Callable, thaw: Callable):
+        """
+        Calcula `fn()` pasando por la caché compartida (si la hay): se guarda `freeze(valor)`
+        y cada sesión recibe `thaw(guardado)`, que no copia los arrays.
+        """
+        if self.track_cache is None:
+            return fn()
+        return thaw(self.track_cache.get_or_compute((stage, key), lambda: freeze(fn())))
+
+    def _track(self, df: pd.DataFrame) -> Track:
+        """
+        `Track` que se guarda en la caché compartida. En modo compacto, con sus columnas
+        derivadas ya calculadas: así las comparten todas las sesiones (y la caché las cuenta).
+        """
+        track = Track.from_frame(df, compact=self.compact)
+        return track.materialize() if self.compact else track
+
+    # ETAPAS =================================================================================
+
+    def parse(self, data: bytes, label: str = "") -> Stage:
+        """Parseo del GPX (puntos y métricas básicas por punto). Clave: hash de los bytes."""
+        key = content_hash(data)
+        return self.run(
+            "parse", key, self._shared, "parse", key, lambda: parse_gpx(io.BytesIO(data)),
+            self._track, Track.to_frame, label=label,
+        )
+
+    def elevation(self, parsed: Stage, dem_dir: str) -> Stage:
+        """
+        Altitud corregida con las teselas SRTM de `dem_dir` (`correct_elevation`). Devuelve
+        una etapa con la forma de `parse`, así que `metrics`, `grade`, … cuelgan de ella
+        igual. Con `track_cache`, se comparte entre sesiones como el parseo.
+        """
+        key = stage_key(parsed.key, os.path.abspath(dem_dir))
+        return self.run(
+            "elevation", key, self._shared, "elevation", key,
+            lambda: correct_elevation(parsed.value, dem_dir),
+            self._track, Track.to_frame,
+        )
+
+    def filter(self, parsed: Stage, smooth: bool = False) -> Stage:
+        """
+        Puntos sin el ruido del GPS (`filter_gps`): descarte de saltos y, con `smooth`,
+        suavizado de Kalman. Con la forma de `parse`, como `elevation`.
+        """
+        key = stage_key(parsed.key, bool(smooth))
+        return self.run(
+            "filter", key, self._shared, "filter", key,
+            lambda: filter_gps(parsed.value, smooth=smooth),
+            self._track, Track.to_frame,
+        )
+
+    def metrics_base(self, parsed: Stage) -> Stage:
+        """
+        Columnas por punto de `compute_metrics` que no dependen del umbral ('km', 'split';
+        `base_metrics`). Con la forma de `parse`.
+        """
+        key = stage_key(parsed.key)
+        parents = [(stage, parsed.key) for stage in ("parse", "elevation", "filter")]
+        return self.run(
+            "metrics_base", key, self._shared, "metrics_base", key,
+            lambda: base_metrics(parsed.value),
+            lambda df: self._extend_track(parents, df), Track.to_frame,
+        )
+
+    def metrics(self, parsed: Stage, moving_speed_threshold: float = 0.5) -> Stage:
+        """
+        `compute_metrics` con el umbral de movimiento: `(metrics, df_proc, splits)`. Cuelga
+        de `metrics_base`: un cambio de umbral solo recalcula 'moving', el resumen y los
+        parciales (`apply_moving_threshold`).
+        """
+        base = self.metrics_base(parsed)
+        key = stage_key(base.key, float(moving_speed_threshold))
+        return self.run(
+            "metrics", key, self._shared, "metrics", key,
+            lambda: apply_moving_threshold(base.value, moving_speed_threshold),
+            lambda r: (r[0], self._extend_track([("metrics_base", base.key)], r[1]), r[2]),
+            lambda r: (r[0], r[1].to_frame(), r[2]),
+        )
+
+    def _extend_track(self, parents, df: pd.DataFrame) -> Track:
+        """
+        `Track` de `df`, salida de una etapa que solo añade columnas a la de `parents`
+        (claves de la caché compartida, en orden de preferencia): si alguno sigue en la
+        caché, se reutilizan sus arrays y solo se guardan las columnas nuevas.
+        """
+        for full_key in parents:
+            base = self.track_cache.peek(full_key)
+            if isinstance(base, Track) and len(base) == len(df):
+                new = {c: df[c] for c in df.columns if c not in base}
+                track = base.with_columns(**new)
+                track.names = tuple(c for c in df.columns if c in track.names)   # orden de `df`
+                return track.materialize() if self.compact else track
+        return self._track(df)
+
+    def splits(self, metrics: Stage, split_km: int) -> Stage:
+        """Parciales de `split_km` km (`make_splits`)."""
+        key = stage_key(metrics.key, int(split_km))
+        return self.run("splits", key, make_splits, metrics.value[1], split_km)
+
+    def grade(self, parsed: Stage, grade_window: int) -> Stage:
+        """
+        Pendiente suavizada por punto (`compute_grade`). Solo depende de la altitud y la
+        distancia, así que cuelga del parseo: cambiar el umbral de movimiento no la invalida.
+        """
+        key = stage_key(parsed.key, int(grade_window))
+        return self.run("grade", key, compute_grade, parsed.value, grade_window)
+
+    def stops(self, metrics: Stage, min_stop_seconds: float = 60) -> Stage:
+        """Pausas ≥ `min_stop_seconds` (`detect_stops`)."""
+        key = stage_key(metrics.key, float(min_stop_seconds))
+        return self.run("stops", key, detect_stops, metrics.value[1], min_stop_seconds)
+
+    def resample(self, parsed: Stage, every_s: float | None = None, every_m: float | None = None) -> Stage:
+        """
+        Track compacto remuestreado sobre una rejilla de tiempo o de distancia (`resample`).
+        Con `track_cache`, se comparte entre sesiones como el parseo.
+        """
+        key = stage_key(parsed.key, every_s, every_m)
+        return self.run(
+            "resample", key, self._shared, "resample", key,
+            lambda: resample(parsed.value, every_s=every_s, every_m=every_m),
+            lambda track: track, lambda track: track,
+        )
+
+    def compare(self, reference: Stage, attempts: dict, every_m: float = 10.0,
+                reference_name: str = "Referencia") -> Stage:
+        """
+        Comparación de varios intentos con una referencia, alineados por distancia
+        (`compare_activities`). `attempts` es un dict nombre → etapa de parseo.
+        """
+        key = stage_key(reference.key, [(name, s.key) for name, s in attempts.items()],
+                        float(every_m), reference_name)
+        return self.run(
+            "compare", key, compare_activities, reference.value,
+            {name: s.value for name, s in attempts.items()},
+            every_m=every_m, reference_name=reference_name, label=reference_name,
+        )
@@ -0,0 +1,275 @@
+# ============================================================================================
+# PROFILING.PY
+# ============================================================================================
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import functools
+import json
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+
+# ============================================================================================
+# ESTRUCTURAS
+# ============================================================================================
+
+@dataclass(frozen=True)
+class ProfileRecord:
+    """Una llamada instrumentada: duración, nº de puntos y memoria asignada (si se mide)."""
+    name: str
+    seconds: float
+    points: int | None
+    alloc_bytes: int | None
+    depth: int
+    started_at: str
+
+class _ProfilingBlock:
+    """Usuario de `tracemalloc` de un bloque `with profiling(...)`."""
+
+# Configuración activa en el contexto actual (hilo / tarea asyncio): (sumideros, medir memoria)
+# o None si el perfilado está apagado. Al ser una ContextVar, cada sesión de Streamlit o
+# petición del servicio ve solo sus propios sumideros.
+_ACTIVE: ContextVar = ContextVar("gpxra_profiling", default=None)
+
+# Pila de llamadas en curso (por contexto), para anidar mediciones de memoria
+_STACK: ContextVar = ContextVar("gpxra_profiling_stack", default=())
+
+# `tracemalloc` es global del proceso: quién lo ha pedido (p. ej. el sumidero de cada sesión
+# de Streamlit) y si lo arrancó este módulo. Se para cuando no queda ningún usuario vivo.
+_TRACING_USERS = weakref.WeakSet()
+_TRACING_LOCK = threading.Lock()
+_STARTED_TRACING = False
+
+# Usuario por defecto de `enable(trace_memory=True)` sin `owner`
+_PROCESS_OWNER = _ProfilingBlock()
+
+# ============================================================================================
+# SUMIDEROS
+# ============================================================================================
+
+class MemorySink:
+    """
+    Guarda los últimos `maxlen` registros en memoria.
+
+    Ejemplos
+    --------
+    >>> sink = MemorySink()
+    >>> with profiling(sink):
+    ...     df = parse_gpx(f)          # doctest: +SKIP
+    >>> sink.frame()                   # doctest: +SKIP
+    """
+
+    def __init__(self, maxlen: int = 1000):
+        self.records = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def __call__(self, record: ProfileRecord) -> None:
+        with self._lock:
+            self.records.append(record)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.records.clear()
+
+    def frame(self):
+        """Registros como DataFrame (name, seconds, points, alloc_bytes, depth, started_at)."""
+        import pandas as pd
+        with self._lock:
+            rows = [asdict(r) for r in self.records]
+        return pd.DataFrame(rows, columns=list(ProfileRecord.__dataclass_fields__))
+
+    def summary(self):
+        """Agregado por función: nº de llamadas, tiempo total/medio/máximo, puntos y memoria máx."""
+        df = self.frame()
+        if df.empty:
+            return df
+        return (
+            df.groupby('name', as_index=False)
+              .agg(calls=('seconds', 'size'), total_s=('seconds', 'sum'), mean_s=('seconds', 'mean'),
+                   max_s=('seconds', 'max'), points=('points', 'max'), alloc_bytes=('alloc_bytes', 'max'))
+              .sort_values('total_s', ascending=False)
+        )
+
+class JsonLogSink:
+    """Añade cada registro como una línea JSON a `path`."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, record: ProfileRecord) -> None:
+        line = json.dumps(asdict(record), ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# ENABLE / DISABLE ===========================================================================
+
+def enable(*sinks, trace_memory: bool = False, owner=None):
+    """
+    Activa el perfilado en el contexto actual. Un sumidero es cualquier invocable que
+    reciba un `ProfileRecord` (`MemorySink`, `JsonLogSink`, una función, …).
+    Con `trace_memory=True` se arranca `tracemalloc` en nombre de `owner` (ver
+    `start_memory_tracing`) y se registra el pico de memoria asignada durante cada llamada
+    (más lento, y para todo el proceso: solo para depurar).
+    Devuelve un token para `disable(token)`.
+    """
+    if trace_memory:
+        start_memory_tracing(_PROCESS_OWNER if owner is None else owner)
+    return _ACTIVE.set((tuple(sinks), bool(trace_memory)))
+
+def disable(token=None) -> None:
+    """Desactiva el perfilado (o restaura el estado previo a `enable` si se pasa su token)."""
+    if token is not None:
+        _ACTIVE.reset(token)
+    else:
+        _ACTIVE.set(None)
+
+def is_enabled() -> bool:
+    return _ACTIVE.get() is not None
+
+def start_memory_tracing(owner) -> None:
+    """
+    Registra a `owner` (cualquier objeto con referencias débiles, p. ej. el sumidero de una
+    sesión) como usuario de `tracemalloc` y lo arranca si no estaba activo.
+    """
+    global _STARTED_TRACING
+    with _TRACING_LOCK:
+        _TRACING_USERS.add(owner)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _STARTED_TRACING = True
+
+def stop_memory_tracing(owner=None) -> None:
+    """
+    Retira a `owner` (a todos, sin argumento) de los usuarios de `tracemalloc` y lo detiene
+    cuando no queda ninguno, solo si lo arrancó este módulo (no si lo usa otro). Los
+    usuarios que ya no existen (sesiones cerradas) no cuentan.
+    """
+    global _STARTED_TRACING
+    with _TRACING_LOCK:
+        if owner is None:
+            _TRACING_USERS.clear()
+        else:
+            _TRACING_USERS.discard(owner)
+        if len(_TRACING_USERS) == 0:
+            if _STARTED_TRACING and tracemalloc.is_tracing():
+                tracemalloc.stop()
+            _STARTED_TRACING = False
+
+@contextmanager
+def profiling(*sinks, trace_memory: bool = False):
+    """Perfilado activo solo dentro del bloque `with`."""
+    owner = _ProfilingBlock()
+    token = enable(*sinks, trace_memory=trace_memory, owner=owner)
+    try:
+        yield
+    finally:
+        disable(token)
+        if trace_memory:
+            stop_memory_tracing(owner)
+
+# _COUNT_POINTS ==============================================================================
+
+def _count_points(args, result) -> int | None:
+    """Nº de puntos: longitud del DataFrame devuelto o, si no hay, del primero recibido."""
+    import pandas as pd
+    candidates = result if isinstance(result, tuple) else (result,)
+    for value in (*candidates, *args):
+        if isinstance(value, pd.DataFrame):
+            return len(value)
+    return None
+
+# PROFILE ====================================================================================
+
+@contextmanager
+def profile(name: str, points: int | None = None):
+    """
+    Mide el bloque `with` como una etapa `name`. Si el perfilado está apagado no hace nada.
+
+    Ejemplos
+    --------
+    >>> with profile("render_map", points=len(coords)):   # doctest: +SKIP
+    ...     html = m.get_root().render()
+    """
+    active = _ACTIVE.get()
+    if active is None:
+        yield
+        return
+    frame = _start()
+    try:
+        yield
+    finally:
+        _finish(active, name, frame, points)
+
+def _start() -> dict:
+    frame = {'t0': time.perf_counter(), 'started_at': datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+             'mem0': None, 'child_peak': 0}
+    stack = _STACK.get()
+    if tracemalloc.is_tracing():
+        frame['mem0'] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    frame['token'] = _STACK.set(stack + (frame,))
+    return frame
+
+def _finish(active, name: str, frame: dict, points) -> None:
+    seconds = time.perf_counter() - frame['t0']
+    _STACK.reset(frame['token'])
+    sinks, trace_memory = active
+    alloc = None
+    if frame['mem0'] is not None and tracemalloc.is_tracing():
+        peak = max(tracemalloc.get_traced_memory()[1], frame['child_peak'])
+        alloc = max(0, peak - frame['mem0'])
+        # el pico de esta llamada también cuenta para la que la contiene (reset_peak lo borra)
+        parent = _STACK.get()
+        if parent:
+            parent[-1]['child_peak'] = max(parent[-1]['child_peak'], peak)
+    record = ProfileRecord(name, seconds, points, alloc if trace_memory else None,
+                           len(_STACK.get()), frame['started_at'])
+    for sink in sinks:
+        sink(record)
+
+# PROFILED ===================================================================================
+
+def profiled(name: str | None = None):
+    """
+    Decorador: registra cada llamada a la función como una etapa (por defecto, con su
+    nombre). El nº de puntos se toma del DataFrame devuelto o del primero recibido.
+    Con el perfilado apagado, el coste es una consulta a una `ContextVar`.
+
+    Ejemplos
+    --------
+    >>> @profiled()
+    ... def compute_metrics(df, moving_speed_threshold=0.5):
+    ...     ...
+    """
+    def decorator(fn):
+        stage = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            active = _ACTIVE.get()
+            if active is None:
+                return fn(*args, **kwargs)
+            frame = _start()
+            result = None
+            try:
+                result = fn(*args, **kwargs)
+                return result
+            finally:
+                _finish(active, stage, frame, _count_points(args, result))
+        return wrapper
+    return decorator
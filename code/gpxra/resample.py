@@ -0,0 +1,177 @@
+# ============================================================================================
+# RESAMPLE.PY
+# ============================================================================================
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import numpy as npy
+import pandas as pd
+from .io import segment_offsets
+from .track import Track
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+# Columnas que se interpolan (las que existan); 'hr' y 'cad' se redondean a enteros
+_INTERP_COLUMNS = ('lat', 'lon', 'ele', 'hr', 'cad')
+
+# Columnas de entrada necesarias (además de las anteriores)
+_INPUT_COLUMNS = ('time', 'lat', 'lon', 'ele', 'hr', 'cad', 'dist')
+
+# Por defecto, un hueco de más de 60 s sin puntos (auto-pausa, grabación inteligente…)
+# no se rellena al remuestrear por tiempo
+DEFAULT_MAX_GAP_S = 60.0
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# _SECONDS ===================================================================================
+
+def _seconds(time: pd.Series) -> npy.ndarray:
+    """Segundos desde 1970 (float64), NaN donde no hay hora."""
+    values = time.to_numpy(dtype='datetime64[ns]') if len(time) else npy.array([], dtype='datetime64[ns]')
+    secs = values.view('int64') / 1e9
+    secs[npy.isnat(values)] = npy.nan
+    return secs
+
+# _RUNS ======================================================================================
+
+def _runs(offsets: npy.ndarray, t: npy.ndarray, max_gap_s: float | None) -> list[tuple[int, int]]:
+    """Tramos `(a, b)` que se remuestrean por separado: segmentos y, si se indica, huecos de tiempo."""
+    bounds = set(offsets.tolist())
+    if max_gap_s is not None and len(t) > 1:
+        bounds.update((npy.flatnonzero(npy.diff(t) > max_gap_s) + 1).tolist())
+    bounds = sorted(bounds)
+    return [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+# _BY_TIME ===================================================================================
+
+def _by_time(t: npy.ndarray, dist: npy.ndarray, cols: dict, step: float) -> dict:
+    """Un tramo sobre la rejilla `t0, t0 + step, …` (hasta el último punto)."""
+    keep = npy.concatenate([[True], npy.diff(t) > 0])       # xp estrictamente creciente
+    x = t[keep]
+    grid = x[0] + npy.arange(int(npy.floor((x[-1] - x[0]) / step)) + 1) * step
+    out = {name: npy.interp(grid, x, values[keep]) for name, values in cols.items()}
+    out['time'] = grid
+    out['dist'] = npy.interp(grid, x, dist[keep])
+    return out
+
+# _BY_DISTANCE ===============================================================================
+
+def _by_distance(t: npy.ndarray, dist: npy.ndarray, cols: dict, step: float) -> dict:
+    """
+    Un tramo sobre la rejilla de múltiplos de `step` metros. Las pausas (puntos sin avance)
+    se colapsan: posición y sensores se toman del punto de llegada y el tiempo se interpola
+    entre la salida de un punto y la llegada al siguiente, de modo que la duración de la
+    pausa cae en el instante en que se para, no repartida por los metros siguientes.
+    """
+    advance = npy.diff(dist) > 0
+    arrive = npy.concatenate([[True], advance])    # primer punto de cada racha sin avance
+    depart = npy.concatenate([advance, [True]])    # último punto de cada racha
+    x = dist[arrive]
+    grid = npy.arange(npy.ceil(x[0] / step) * step, x[-1] + 1e-9, step)
+    out = {name: npy.interp(grid, x, values[arrive]) for name, values in cols.items()}
+    out['dist'] = grid
+    t_arrive, t_depart = t[arrive], t[depart]
+    if len(x) == 1:
+        out['time'] = npy.full(len(grid), t_depart[0])
+    else:
+        j = npy.clip(npy.searchsorted(x, grid, side='right') - 1, 0, len(x) - 2)
+        w = (grid - x[j]) / (x[j + 1] - x[j])
+        out['time'] = t_depart[j] + w * (t_arrive[j + 1] - t_depart[j])
+    return out
+
+# RESAMPLE ===================================================================================
+
+def resample(track, every_s: float | None = None, every_m: float | None = None,
+             max_gap_s: float | None = DEFAULT_MAX_GAP_S) -> Track:
+    """
+    Remuestrea un track sobre una rejilla uniforme de tiempo (`every_s`) o de distancia
+    (`every_m`), interpolando linealmente (`numpy.interp`) sobre 'time' / 'dist'.
+
+    Parámetros
+    ----------
+    track : Track | pandas.DataFrame
+        Puntos de `parse_gpx` o `compute_metrics` (necesita 'time', 'lat', 'lon', 'dist';
+        'ele', 'hr' y 'cad' si existen).
+    every_s : float, opcional
+        Paso de la rejilla en segundos (desde el inicio de cada tramo).
+    every_m : float, opcional
+        Paso de la rejilla en metros (múltiplos de `every_m` de la distancia acumulada).
+    max_gap_s : float | None, opcional
+        Solo por tiempo: los huecos entre puntos mayores que este valor no se rellenan
+        (el track se parte en dos tramos). None para interpolar siempre. Por defecto 60.
+
+    Devuelve
+    --------
+    Track
+        Track compacto con 'time', 'lat', 'lon', 'ele', 'hr', 'cad' (si hay datos),
+        'dist' y, derivadas, 'd_dist', 'dt' y 'speed'. Sus segmentos (`segment_offsets`)
+        son los tramos remuestreados.
+
+    Notas
+    -----
+    - Hay que indicar exactamente uno de `every_s` y `every_m`.
+    - Los segmentos (`<trkseg>`) se remuestrean por separado: no se inventan puntos
+    entre el final de uno y el inicio del siguiente, ni se suma distancia entre ellos.
+    - Por tiempo, las pausas con el dispositivo grabando dan puntos parados (misma
+    posición); por distancia se colapsan en un salto de tiempo (ver `_by_distance`).
+    - Coste lineal en el nº de puntos de entrada y salida; no usa `DataFrame.resample`.
+
+    Ejemplos
+    --------
+    >>> grid = resample(df_proc, every_s=1)                    # doctest: +SKIP
+    >>> metrics, df_grid, splits = compute_metrics(resample(df, every_m=10).to_frame())  # doctest: +SKIP
+    """
+    if (every_s is None) == (every_m is None):
+        raise ValueError("Indica every_s o every_m (uno de los dos)")
+    step = float(every_s if every_s is not None else every_m)
+    if not step > 0:
+        raise ValueError(f"El paso de remuestreo debe ser positivo: {step}")
+
+    df = track.to_frame(list(_INPUT_COLUMNS)) if isinstance(track, Track) else track
+    if df.empty:
+        return Track.from_frame(pd.DataFrame(), compact=True)
+    t = _seconds(df['time'])
+    dist = df['dist'].to_numpy(dtype=float)
+    cols = {name: df[name].to_numpy(dtype=float, na_value=npy.nan) for name in _INTERP_COLUMNS if name in df}
+    if every_s is not None and npy.isnan(t).any():
+        raise ValueError("El remuestreo por tiempo necesita la hora de todos los puntos")
+
+    by_time = every_s is not None
+    pieces = []
+    for a, b in _runs(segment_offsets(df), t, max_gap_s if by_time else None):
+        fn = _by_time if by_time else _by_distance
+        piece = fn(t[a:b], dist[a:b], {name: v[a:b] for name, v in cols.items()}, step)
+        if len(piece['dist']):
+            pieces.append(piece)
+    if not pieces:
+        return Track.from_frame(pd.DataFrame(), compact=True)
+
+    out = {name: npy.concatenate([p[name] for p in pieces]) for name in pieces[0]}
+    offsets = npy.concatenate([[0], npy.cumsum([len(p['dist']) for p in pieces])])
+    for name in ('hr', 'cad'):
+        if name in out:
+            out[name] = npy.round(out[name])
+
+    # 'dist' ya no incluye saltos entre segmentos: entre tramos solo queda lo recorrido
+    # dentro del segmento (o durante el hueco) que no cae en la rejilla
+    d_dist = npy.diff(out['dist'], prepend=out['dist'][:1])
+    dt = npy.nan_to_num(npy.diff(out['time'], prepend=npy.nan), nan=0.0)
+    speed = npy.divide(d_dist, dt, out=npy.zeros_like(d_dist), where=dt > 0)
+
+    frame = pd.DataFrame({
+        'time': pd.to_datetime(out['time'], unit='s', utc=True),
+        **{name: out[name] for name in _INTERP_COLUMNS if name in out},
+        'dist': out['dist'],
+        'd_dist': d_dist,
+        'dt': dt,
+        'speed': speed,
+    })
+    frame.attrs['segment_offsets'] = tuple(offsets.tolist())
+    return Track.from_frame(frame, compact=True)
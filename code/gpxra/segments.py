@@ -0,0 +1,230 @@
+# ============================================================================================
+# SEGMENTS.PY
+# ============================================================================================
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import numpy as npy
+import pandas as pd
+from .geo import haversine
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+# Columnas del resultado de `match_segment`
+EFFORT_COLUMNS = ['rank', 'track', 'start_idx', 'end_idx', 'start_time', 'elapsed_s', 'distance_m', 'avg_speed_kmh']
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# TRACK_BBOXES ===============================================================================
+
+def track_bboxes(tracks) -> dict:
+    """
+    Bbox `(lat_min, lon_min, lat_max, lon_max)` de cada actividad de `tracks` (dict nombre →
+    puntos con 'lat' y 'lon'); las que no tienen posiciones no aparecen. Se calcula una vez
+    por conjunto de actividades y sirve de prefiltro a `match_segment(..., bboxes=...)`.
+    """
+    out = {}
+    for name, df in tracks.items():
+        lat = npy.asarray(df['lat'], dtype=float)
+        lon = npy.asarray(df['lon'], dtype=float)
+        valid = ~(npy.isnan(lat) | npy.isnan(lon))
+        if valid.any():
+            lat, lon = lat[valid], lon[valid]
+            out[name] = (float(lat.min()), float(lon.min()), float(lat.max()), float(lon.max()))
+    return out
+
+# SEGMENT_FROM_GEOJSON =======================================================================
+
+def segment_from_geojson(feature: dict) -> npy.ndarray | None:
+    """
+    Extrae el segmento `(lat, lon)` de una feature GeoJSON `LineString` (p. ej. la que
+    devuelve `st_folium` para el dibujo activo del plugin `Draw`).
+
+    Devuelve un array `(n, 2)` con columnas lat/lon, o None si la feature no es una línea
+    de al menos dos vértices.
+    """
+    geometry = (feature or {}).get("geometry") or {}
+    if geometry.get("type") != "LineString":
+        return None
+    coords = npy.asarray(geometry.get("coordinates") or [], dtype=float)
+    if coords.ndim != 2 or len(coords) < 2:
+        return None
+    return coords[:, [1, 0]]  # GeoJSON guarda [lon, lat]
+
+# _ENTRY_POINTS ==============================================================================
+
+def _entry_points(d: npy.ndarray, radius_m: float) -> npy.ndarray:
+    """
+    Índices de "paso" por un punto: para cada racha consecutiva de puntos a menos de
+    `radius_m`, el punto de la racha más cercano.
+    """
+    near = d <= radius_m
+    if not near.any():
+        return npy.zeros(0, dtype=npy.int64)
+    idx = npy.flatnonzero(near)
+    run = npy.concatenate([[0], npy.cumsum(npy.diff(idx) > 1)])
+    # argmin por racha: ordenar por (racha, distancia) y quedarse con el primero de cada una
+    order = npy.lexsort((d[idx], run))
+    first = npy.concatenate([[True], run[order][1:] != run[order][:-1]])
+    return npy.sort(idx[order][first])
+
+# _PASSES_THROUGH ============================================================================
+
+def _passes_through(lat, lon, checkpoints: npy.ndarray, radius_m: float) -> bool:
+    """Comprueba que el tramo pasa, en orden, cerca de todos los puntos de control."""
+    pos = 0
+    for c_lat, c_lon in checkpoints:
+        d = haversine(c_lat, c_lon, lat[pos:], lon[pos:])
+        hits = npy.flatnonzero(d <= radius_m)
+        if len(hits) == 0:
+            return False
+        pos += int(hits[0])
+    return True
+
+# MATCH_TRACK ================================================================================
+
+def match_track(df: pd.DataFrame, segment, radius_m: float = 30.0, length_tolerance: float = 0.25,
+                n_checkpoints: int = 3) -> list[dict]:
+    """
+    Busca todas las pasadas de una actividad por el segmento.
+
+    Una pasada es un punto cercano al inicio del segmento seguido de un punto cercano al
+    final, tal que la distancia recorrida entre ambos es la del segmento (± `length_tolerance`)
+    y el tramo pasa en orden por `n_checkpoints` puntos intermedios del segmento (control
+    de sentido: recorrerlo al revés no cuenta).
+
+    Devuelve una lista de dicts con `start_idx`, `end_idx`, `start_time`, `elapsed_s`,
+    `distance_m` y `avg_speed_kmh`.
+    """
+
+    segment = npy.asarray(segment, dtype=float)
+    lat = df['lat'].to_numpy(dtype=float)
+    lon = df['lon'].to_numpy(dtype=float)
+    dist = df['dist'].to_numpy(dtype=float)
+
+    seg_len = float(haversine(segment[:-1, 0], segment[:-1, 1], segment[1:, 0], segment[1:, 1]).sum())
+    starts = _entry_points(haversine(segment[0, 0], segment[0, 1], lat, lon), radius_m)
+    if len(starts) == 0:
+        return []
+    ends = _entry_points(haversine(segment[-1, 0], segment[-1, 1], lat, lon), radius_m)
+    if len(ends) == 0:
+        return []
+
+    # Puntos de control interiores, equiespaciados a lo largo del segmento
+    cum = npy.concatenate([[0.0], npy.cumsum(haversine(segment[:-1, 0], segment[:-1, 1], segment[1:, 0], segment[1:, 1]))])
+    at = npy.linspace(0, seg_len, n_checkpoints + 2)[1:-1]
+    checkpoints = npy.column_stack([npy.interp(at, cum, segment[:, 0]), npy.interp(at, cum, segment[:, 1])])
+
+    # Para cada inicio, el primer final posterior (vectorizado con searchsorted)
+    pair = npy.searchsorted(ends, starts, side="right")
+    valid = pair < len(ends)
+    starts, pair_ends = starts[valid], ends[pair[valid]]
+    traversed = dist[pair_ends] - dist[starts]
+    ok = npy.abs(traversed - seg_len) <= length_tolerance * max(seg_len, radius_m)
+    starts, pair_ends, traversed = starts[ok], pair_ends[ok], traversed[ok]
+
+    time = df['time']
+    efforts = []
+    last_end = -1
+    for s, e, d_m in zip(starts, pair_ends, traversed):
+        if s < last_end:
+            continue  # inicio dentro de una pasada ya contada
+        if not _passes_through(lat[s:e + 1], lon[s:e + 1], checkpoints, 2 * radius_m):
+            continue
+        elapsed = (time.iloc[e] - time.iloc[s]).total_seconds()
+        efforts.append({
+            'start_idx': int(s),
+            'end_idx': int(e),
+            'start_time': time.iloc[s],
+            'elapsed_s': elapsed,
+            'distance_m': float(d_m),
+            'avg_speed_kmh': 3.6 * d_m / elapsed if elapsed > 0 else npy.nan,
+        })
+        last_end = e
+    return efforts
+
+# MATCH_SEGMENT ==============================================================================
+
+def match_segment(segment, tracks, radius_m: float = 30.0, length_tolerance: float = 0.25,
+                  index=None, bboxes: dict | None = None) -> pd.DataFrame:
+    """
+    Encuentra todas las pasadas por un segmento en un conjunto de actividades (estilo
+    segmentos de Strava) y las ordena por tiempo.
+
+    Parámetros
+    ----------
+    segment : array-like (n, 2)
+        Vértices `(lat, lon)` del segmento, en el sentido de marcha. Ver
+        `segment_from_geojson` para convertir un dibujo del plugin `Draw`.
+    tracks : dict[str, pandas.DataFrame]
+        Actividades por nombre, con columnas 'time', 'lat', 'lon' y 'dist'.
+    radius_m : float, opcional
+        Tolerancia (m) para considerar que se pasa por el inicio/fin. Por defecto 30 m.
+    length_tolerance : float, opcional
+        Diferencia relativa admitida entre la distancia recorrida y la longitud del
+        segmento. Por defecto 0.25 (±25 %).
+    index : gpxra.spatial.GridIndex, opcional
+        Índice espacial construido sobre `tracks`. Si se pasa, el prefiltro usa las
+        rutas con puntos cerca del inicio Y del final; si no, se compara el bbox de cada
+        ruta con el del segmento.
+    bboxes : dict, opcional
+        Bbox de cada ruta ya calculados (`track_bboxes(tracks)`), para no recorrer sus
+        coordenadas en cada llamada. Sin `index` ni `bboxes`, se calculan aquí.
+
+    Devuelve
+    --------
+    pandas.DataFrame
+        Una fila por pasada (columnas `EFFORT_COLUMNS`), ordenadas por `elapsed_s`;
+        `rank` empieza en 1.
+
+    Notas
+    -----
+    - El prefiltro grueso descarta casi todas las actividades sin calcular distancias; las
+    candidatas se procesan con búsquedas vectorizadas de proximidad al inicio y al final.
+
+    Ejemplos
+    --------
+    >>> efforts = match_segment([(43.26, -2.93), (43.27, -2.95)], sessions)  # doctest: +SKIP
+    >>> efforts[['rank', 'track', 'elapsed_s']].head()                     # doctest: +SKIP
+    """
+
+    segment = npy.asarray(segment, dtype=float)
+    if segment.ndim != 2 or len(segment) < 2:
+        raise ValueError("El segmento necesita al menos dos vértices (lat, lon).")
+
+    # Margen del bbox en grados (radio convertido a grados a la latitud del segmento)
+    pad_lat = radius_m / 111_320.0
+    pad_lon = radius_m / (111_320.0 * max(npy.cos(npy.radians(segment[:, 0].mean())), 0.01))
+
+    if index is not None:
+        def near(p):
+            return set(index.tracks_in_bbox(p[0] - pad_lat, p[1] - pad_lon, p[0] + pad_lat, p[1] + pad_lon))
+        names = near(segment[0]) & near(segment[-1])
+        candidates = [name for name in tracks if str(name) in names]
+    else:
+        lat_min, lon_min = segment.min(axis=0) - (pad_lat, pad_lon)
+        lat_max, lon_max = segment.max(axis=0) + (pad_lat, pad_lon)
+        if bboxes is None:
+            bboxes = track_bboxes(tracks)
+        candidates = [
+            name for name in tracks if name in bboxes
+            and bboxes[name][2] >= lat_min and bboxes[name][0] <= lat_max
+            and bboxes[name][3] >= lon_min and bboxes[name][1] <= lon_max
+        ]
+
+    rows = []
+    for name in candidates:
+        for effort in match_track(tracks[name], segment, radius_m=radius_m, length_tolerance=length_tolerance):
+            rows.append({'track': name, **effort})
+
+    efforts = pd.DataFrame(rows, columns=[c for c in EFFORT_COLUMNS if c != 'rank'])
+    efforts = efforts.sort_values('elapsed_s', kind="stable").reset_index(drop=True)
+    efforts.insert(0, 'rank', npy.arange(1, len(efforts) + 1))
+    return efforts
@@ -0,0 +1,404 @@
+# ============================================================================================
+# SERVER.PY
+# ============================================================================================
+#
+# Servicio HTTP de análisis (asyncio, solo biblioteca estándar):
+#
+#   python -m gpxra.server --port 8080 --workers 4 --queue 32
+#   curl --data-binary @ruta.gpx "http://localhost:8080/analyze?threshold=0.5&split_km=5"
+#   curl http://localhost:8080/metrics
+#
+# Endpoints:
+#   POST /analyze   cuerpo = bytes del GPX → resumen, parciales, pausas y ruta simplificada (JSON)
+#   GET  /metrics   contadores: peticiones, latencia, profundidad de cola, caché
+#   GET  /health    {"status": "ok"}
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+from .cache import TrackCache, shared_track_cache
+from .hashing import content_hash
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+# Límites superiores (s) del histograma de latencias de /analyze
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+# Parámetros de /analyze: nombre en la query → (conversión, valor por defecto)
+ANALYZE_PARAMS = {
+    'threshold': (float, 0.5),
+    'split_km': (int, 5),
+    'min_stop_seconds': (float, 60.0),
+    'simplify_m': (float, 10.0),
+}
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# _WORKER_ANALYZE ============================================================================
+
+_WORKER_PIPE = None
+
+def _worker_analyze(data: bytes, label: str, threshold: float, split_km: int,
+                    min_stop_seconds: float, simplify_m: float) -> tuple[bool, bytes]:
+    """
+    Análisis en un proceso del pool. Cada proceso mantiene su pipeline con la caché de
+    tracks del proceso, así que un GPX repetido con otros parámetros no se vuelve a parsear.
+    Devuelve `(ok, respuesta)`, con la respuesta ya codificada en JSON (se serializa en el
+    proceso hijo).
+    """
+    global _WORKER_PIPE
+    from .cli import analyze_bytes
+    from .pipeline import AnalysisPipeline
+
+    if _WORKER_PIPE is None:
+        _WORKER_PIPE = AnalysisPipeline(track_cache=shared_track_cache())
+    row = analyze_bytes(data, label, threshold, split_km, min_stop_seconds,
+                        pipe=_WORKER_PIPE, simplify_m=simplify_m)
+    return row['error'] is None, json.dumps(row, ensure_ascii=False).encode("utf-8")
+
+# ============================================================================================
+# ANALYSISSERVICE
+# ============================================================================================
+
+class Overloaded(Exception):
+    """Ya hay `workers + queue_size` trabajos admitidos (se responde 503)."""
+
+class AnalysisService:
+    """
+    Servicio de análisis con un pool de procesos acotado y contrapresión.
+
+    Las peticiones a `/analyze` entran en una cola; `workers` tareas la consumen y delegan
+    `parse_gpx`/`compute_metrics` en un `ProcessPoolExecutor`. Se admiten a la vez hasta
+    `workers` trabajos en curso más `queue_size` en espera; por encima se responde 503
+    (`Retry-After`) en lugar de acumular trabajo y memoria.
+
+    Parámetros
+    ----------
+    workers : int, opcional
+        Procesos de análisis. Por defecto, `os.cpu_count()`.
+    queue_size : int, opcional
+        Trabajos en espera (además de los `workers` en curso) admitidos antes de rechazar;
+        al menos 1. Por defecto 32.
+    track_cache : TrackCache, opcional
+        Caché para las respuestas (clave: hash del GPX + parámetros). Por defecto, la
+        caché compartida del proceso (`shared_track_cache()`).
+    max_body_bytes : int, opcional
+        Tamaño máximo del GPX aceptado. Por defecto 50 MB.
+
+    Notas
+    -----
+    - Dos peticiones idénticas simultáneas comparten el mismo cálculo.
+    - `handle()` es la lógica HTTP sin sockets; `InProcessClient` la usa para probar el
+    servicio sin abrir puertos, y `serve()` la expone por TCP.
+
+    Ejemplos
+    --------
+    >>> async def demo(gpx_bytes):
+    ...     async with AnalysisService(workers=2) as service:
+    ...         client = InProcessClient(service)
+    ...         status, body = await client.post("/analyze?split_km=1", gpx_bytes)
+    ...         return status, body['distance_km']
+    >>> asyncio.run(demo(open("ruta.gpx", "rb").read()))  # doctest: +SKIP
+    (200, 42.18)
+    """
+
+    def __init__(self, workers: int | None = None, queue_size: int = 32, track_cache: TrackCache | None = None,
+                 max_body_bytes: int = 50 * 1024 ** 2):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.queue_size = int(queue_size)
+        if self.queue_size < 1:
+            raise ValueError(f"queue_size debe ser al menos 1 (recibido {queue_size})")
+        self.track_cache = shared_track_cache() if track_cache is None else track_cache
+        self.max_body_bytes = int(max_body_bytes)
+        self._pool = None
+        self._queue = None
+        self._consumers = []
+        self._pending = {}          # clave → Future de un análisis en curso
+        self._admitted = 0          # trabajos admitidos (en cola o en curso)
+        # contadores
+        self.requests = Counter()   # (método, ruta) → nº
+        self.responses = Counter()  # código → nº
+        self.rejected = 0
+        self.cache_hits = 0
+        self.in_flight = 0
+        self.max_queue_depth = 0
+        self.latency_count = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self._recent = deque(maxlen=1024)
+
+    # CICLO DE VIDA ==========================================================================
+
+    async def start(self) -> "AnalysisService":
+        """Arranca el pool de procesos y las tareas que consumen la cola."""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            self._queue = asyncio.Queue(maxsize=self.workers + self.queue_size)
+            self._consumers = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+        return self
+
+    async def close(self) -> None:
+        """Detiene las tareas y el pool (los trabajos en cola se cancelan)."""
+        for task in self._consumers:
+            task.cancel()
+        await asyncio.gather(*self._consumers, return_exceptions=True)
+        self._consumers = []
+        if self._queue is not None:
+            while not self._queue.empty():
+                _, future = self._queue.get_nowait()
+                future.cancel()
+        self._admitted = 0
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _consume(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job, future = await self._queue.get()
+            try:
+                if not future.cancelled():
+                    self.in_flight += 1
+                    try:
+                        result = await loop.run_in_executor(self._pool, _worker_analyze, *job)
+                    except Exception as e:
+                        if not future.cancelled():
+                            future.set_exception(e)
+                    else:
+                        if not future.cancelled():
+                            future.set_result(result)
+                    finally:
+                        self.in_flight -= 1
+            finally:
+                self._admitted -= 1
+                self._queue.task_done()
+
+    # ANÁLISIS ===============================================================================
+
+    async def analyze(self, data: bytes, label: str = "", **params) -> tuple[bool, bytes]:
+        """
+        Analiza un GPX y devuelve `(ok, respuesta JSON en bytes)`; solo se cachean los
+        análisis correctos. Lanza `Overloaded` si ya hay `workers + queue_size` trabajos
+        admitidos.
+        """
+        if self._pool is None:
+            await self.start()
+        args = [conv(params.get(name, default)) for name, (conv, default) in ANALYZE_PARAMS.items()]
+        key = ("analyze", content_hash(data), label, *args)
+
+        cached = self.track_cache.get(key)
+        if cached is not None:
+            self.cache_hits += 1
+            return True, cached
+        if key in self._pending:
+            return await asyncio.shield(self._pending[key])
+
+        # la capacidad cuenta los trabajos admitidos, no los que siguen en la cola: una
+        # ráfaga en el mismo ciclo del bucle llega antes de que los consumidores saquen nada
+        if self._admitted >= self.workers + self.queue_size:
+            self.rejected += 1
+            raise Overloaded(f"servicio lleno ({self.workers} trabajos en curso y {self.queue_size} en espera)")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(((data, label, *args), future))
+        self._admitted += 1
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        self._pending[key] = future
+        try:
+            ok, body = await asyncio.shield(future)
+        finally:
+            self._pending.pop(key, None)
+        if ok:
+            self.track_cache.put(key, body)
+        return ok, body
+
+    # HTTP ===================================================================================
+
+    async def handle(self, method: str, target: str, body: bytes = b"") -> tuple[int, dict, bytes]:
+        """
+        Atiende una petición ya leída. Devuelve `(código, cabeceras, cuerpo)`.
+        """
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self.requests[(method, url.path)] += 1
+        t0 = time.perf_counter()
+        headers = {'Content-Type': 'application/json'}
+
+        if url.path == "/analyze" and method == "POST":
+            if len(body) > self.max_body_bytes:
+                status, payload = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': "GPX demasiado grande"}
+            elif not body:
+                status, payload = HTTPStatus.BAD_REQUEST, {'error': "Cuerpo vacío: envía el GPX"}
+            else:
+                try:
+                    params = {k: ANALYZE_PARAMS[k][0](v) for k, v in query.items() if k in ANALYZE_PARAMS}
+                    ok, payload = await self.analyze(body, query.get('name', ""), **params)
+                    status = HTTPStatus.OK if ok else HTTPStatus.UNPROCESSABLE_ENTITY
+                except ValueError as e:
+                    status, payload = HTTPStatus.BAD_REQUEST, {'error': f"Parámetro no válido: {e}"}
+                except Overloaded as e:
+                    status, payload = HTTPStatus.SERVICE_UNAVAILABLE, {'error': str(e)}
+                    headers['Retry-After'] = "1"
+                except Exception as e:
+                    # p. ej. BrokenProcessPool: el cliente recibe un 500, no una conexión cortada
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': f"Error interno: {type(e).__name__}: {e}"}
+            self._observe(time.perf_counter() - t0)
+        elif url.path == "/metrics" and method == "GET":
+            status, payload = HTTPStatus.OK, self.metrics()
+        elif url.path == "/health" and method == "GET":
+            status, payload = HTTPStatus.OK, {'status': "ok"}
+        elif url.path in ("/analyze", "/metrics", "/health"):
+            status, payload = HTTPStatus.METHOD_NOT_ALLOWED, {'error': f"Método no permitido: {method}"}
+        else:
+            status, payload = HTTPStatus.NOT_FOUND, {'error': f"Ruta desconocida: {url.path}"}
+
+        self.responses[int(status)] += 1
+        if not isinstance(payload, bytes):
+            payload = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        return int(status), headers, payload
+
+    def _observe(self, seconds: float) -> None:
+        self.latency_count += 1
+        self.latency_sum += seconds
+        self.latency_max = max(self.latency_max, seconds)
+        self._recent.append(seconds)
+        for i, upper in enumerate(LATENCY_BUCKETS):
+            if seconds <= upper:
+                self.latency_buckets[i] += 1
+                break
+
+    def metrics(self) -> dict:
+        """Contadores del servicio (lo que devuelve `GET /metrics`)."""
+        recent = sorted(self._recent)
+        pct = lambda q: recent[min(len(recent) - 1, int(q * len(recent)))] if recent else None
+        return {
+            'requests': {f"{m} {p}": n for (m, p), n in self.requests.items()},
+            'responses': {str(code): n for code, n in sorted(self.responses.items())},
+            'rejected': self.rejected,
+            'cache_hits': self.cache_hits,
+            'queue': {
+                'depth': self._queue.qsize() if self._queue is not None else 0,
+                'max_depth': self.max_queue_depth,
+                'capacity': self.queue_size,
+                'in_flight': self.in_flight,
+                'admitted': self._admitted,
+                'workers': self.workers,
+            },
+            'latency_s': {
+                'count': self.latency_count,
+                'sum': self.latency_sum,
+                'max': self.latency_max,
+                'p50': pct(0.50),
+                'p95': pct(0.95),
+                'buckets': {("+Inf" if b == float("inf") else str(b)): n
+                            for b, n in zip(LATENCY_BUCKETS, self.latency_buckets)},
+            },
+            'track_cache': self.track_cache.stats(),
+        }
+
+    async def _on_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Una petición HTTP/1.1 por conexión (`Connection: close`)."""
+        try:
+            request_line = (await reader.readline()).decode("latin-1").strip()
+            if not request_line:
+                return
+            method, target, _ = request_line.split(" ", 2)
+            length = 0
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value.strip())
+            if length > self.max_body_bytes:
+                status, headers, payload = 413, {'Content-Type': 'application/json'}, b'{"error": "GPX demasiado grande"}'
+            else:
+                body = await reader.readexactly(length) if length else b""
+                status, headers, payload = await self.handle(method.upper(), target, body)
+            head = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+            head += [f"{k}: {v}" for k, v in headers.items()]
+            head += [f"Content-Length: {len(payload)}", "Connection: close", "", ""]
+            writer.write("\r\n".join(head).encode("latin-1") + payload)
+            await writer.drain()
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8080) -> asyncio.AbstractServer:
+        """Arranca el servicio y lo expone por TCP en `host:port`."""
+        await self.start()
+        return await asyncio.start_server(self._on_connection, host, port)
+
+# ============================================================================================
+# INPROCESSCLIENT
+# ============================================================================================
+
+class InProcessClient:
+    """
+    Cliente para probar `AnalysisService` en el mismo proceso, sin sockets: llama a
+    `service.handle()` y decodifica el JSON de la respuesta.
+    """
+
+    def __init__(self, service: AnalysisService):
+        self.service = service
+
+    async def request(self, method: str, target: str, body: bytes = b"") -> tuple[int, dict]:
+        status, _, payload = await self.service.handle(method, target, body)
+        return status, json.loads(payload)
+
+    async def get(self, target: str) -> tuple[int, dict]:
+        return await self.request("GET", target)
+
+    async def post(self, target: str, body: bytes) -> tuple[int, dict]:
+        return await self.request("POST", target, body)
+
+# ============================================================================================
+# MAIN
+# ============================================================================================
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m gpxra.server", description="Servicio HTTP de análisis GPX.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=None, help="Procesos de análisis (por defecto, nº de CPUs).")
+    parser.add_argument("--queue", type=int, default=32,
+                        help="Trabajos en espera (además de los que están en curso) antes de responder 503.")
+    args = parser.parse_args(argv)
+
+    async def run():
+        async with AnalysisService(workers=args.workers, queue_size=args.queue) as service:
+            server = await service.serve(args.host, args.port)
+            print(f"Escuchando en http://{args.host}:{args.port} ({service.workers} procesos, cola {args.queue})")
+            async with server:
+                await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
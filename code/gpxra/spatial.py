@@ -0,0 +1,244 @@
+# ============================================================================================
+# SPATIAL.PY
+# ============================================================================================
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import numpy as npy
+from .geo import haversine
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+# Lado aproximado de cada celda de la rejilla (m)
+DEFAULT_CELL_M = 250.0
+
+# Radio terrestre de `haversine` y metros por grado de latitud que le corresponden
+_EARTH_R = 6_371_000.0
+_M_PER_DEG = npy.radians(1.0) * _EARTH_R
+
+# ============================================================================================
+# GRIDINDEX
+# ============================================================================================
+
+class GridIndex:
+    """
+    Índice espacial de rejilla uniforme sobre los puntos de una o varias rutas.
+
+    Los puntos se agrupan en celdas de ~`cell_m` metros y se ordenan por clave de celda
+    (`fila * n_columnas + columna`), de modo que cada fila de celdas es un tramo contiguo
+    del array ordenado. Las consultas por bbox y de vecinos más cercanos se resuelven con
+    unas pocas llamadas a `npy.searchsorted` y un filtrado exacto de los candidatos.
+
+    Parámetros
+    ----------
+    lat, lon : array-like
+        Coordenadas de todos los puntos (concatenadas si hay varias rutas).
+    track_offsets : array-like, opcional
+        Inicio de cada ruta dentro de `lat`/`lon` más el total final (formato CSR),
+        p. ej. `[0, n1, n1 + n2]`. Por defecto, una sola ruta.
+    track_names : list[str], opcional
+        Nombre de cada ruta (mismo orden que `track_offsets`).
+    cell_m : float, opcional
+        Lado de la celda en metros. Por defecto 250 m.
+
+    Notas
+    -----
+    - Los identificadores de punto que devuelven las consultas son posiciones globales
+    en los arrays originales; `locate()` los traduce a (ruta, índice dentro de la ruta).
+    - Se ignoran los puntos con lat/lon NaN.
+
+    Ejemplos
+    --------
+    >>> idx = GridIndex.from_tracks({"a.gpx": df_a, "b.gpx": df_b})  # doctest: +SKIP
+    >>> dist_m, ids = idx.nearest(43.26, -2.93, k=3)                # doctest: +SKIP
+    >>> idx.tracks_in_bbox(43.2, -3.0, 43.3, -2.9)                   # doctest: +SKIP
+    ['a.gpx']
+    """
+
+    def __init__(self, lat, lon, track_offsets=None, track_names=None, cell_m: float = DEFAULT_CELL_M):
+        self.lat = npy.ascontiguousarray(lat, dtype=float)
+        self.lon = npy.ascontiguousarray(lon, dtype=float)
+        n = len(self.lat)
+        self.track_offsets = npy.asarray([0, n] if track_offsets is None else track_offsets, dtype=npy.int64)
+        self.track_names = list(track_names) if track_names is not None else [str(i) for i in range(len(self.track_offsets) - 1)]
+        self.cell_m = float(cell_m)
+
+        valid = ~(npy.isnan(self.lat) | npy.isnan(self.lon))
+        if valid.any():
+            self.lat0, self.lon0 = float(self.lat[valid].min()), float(self.lon[valid].min())
+            mean_lat = float(npy.mean(self.lat[valid]))
+            self.dlat = self.cell_m / _M_PER_DEG
+            self.dlon = self.cell_m / (_M_PER_DEG * max(npy.cos(npy.radians(mean_lat)), 0.01))
+        else:
+            self.lat0 = self.lon0 = 0.0
+            self.dlat = self.dlon = 1.0
+
+        ids = npy.flatnonzero(valid)
+        iy, ix = self._cell(self.lat[ids], self.lon[ids])
+        self.n_cols = int(ix.max()) + 1 if len(ids) else 1
+        keys = iy * self.n_cols + ix
+        order = npy.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.ids = ids[order]
+
+    # CONSTRUCTORES ==========================================================================
+
+    @classmethod
+    def from_tracks(cls, tracks, cell_m: float = DEFAULT_CELL_M) -> "GridIndex":
+        """
+        Construye el índice a partir de un dict `{nombre: DataFrame}` (o lista de
+        DataFrames) con columnas 'lat' y 'lon'.
+        """
+        items = list(tracks.items()) if isinstance(tracks, dict) else list(enumerate(tracks))
+        names = [str(k) for k, _ in items]
+        lats = [df['lat'].to_numpy(dtype=float) for _, df in items]
+        lons = [df['lon'].to_numpy(dtype=float) for _, df in items]
+        offsets = npy.concatenate([[0], npy.cumsum([len(a) for a in lats])]).astype(npy.int64)
+        lat = npy.concatenate(lats) if lats else npy.zeros(0)
+        lon = npy.concatenate(lons) if lons else npy.zeros(0)
+        return cls(lat, lon, track_offsets=offsets, track_names=names, cell_m=cell_m)
+
+    # UTILIDADES =============================================================================
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _cell(self, lat, lon):
+        iy = npy.floor((npy.asarray(lat) - self.lat0) / self.dlat).astype(npy.int64)
+        ix = npy.floor((npy.asarray(lon) - self.lon0) / self.dlon).astype(npy.int64)
+        return iy, ix
+
+    def _covered_m(self, lat: float, ring: int) -> float:
+        """
+        Radio (m) alrededor de `lat` que cubren con certeza `ring` celdas completas a cada
+        lado: el menor de los lados, con el de longitud medido en la latitud más alejada
+        del ecuador del rectángulo explorado (donde las celdas son más estrechas).
+        """
+        far_lat = min(abs(lat) + (ring + 1) * self.dlat, 90.0)
+        return ring * _M_PER_DEG * min(self.dlat, self.dlon * npy.cos(npy.radians(far_lat)))
+
+    def _candidates(self, iy0: int, iy1: int, ix0: int, ix1: int) -> npy.ndarray:
+        """Ids de los puntos en el rectángulo de celdas [iy0, iy1] × [ix0, ix1]."""
+        ix0, ix1 = max(ix0, 0), min(ix1, self.n_cols - 1)
+        if ix0 > ix1 or iy1 < iy0:
+            return npy.zeros(0, dtype=npy.int64)
+        rows = npy.arange(iy0, iy1 + 1, dtype=npy.int64) * self.n_cols
+        lo = npy.searchsorted(self.keys, rows + ix0, side="left")
+        hi = npy.searchsorted(self.keys, rows + ix1, side="right")
+        lengths = hi - lo
+        total = int(lengths.sum())
+        if total == 0:
+            return npy.zeros(0, dtype=npy.int64)
+        # Concatenar los tramos [lo, hi) sin bucle en Python
+        starts = npy.repeat(lo - (npy.cumsum(lengths) - lengths), lengths)
+        return self.ids[starts + npy.arange(total)]
+
+    def locate(self, point_ids):
+        """
+        Traduce ids globales de punto a `(nombre_ruta, índice_en_ruta)`.
+        Acepta un entero o un array; con array devuelve dos arrays.
+        """
+        point_ids = npy.asarray(point_ids, dtype=npy.int64)
+        track = npy.searchsorted(self.track_offsets, point_ids, side="right") - 1
+        local = point_ids - self.track_offsets[track]
+        if point_ids.ndim == 0:
+            return self.track_names[int(track)], int(local)
+        return npy.asarray(self.track_names, dtype=object)[track], local
+
+    # CONSULTAS ==============================================================================
+
+    def bbox(self, lat_min: float, lon_min: float, lat_max: float, lon_max: float) -> npy.ndarray:
+        """Ids (ordenados) de todos los puntos dentro del bbox."""
+        iy0, ix0 = self._cell(lat_min, lon_min)
+        iy1, ix1 = self._cell(lat_max, lon_max)
+        cand = self._candidates(int(iy0), int(iy1), int(ix0), int(ix1))
+        inside = ((self.lat[cand] >= lat_min) & (self.lat[cand] <= lat_max) &
+                  (self.lon[cand] >= lon_min) & (self.lon[cand] <= lon_max))
+        return npy.sort(cand[inside])
+
+    def tracks_in_bbox(self, lat_min: float, lon_min: float, lat_max: float, lon_max: float) -> list[str]:
+        """Nombres de las rutas con al menos un punto dentro del bbox."""
+        ids = self.bbox(lat_min, lon_min, lat_max, lon_max)
+        tracks = npy.unique(npy.searchsorted(self.track_offsets, ids, side="right") - 1)
+        return [self.track_names[t] for t in tracks]
+
+    def nearest(self, lat: float, lon: float, k: int = 1, max_radius_m: float | None = None):
+        """
+        Los `k` puntos más cercanos a (lat, lon).
+
+        Se buscan candidatos en anillos de celdas crecientes hasta que la k-ésima
+        distancia queda cubierta por el radio explorado, así que el resultado es exacto.
+        Con `max_radius_m`, la búsqueda se detiene cuando el radio explorado lo cubre y
+        devuelve los que haya dentro (quizá menos de `k`).
+
+        Devuelve
+        --------
+        dist_m : numpy.ndarray
+            Distancias en metros, de menor a mayor (hasta `k` valores).
+        ids : numpy.ndarray
+            Ids globales de punto correspondientes.
+        """
+        if len(self.ids) == 0 or k <= 0:
+            return npy.zeros(0), npy.zeros(0, dtype=npy.int64)
+        k = min(int(k), len(self.ids))
+        iy, ix = (int(v) for v in self._cell(lat, lon))
+        n_rows = int(self.keys[-1] // self.n_cols) + 1
+        # distancia (en celdas) a la que está la rejilla si el punto cae fuera
+        ring = max(1, -iy, iy - n_rows + 1, -ix, ix - self.n_cols + 1)
+        max_ring = max(n_rows, self.n_cols) + ring
+        while True:
+            cand = self._candidates(iy - ring, iy + ring, ix - ring, ix + ring)
+            covered_m = self._covered_m(lat, ring)
+            # ya no puede aparecer nada más cerca: rejilla entera o radio máximo explorados
+            done = ring >= max_ring or (max_radius_m is not None and covered_m >= max_radius_m)
+            if len(cand) >= k or done:
+                d = haversine(lat, lon, self.lat[cand], self.lon[cand])
+                if max_radius_m is not None:
+                    keep = d <= max_radius_m
+                    d, cand = d[keep], cand[keep]
+                part = npy.argpartition(d, k - 1)[:k] if len(d) > k else npy.arange(len(d))
+                part = part[npy.argsort(d[part])]
+                if done or (len(part) == k and d[part[-1]] <= covered_m):
+                    return d[part], cand[part]
+            ring *= 2
+
+    def nearest_point(self, lat: float, lon: float, max_radius_m: float | None = None):
+        """
+        Atajo para el punto más cercano: devuelve `(nombre_ruta, índice_en_ruta, dist_m)`
+        o `None` si no hay puntos (o ninguno dentro de `max_radius_m`).
+        """
+        d, ids = self.nearest(lat, lon, k=1, max_radius_m=max_radius_m)
+        if len(ids) == 0:
+            return None
+        name, local = self.locate(int(ids[0]))
+        return name, local, float(d[0])
+
+    # SERIALIZACIÓN ==========================================================================
+
+    def save(self, path) -> None:
+        """Guarda el índice en un fichero `.npz` (junto a las rutas en caché)."""
+        npy.savez(
+            path,
+            lat=self.lat, lon=self.lon, keys=self.keys, ids=self.ids,
+            track_offsets=self.track_offsets, track_names=npy.asarray(self.track_names, dtype=str),
+            grid=npy.asarray([self.cell_m, self.lat0, self.lon0, self.dlat, self.dlon, self.n_cols], dtype=float),
+        )
+
+    @classmethod
+    def load(cls, path) -> "GridIndex":
+        """Carga un índice guardado con `save()` sin recalcular el ordenamiento."""
+        with npy.load(path, allow_pickle=False) as data:
+            cell_m, lat0, lon0, dlat, dlon, n_cols = data['grid']
+            index = cls.__new__(cls)
+            index.lat, index.lon = data['lat'], data['lon']
+            index.keys, index.ids = data['keys'], data['ids']
+            index.track_offsets = data['track_offsets']
+            index.track_names = [str(s) for s in data['track_names']]
+        index.cell_m, index.lat0, index.lon0 = float(cell_m), float(lat0), float(lon0)
+        index.dlat, index.dlon, index.n_cols = float(dlat), float(dlon), int(n_cols)
+        return index
@@ -0,0 +1,243 @@
+# ============================================================================================
+# THUMBNAILS.PY
+# ============================================================================================
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import inspect
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as npy
+import pandas as pd
+from PIL import Image, ImageDraw
+from .formatting import ROUTE_COLORS
+from .geo import mercator_px
+from .hashing import array_fingerprint
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+# Factor de sobremuestreo para el antialiasing (se dibuja a N× y se reduce)
+_SUPERSAMPLE = 3
+
+# Nº de tramos de color, igual que `ColorLine(nb_steps=12)` en `draw_route`
+_COLOR_STEPS = 12
+
+# Por debajo de este número de miniaturas pendientes no compensa arrancar procesos
+_MIN_PARALLEL = 16
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# _HEX_TO_RGB ================================================================================
+
+def _hex_to_rgb(hex_color: str):
+    hex_color = hex_color.lstrip("#")
+    return tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
+
+# _RAMP_COLORS ===============================================================================
+
+def _ramp_colors(n_steps: int):
+    """`n_steps` colores RGB muestreados de forma uniforme sobre `ROUTE_COLORS`."""
+    ramp = npy.array([_hex_to_rgb(c) for c in ROUTE_COLORS], dtype=float)
+    pos = npy.linspace(0, len(ramp) - 1, n_steps)
+    lo = npy.floor(pos).astype(int)
+    hi = npy.minimum(lo + 1, len(ramp) - 1)
+    frac = (pos - lo)[:, None]
+    return [tuple(int(v) for v in c) for c in ramp[lo] * (1 - frac) + ramp[hi] * frac]
+
+# _RENDER_ARRAYS =============================================================================
+
+def _render_arrays(lat, lon, values, size, color_hex, line_width, robust, background, padding) -> bytes:
+    """
+    Dibuja la polilínea (lat, lon) en un PNG de `size` píxeles. Si `values` no es None,
+    colorea cada tramo según su valor con la paleta `ROUTE_COLORS`.
+    Función de nivel de módulo para poder enviarse a un `ProcessPoolExecutor`.
+    """
+
+    width, height = size
+    ss = _SUPERSAMPLE
+    img = Image.new("RGBA", (width * ss, height * ss), background or (0, 0, 0, 0))
+    if len(lat) < 2:
+        buf = io.BytesIO()
+        img.reduce(ss).save(buf, format="PNG")
+        return buf.getvalue()
+
+    # Proyección Web Mercator y encaje (manteniendo la proporción) en el lienzo
+    x, y = mercator_px(lat, lon, 0)
+    w_px, h_px = float(npy.ptp(x)), float(npy.ptp(y))
+    scale = min((width - 2 * padding) * ss / max(w_px, 1e-12), (height - 2 * padding) * ss / max(h_px, 1e-12))
+    px = (x - x.min()) * scale + (width * ss - w_px * scale) / 2
+    py = (y - y.min()) * scale + (height * ss - h_px * scale) / 2
+    points = npy.column_stack([px, py])
+
+    draw = ImageDraw.Draw(img)
+    lw = max(1, int(round(line_width * ss)))
+    if values is None:
+        draw.line([tuple(p) for p in points], fill=_hex_to_rgb(color_hex), width=lw, joint="curve")
+    else:
+        values = npy.asarray(values, dtype=float)
+        finite = values[npy.isfinite(values)]
+        if finite.size == 0:
+            finite = npy.zeros(1)
+        vmin, vmax = npy.percentile(finite, [2, 98]) if robust else (finite.min(), finite.max())
+        seg_values = npy.nan_to_num((values[:-1] + values[1:]) / 2.0, nan=vmin)
+        norm = npy.clip((seg_values - vmin) / (vmax - vmin), 0, 1) if vmax > vmin else npy.zeros_like(seg_values)
+        bins = npy.minimum((norm * _COLOR_STEPS).astype(int), _COLOR_STEPS - 1)
+        colors = _ramp_colors(_COLOR_STEPS)
+        # Una polilínea por racha de tramos con el mismo color
+        breaks = npy.flatnonzero(npy.diff(bins)) + 1
+        for a, b in zip(npy.concatenate([[0], breaks]), npy.concatenate([breaks, [len(bins)]])):
+            draw.line([tuple(p) for p in points[a:b + 1]], fill=colors[bins[a]], width=lw, joint="curve")
+
+    buf = io.BytesIO()
+    img.reduce(ss).save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+# _THUMBNAIL_INPUTS ==========================================================================
+
+def _thumbnail_inputs(df: pd.DataFrame, mode: str, max_vertices: int):
+    """Extrae (y submuestrea) los arrays que necesita la miniatura."""
+    df = df.dropna(subset=['lat', 'lon'])
+    step = max(1, len(df) // max_vertices)
+    lat = df['lat'].to_numpy(dtype=float)[::step]
+    lon = df['lon'].to_numpy(dtype=float)[::step]
+    if mode == "Velocidad":
+        values = df['speed'].to_numpy(dtype=float)[::step] * 3.6
+    elif mode == "Altitud":
+        values = df['ele'].to_numpy(dtype=float)[::step]
+    else:
+        values = None
+    return lat, lon, values
+
+# _RENDER_ARGS ===============================================================================
+
+def _render_args(df, size, mode, color_hex, color_range_mode, line_width, background, padding) -> tuple:
+    """Argumentos de `_render_arrays` para los parámetros de `render_thumbnail`."""
+    lat, lon, values = _thumbnail_inputs(df, mode, max_vertices=4 * max(size))
+    robust = "robusto" in color_range_mode.lower()
+    return lat, lon, values, tuple(size), color_hex, line_width, robust, background, padding
+
+# RENDER_THUMBNAIL ===========================================================================
+
+def render_thumbnail(
+    df: pd.DataFrame,
+    size: tuple[int, int] = (240, 160),
+    mode: str = "Posición",
+    color_hex: str = "#1f77b4",
+    color_range_mode: str = "Min-Max (robusto)",
+    line_width: float = 2.0,
+    background=None,
+    padding: int = 8,
+) -> bytes:
+    """
+    Dibuja la ruta en una miniatura PNG sin mapa base ni descarga de teselas.
+
+    Parámetros
+    ----------
+    df : pandas.DataFrame
+        Puntos del track con 'lat' y 'lon' (y 'speed'/'ele' para los modos coloreados).
+    size : (int, int), opcional
+        Ancho y alto en píxeles. Por defecto 240×160.
+    mode : str, opcional
+        "Posición" (color único), "Velocidad" o "Altitud" (paleta de `draw_route`).
+    color_hex : str, opcional
+        Color de la línea en modo "Posición".
+    color_range_mode : str, opcional
+        "Min–Max" o "Min-Max (robusto)" (P2–P98), como en el mapa.
+    line_width : float, opcional
+        Grosor de la línea en píxeles.
+    background : tuple RGBA, opcional
+        Color de fondo. Por defecto, transparente.
+    padding : int, opcional
+        Margen en píxeles alrededor de la ruta.
+
+    Devuelve
+    --------
+    bytes
+        Imagen PNG.
+
+    Notas
+    -----
+    - La ruta se submuestrea a unos pocos vértices por píxel, así que el coste no depende
+    de la longitud del track.
+    - Se dibuja sobremuestreada (×3) y se reduce promediando bloques para suavizar los bordes.
+    """
+
+    return _render_arrays(*_render_args(df, size, mode, color_hex, color_range_mode, line_width,
+                                        background, padding))
+
+# RENDER_THUMBNAILS ==========================================================================
+
+def render_thumbnails(tracks: dict, cache_dir: str | None = None, workers: int | None = None, **kwargs) -> dict:
+    """
+    Genera las miniaturas de varias actividades en lote.
+
+    Parámetros
+    ----------
+    tracks : dict[str, pandas.DataFrame]
+        Actividades por nombre.
+    cache_dir : str, opcional
+        Directorio de caché en disco. Cada PNG se guarda con la huella de la ruta y de
+        los parámetros de dibujo, así que solo se redibuja lo que ha cambiado.
+    workers : int, opcional
+        Procesos para dibujar en paralelo. Por defecto, `os.cpu_count()`. Con pocas
+        miniaturas pendientes (o `workers <= 1`) se dibuja en el propio proceso.
+    **kwargs
+        Parámetros de `render_thumbnail` (size, mode, color_hex, …), con sus mismos valores
+        por defecto. Un parámetro desconocido da TypeError.
+
+    Devuelve
+    --------
+    dict[str, bytes]
+        PNG por nombre de actividad, en el mismo orden que `tracks`.
+    """
+
+    # los parámetros se validan y completan con la firma de `render_thumbnail` (un nombre
+    # mal escrito da TypeError en vez de dibujar con los valores por defecto)
+    bound = inspect.signature(render_thumbnail).bind(None, **kwargs)
+    bound.apply_defaults()
+    params = {k: v for k, v in bound.arguments.items() if k != "df"}
+
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    results, pending = {}, {}
+    for name, df in tracks.items():
+        args = _render_args(df, **params)
+        lat, lon, values = args[:3]
+        path = None
+        if cache_dir:
+            key = array_fingerprint(lat, lon, *(() if values is None else (values,)),
+                                    extra=tuple(params.items()))
+            path = os.path.join(cache_dir, f"{key}.png")
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    results[name] = f.read()
+                continue
+        pending[name] = (args, path)
+
+    workers = os.cpu_count() if workers is None else workers
+    if len(pending) >= _MIN_PARALLEL and workers and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {name: pool.submit(_render_arrays, *args) for name, (args, _) in pending.items()}
+            rendered = {name: fut.result() for name, fut in futures.items()}
+    else:
+        rendered = {name: _render_arrays(*args) for name, (args, _) in pending.items()}
+
+    for name, png in rendered.items():
+        path = pending[name][1]
+        if path:
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(png)
+            os.replace(tmp, path)
+        results[name] = png
+
+    return {name: results[name] for name in tracks}
@@ -0,0 +1,387 @@
+# ============================================================================================
+# TRACK.PY
+# ============================================================================================
+
+# ============================================================================================
+# LIBRERÍAS
+# ============================================================================================
+
+from __future__ import annotations
+import json
+import threading
+import numpy as npy
+import pandas as pd
+
+# ============================================================================================
+# CONFIGURACIÓN
+# ============================================================================================
+
+# Modo compacto: columnas que se guardan en float32 (altitud, velocidad y sensores no
+# necesitan la precisión de float64; 'd_dist' y 'dt' se suman, así que siguen en float64)
+FLOAT32_COLUMNS = ('ele', 'speed', 'hr', 'cad')
+
+# Sensores enteros: se guardan como uint8/uint16 y una máscara de valores presentes
+SENSOR_COLUMNS = ('hr', 'cad')
+
+# Tolerancia al comprobar que una columna derivada reproduce la original
+_DERIVE_RTOL, _DERIVE_ATOL = 1e-6, 1e-6
+
+# ============================================================================================
+# FUNCIONES
+# ============================================================================================
+
+# _FREEZE ====================================================================================
+
+def _freeze(values):
+    """Marca como solo lectura el buffer de una columna (array de NumPy o de fechas)."""
+    if isinstance(values, npy.ndarray):
+        values.flags.writeable = False
+    else:
+        # DatetimeArray con zona horaria: `to_numpy` en datetime64[ns] (UTC) devuelve su buffer
+        values.to_numpy(dtype='datetime64[ns]').flags.writeable = False
+    return values
+
+# _COLUMN_VALUES =============================================================================
+
+def _column_values(series: pd.Series):
+    """Copia propia (contigua) de una columna; las de objetos sin datos pasan a float NaN."""
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        return series.array.copy()
+    values = series.to_numpy()
+    if values.dtype == object:
+        try:
+            values = series.to_numpy(dtype=float, na_value=npy.nan)
+        except (TypeError, ValueError):
+            pass
+    return npy.array(values, copy=True)
+
+# _SECONDS ===================================================================================
+
+def _seconds(time) -> npy.ndarray:
+    """Marcas de tiempo como segundos (float64, NaN donde falten); error si no son fechas."""
+    if isinstance(time, pd.arrays.DatetimeArray):
+        time = time.to_numpy(dtype='datetime64[ns]')
+    if not npy.issubdtype(time.dtype, npy.datetime64):
+        raise TypeError("'time' no es una columna de fechas")
+    ns = time.astype('datetime64[ns]').view('int64').astype(float)
+    ns[npy.isnat(time)] = npy.nan
+    return ns / 1e9
+
+# COLUMNAS DERIVADAS =========================================================================
+#
+# En modo compacto no se guardan: se recalculan al pedirlas a partir de las almacenadas.
+# Cada entrada es (columnas de las que depende, función(track) -> float64/int64).
+
+def _derive_d_dist(track) -> npy.ndarray:
+    return npy.diff(track['dist'], prepend=track['dist'][:1])
+
+def _derive_dt(track) -> npy.ndarray:
+    dt = npy.diff(_seconds(track['time']), prepend=npy.nan)
+    return npy.nan_to_num(dt, nan=0.0)
+
+def _derive_speed(track) -> npy.ndarray:
+    d_dist, dt = _derive_d_dist(track), _derive_dt(track)
+    return npy.divide(d_dist, dt, out=npy.zeros_like(d_dist), where=dt > 0)
+
+DERIVED_COLUMNS = {
+    'd_dist': (('dist',), _derive_d_dist),
+    'dt': (('time',), _derive_dt),
+    'speed': (('dist', 'time'), _derive_speed),
+    'km': (('dist',), lambda t: t['dist'] / 1000.0),
+    'split': (('dist',), lambda t: npy.floor(t['dist'] / 1000.0 / 5).astype(int)),
+}
+
+# _COMPACT_VALUES ============================================================================
+
+def _compact_values(name: str, values):
+    """
+    Versión compacta de una columna: `(valores, máscara)`. La máscara (True = dato presente)
+    solo existe para sensores con huecos; un sensor sin ningún dato devuelve `(None, None)`.
+    """
+    if not isinstance(values, npy.ndarray) or values.dtype.kind not in "fiu":
+        return values, None
+    if name in SENSOR_COLUMNS:
+        valid = ~npy.isnan(values) if values.dtype.kind == "f" else npy.ones(len(values), dtype=bool)
+        if not valid.any():
+            return None, None
+        present = values[valid]
+        if npy.all(present == npy.round(present)) and present.min() >= 0 and present.max() <= 65535:
+            out = npy.zeros(len(values), dtype=npy.uint8 if present.max() <= 255 else npy.uint16)
+            out[valid] = present
+            return out, (None if valid.all() else valid)
+    if name in FLOAT32_COLUMNS and values.dtype != npy.float32:
+        return values.astype(npy.float32), None
+    return values, None
+
+# ============================================================================================
+# TRACK
+# ============================================================================================
+
+class Track:
+    """
+    Puntos de una actividad guardados por columnas, en arrays de NumPy de solo lectura.
+
+    Es la forma compacta y compartible de un DataFrame de puntos (`parse_gpx`,
+    `compute_metrics`): no tiene índice ni bloques consolidados, así que varias sesiones
+    pueden trabajar sobre el mismo `Track` sin copiar nada.
+
+    Parámetros
+    ----------
+    columns : dict[str, array-like]
+        Columnas por nombre, todas de la misma longitud. 'time' puede ser un
+        `DatetimeArray` con zona horaria.
+    masks, derived, names, compact : opcionales
+        Estado del modo compacto (máscaras de sensores, columnas derivadas, orden de las
+        columnas y si lo es); normalmente los fija `from_frame(df, compact=True)`.
+    attrs : dict, opcional
+        Metadatos del DataFrame de origen (`df.attrs`, p. ej. 'segment_offsets'), que
+        `to_frame()` restaura.
+
+    Notas
+    -----
+    - Los arrays se marcan como no escribibles: cualquier escritura in situ (también a
+    través de `to_frame()`) lanza `ValueError`.
+    - `to_frame()` no copia: devuelve un DataFrame con `RangeIndex` cuyas columnas son
+    vistas de las del `Track`. Para modificarlo, usar `df.copy()` (como hace
+    `compute_metrics`).
+    - `from_frame(df, compact=True)` activa el modo de memoria reducida (tipos pequeños,
+    sensores con máscara y columnas derivadas bajo demanda); ver `memory_report()`.
+    - En modo compacto, las columnas derivadas y los sensores en float32 se calculan la
+    primera vez que se piden y se guardan en el propio `Track` (bajo un cerrojo): todas
+    las sesiones que comparten el `Track` reciben los mismos arrays, sin copias propias.
+    `materialize()` los calcula todos de una vez (antes de meterlo en la caché compartida,
+    para que cuente su tamaño).
+
+    Ejemplos
+    --------
+    >>> track = Track.from_frame(parse_gpx(f))   # doctest: +SKIP
+    >>> track.nbytes                             # doctest: +SKIP
+    >>> df = track.to_frame()                    # doctest: +SKIP
+    >>> Track.from_frame(df_proc, compact=True)  # doctest: +SKIP
+    """
+
+    def __init__(self, columns: dict, masks: dict | None = None, derived=(), names=None,
+                 compact: bool = False, attrs: dict | None = None):
+        self.columns = {name: _freeze(values) for name, values in columns.items()}
+        self.masks = {name: _freeze(mask) for name, mask in (masks or {}).items()}
+        self.derived = tuple(derived)
+        self.names = tuple(names) if names is not None else (*self.columns, *self.derived)
+        self.compact = bool(compact)
+        self.attrs = dict(attrs or {})
+        self._views = {}                       # derivadas / sensores en float32 ya calculados
+        self._views_lock = threading.RLock()
+        lengths = {len(v) for v in (*self.columns.values(), *self.masks.values())}
+        if len(lengths) > 1:
+            raise ValueError(f"Las columnas de un Track deben tener la misma longitud: {sorted(lengths)}")
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, compact: bool = False) -> "Track":
+        """
+        Construye un `Track` con una copia propia de cada columna de `df` (se descarta el índice).
+
+        Con `compact=True` (modo de memoria reducida):
+
+        - 'ele', 'speed' y los sensores se guardan en float32;
+        - 'hr'/'cad' enteros, como uint8/uint16 más una máscara (solo si hay huecos); un
+        sensor sin ningún dato no se guarda;
+        - 'd_dist', 'dt', 'speed', 'km' y 'split' no se guardan si se pueden reconstruir a
+        partir de 'dist' y 'time' (se comprueba): se calculan al pedirlas.
+        """
+        if not compact:
+            return cls({name: _column_values(df[name]) for name in df.columns}, attrs=df.attrs)
+
+        stored = {name: _column_values(df[name]) for name in df.columns if name not in DERIVED_COLUMNS}
+        base = cls(stored)
+        columns, masks, derived, names = {}, {}, [], []
+        for name in df.columns:
+            if name in DERIVED_COLUMNS:
+                if base._derivable(name, df[name]):
+                    derived.append(name)
+                    names.append(name)
+                    continue
+                values = _column_values(df[name])
+            else:
+                values = stored[name]
+            values, mask = _compact_values(name, values)
+            if values is None:
+                continue
+            columns[name] = values
+            if mask is not None:
+                masks[name] = mask
+            names.append(name)
+        return cls(columns, masks, derived, names, compact=True, attrs=df.attrs)
+
+    def _derivable(self, name: str, series: pd.Series) -> bool:
+        """True si `name` se reconstruye a partir de las columnas guardadas igual que `series`."""
+        needs, _ = DERIVED_COLUMNS[name]
+        if not set(needs) <= set(self.columns):
+            return False
+        try:
+            rebuilt = self._derive(name)
+            original = series.to_numpy(dtype=float, na_value=npy.nan)
+        except (TypeError, ValueError):
+            return False
+        return bool(npy.allclose(rebuilt, original, rtol=_DERIVE_RTOL, atol=_DERIVE_ATOL, equal_nan=True))
+
+    def _derive(self, name: str) -> npy.ndarray:
+        return DERIVED_COLUMNS[name][1](self)
+
+    def with_columns(self, **columns) -> "Track":
+        """
+        Nuevo `Track` con las columnas de este (compartidas, sin copiar) más `columns`.
+        Si este `Track` es compacto, las nuevas también: se compactan o, si se pueden
+        reconstruir, pasan a ser derivadas.
+        """
+        stored, masks = dict(self.columns), dict(self.masks)
+        derived = [n for n in self.derived if n not in columns]
+        names = [n for n in self.names if n not in columns]
+        for name, values in columns.items():
+            series = values if isinstance(values, pd.Series) else pd.Series(values)
+            stored.pop(name, None)
+            masks.pop(name, None)
+            names.append(name)
+            if self.compact and name in DERIVED_COLUMNS and Track(stored)._derivable(name, series):
+                derived.append(name)
+                continue
+            values, mask = _column_values(series), None
+            if self.compact:
+                values, mask = _compact_values(name, values)
+                if values is None:
+                    names.pop()
+                    continue
+            stored[name] = values
+            if mask is not None:
+                masks[name] = mask
+        track = Track(stored, masks, derived, names, compact=self.compact, attrs=self.attrs)
+        # las columnas ya calculadas que no dependen de las nuevas siguen valiendo
+        with self._views_lock:
+            track._views = {name: values for name, values in self._views.items()
+                            if name not in columns and name in track
+                            and not set(DERIVED_COLUMNS.get(name, ((),))[0]) & set(columns)}
+        return track
+
+    def materialize(self) -> "Track":
+        """Calcula y guarda ya todas las columnas derivadas y de sensores compactos."""
+        for name in self.names:
+            self[name]
+        return self
+
+    def to_frame(self, columns=None) -> pd.DataFrame:
+        """
+        DataFrame con las columnas (todas o las de `columns`). Las guardadas tal cual son
+        vistas de solo lectura (sin copias); los sensores compactos se devuelven en float32
+        con NaN y las derivadas se calculan en el momento.
+        """
+        names = self.names if columns is None else [n for n in columns if n in self]
+        df = pd.DataFrame({name: self[name] for name in names}, index=pd.RangeIndex(len(self)), copy=False)
+        df.attrs = dict(self.attrs)
+        return df
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def __getitem__(self, name: str):
+        if name not in self.derived:
+            values = self.columns[name]
+            if not (values.dtype.kind == "u" and name in SENSOR_COLUMNS):
+                return values
+        values = self._views.get(name)
+        if values is None:
+            with self._views_lock:
+                values = self._views.get(name)
+                if values is None:
+                    values = self._views[name] = _freeze(self._thaw(name))
+        return values
+
+    def _thaw(self, name: str) -> npy.ndarray:
+        """Columna derivada o sensor compacto como array completo (float32 con NaN)."""
+        if name in self.derived:
+            values = self._derive(name)
+            return values.astype(npy.float32) if name in FLOAT32_COLUMNS else values
+        values = self.columns[name].astype(npy.float32)
+        if name in self.masks:
+            values[~self.masks[name]] = npy.nan
+        return values
+
+    def arrays(self) -> list:
+        """Todos los arrays que retiene: columnas, máscaras y columnas ya calculadas."""
+        with self._views_lock:
+            return [*self.columns.values(), *self.masks.values(), *self._views.values()]
+
+    def __getstate__(self):
+        # el cerrojo no se serializa y las columnas calculadas se rehacen al pedirlas
+        state = dict(self.__dict__)
+        del state['_views_lock']
+        state['_views'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._views_lock = threading.RLock()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names
+
+    @property
+    def nbytes(self) -> int:
+        """Memoria ocupada por los datos guardados (columnas y máscaras, bytes; sin las ya calculadas)."""
+        return int(sum(v.nbytes for v in (*self.columns.values(), *self.masks.values())))
+
+    def memory_report(self) -> pd.DataFrame:
+        """
+        Memoria por columna: tipo guardado, cómo se guarda ('completa', 'con máscara' o
+        'derivada', que no ocupa) y bytes (incluida la máscara) totales y por punto.
+
+        Ejemplos
+        --------
+        >>> Track.from_frame(df_proc, compact=True).memory_report()   # doctest: +SKIP
+        """
+        rows = []
+        for name in self.names:
+            if name in self.derived:
+                rows.append((name, "-", "derivada", 0))
+                continue
+            values = self.columns[name]
+            nbytes = values.nbytes + (self.masks[name].nbytes if name in self.masks else 0)
+            rows.append((name, str(values.dtype), "con máscara" if name in self.masks else "completa", nbytes))
+        report = pd.DataFrame(rows, columns=['column', 'dtype', 'storage', 'bytes'])
+        report['bytes_per_point'] = report['bytes'] / max(1, len(self))
+        return report
+
+    # SERIALIZACIÓN ==========================================================================
+
+    def save(self, path) -> None:
+        """
+        Guarda el `Track` tal cual (tipos compactos, máscaras y columnas derivadas incluidos)
+        en un fichero `.npz` sin comprimir; `Track.load` lo recupera sin recalcular nada.
+        """
+        arrays, meta = {}, {'names': list(self.names), 'derived': list(self.derived),
+                            'compact': self.compact, 'attrs': self.attrs, 'tz': {}}
+        for name, values in self.columns.items():
+            if not isinstance(values, npy.ndarray):
+                meta['tz'][name] = str(values.tz)
+                values = values.to_numpy(dtype='datetime64[ns]')
+            arrays[f"c_{name}"] = values
+        for name, mask in self.masks.items():
+            arrays[f"m_{name}"] = mask
+        arrays['meta'] = npy.asarray(json.dumps(meta, default=list))
+        npy.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path) -> "Track":
+        """Carga un `Track` guardado con `save()`."""
+        with npy.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            columns = {key[2:]: data[key] for key in data.files if key.startswith("c_")}
+            masks = {key[2:]: data[key] for key in data.files if key.startswith("m_")}
+        for name, tz in meta['tz'].items():
+            # se guardaron en UTC: se leen como tales y se pasan a su zona horaria
+            columns[name] = pd.array(columns[name], dtype=pd.DatetimeTZDtype(tz="UTC")).tz_convert(tz)
+        attrs = meta['attrs']
+        if 'segment_offsets' in attrs:
+            attrs['segment_offsets'] = tuple(attrs['segment_offsets'])
+        return cls(columns, masks, meta['derived'], meta['names'], compact=meta['compact'], attrs=attrs)
+
+    def __repr__(self) -> str:
+        mode = ", compacto" if self.compact else ""
+        return f"Track({len(self)} puntos, {len(self.names)} columnas, {self.nbytes / 1e6:.1f} MB{mode})"